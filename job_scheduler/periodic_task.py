@@ -14,4 +14,8 @@ periodic_tasks = {
         "task": "Sync_PipeLineBlockSpecification",
         "schedule": crontab(minute="*/10"),  # Execute every 10 minutes.
     },
+    "c_rollup_sensorreadings": {
+        "task": "Rollup_SensorReadings",
+        "schedule": crontab(minute="*/15"),  # Execute every 15 minutes.
+    },
 }
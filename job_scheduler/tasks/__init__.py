@@ -2,6 +2,9 @@
 # Contact: Simon Cramer, s.cramer@wzl-mq.rwth-aachen.de
 
 from .create_dataframe import CreateDataframe
+from .merge_dataframe_partitions import MergeDataframePartitions
+from .rollup_sensorreadings import RollupSensorReadings
+from .progress import BuildProgress, BuildCancelled
 from .update_argo_pipeline_status import UpdateMachineLearningRun
 from .sync_piplineblockspecification import SyncPipeLineBlockSpecification
 from .import_fixtures import c_import_fixtures
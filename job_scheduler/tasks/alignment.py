@@ -0,0 +1,60 @@
+# Copyright (c) 2022 RWTH Aachen - Werkzeugmaschinenlabor (WZL)
+# Contact: Simon Cramer, s.cramer@wzl-mq.rwth-aachen.de
+
+import numpy as np
+
+
+class IdAlignment:
+    """Maps ids, e.g. product ids or feature ids, to their positions in a given order with a sorted index array.
+    Build it once and reuse it for all arrays that have to be aligned to the same order.
+    """
+
+    def __init__(self, ids):
+        """
+        Args:
+            ids (array-like): Unique ids in the target order.
+        """
+        self.ids = np.asarray(ids)
+        self.sorter = np.argsort(self.ids, kind="stable")
+        self.sorted_ids = self.ids[self.sorter]
+
+    def __len__(self):
+        return self.ids.shape[0]
+
+    def positions(self, ids):
+        """Positions of ids in the target order.
+
+        Args:
+            ids (array-like): Ids to look up, may contain ids that are not part of the target order.
+
+        Returns:
+            [np.ndarray]: int64 positions, -1 for unknown ids.
+        """
+        ids = np.asarray(ids)
+        if self.sorted_ids.shape[0] == 0:
+            return np.full(ids.shape[0], -1, dtype=np.int64)
+        index = np.minimum(np.searchsorted(self.sorted_ids, ids), self.sorted_ids.shape[0] - 1)
+        found = self.sorted_ids[index] == ids
+
+        return np.where(found, self.sorter[index], -1).astype(np.int64)
+
+    def align(self, row_ids, column_ids, values, columns):
+        """Scatter values into a (len(self), len(columns) * n_values) array. Missing combinations are NaN, rows with unknown ids are ignored.
+
+        Args:
+            row_ids (np.ndarray): Ids of the rows of the values, aligned to this alignment.
+            column_ids (np.ndarray): Ids of the column blocks of the values, aligned to columns.
+            values (np.ndarray): float64 array with shape (len(row_ids), n_values).
+            columns (IdAlignment): Alignment of the column blocks, each block has n_values columns.
+
+        Returns:
+            [np.ndarray]: float64 array with shape (len(self), len(columns) * n_values).
+        """
+        n_values = values.shape[1]
+        result = np.full((len(self), len(columns) * n_values), np.nan)
+        rows = self.positions(row_ids)
+        blocks = columns.positions(column_ids)
+        known = (rows >= 0) & (blocks >= 0)
+        result[rows[known, None], blocks[known, None] * n_values + np.arange(n_values)] = values[known]
+
+        return result
@@ -0,0 +1,111 @@
+# Copyright (c) 2022 RWTH Aachen - Werkzeugmaschinenlabor (WZL)
+# Contact: Simon Cramer, s.cramer@wzl-mq.rwth-aachen.de
+
+import json
+
+import pandas as pd
+
+from smart_open import open as smart_open
+
+
+class BuildCheckpoint:
+    """Checkpoints of the completed parts of a dataframe build at the save_path, e.g. the feature dataframe of the processparameters.
+    The manifest stores the key (configuration fingerprint) of the build, the selected product ids and the names of the completed parts and their files.
+    A re-submitted build resumes from the checkpoints when the manifest was written by a build with the same key, new sensorreadings or products do not change the key.
+    """
+    manifest_filename = "manifest.json"
+
+    def __init__(self, artifacts, key, prefix="checkpoints/"):
+        """
+        Args:
+            artifacts (DataFrameArtifacts): Artifacts of the dataframe, defines the save_path.
+            key (str): Configuration fingerprint of the build.
+            prefix (str, optional): Directory of the checkpoints relative to the save_path. Defaults to "checkpoints/".
+        """
+        self.artifacts = artifacts
+        self.key = key
+        self.prefix = prefix
+        self.manifest = {"key": key, "product_ids": None, "product_high_water_mark": None, "completed": [], "files": []}
+        self.resumed = False
+
+    def path(self, filename):
+        """Path of a checkpoint file at the save_path."""
+        return self.artifacts.path(self.prefix + filename)
+
+    def open(self):
+        """Read the manifest of a previous build. A new manifest is written when there is none or it belongs to another build.
+
+        Returns:
+            [bool]: Whether the build resumes from the checkpoints of a previous build.
+        """
+        try:
+            with smart_open(self.path(self.manifest_filename), 'r') as f:
+                manifest = json.load(f)
+        except (OSError, ValueError):
+            manifest = None
+
+        if manifest is not None and manifest.get("key") == self.key:
+            self.manifest = manifest
+            self.resumed = True
+        else:
+            self.write_manifest()
+
+        return self.resumed
+
+    def write_manifest(self):
+        """Write the manifest to the checkpoint directory."""
+        with smart_open(self.path(self.manifest_filename), 'w') as f:
+            json.dump(self.manifest, f)
+
+    @property
+    def product_ids(self):
+        """Product ids that were selected by the checkpointed build, None if they were not stored yet."""
+        return self.manifest["product_ids"]
+
+    def save_product_ids(self, product_ids, product_high_water_mark=None):
+        """Store the selected product ids, so that a resumed build uses the same (random) products.
+
+        Args:
+            product_ids (np.ndarray): Selected product ids in the order of the build.
+            product_high_water_mark (int, optional): Highest product id that was considered by the selection. Defaults to None.
+        """
+        self.manifest["product_ids"] = [int(product_id) for product_id in product_ids]
+        self.manifest["product_high_water_mark"] = product_high_water_mark
+        self.write_manifest()
+
+    def is_completed(self, name):
+        """Whether the part was completed by this or a previous build with the same key."""
+        return name in self.manifest["completed"]
+
+    def load(self, name):
+        """Load the dataframe of a completed part.
+
+        Args:
+            name (str): Name of the part.
+
+        Returns:
+            [pd.DataFrame or None]: Dataframe of the part or None if the part was saved without dataframe.
+        """
+        if name + ".pkl" not in self.manifest["files"]:
+            return None
+        with smart_open(self.path(name + ".pkl"), 'rb') as f:
+            return pd.read_pickle(f)
+
+    def save(self, name, dataframe=None):
+        """Mark a part as completed and save its dataframe. The manifest is written after the dataframe, so incomplete files are never loaded.
+
+        Args:
+            name (str): Name of the part.
+            dataframe (pd.DataFrame, optional): Dataframe of the part. Parts that were written to their final file are saved without dataframe. Defaults to None.
+        """
+        if dataframe is not None:
+            with smart_open(self.path(name + ".pkl"), 'wb') as f:
+                dataframe.to_pickle(f)
+            self.manifest["files"].append(name + ".pkl")
+        self.manifest["completed"].append(name)
+        self.write_manifest()
+
+    def clear(self):
+        """Invalidate the checkpoints after the build succeeded. The checkpoint files are overwritten by the next build."""
+        self.manifest = {"key": None, "product_ids": None, "product_high_water_mark": None, "completed": [], "files": []}
+        self.write_manifest()
@@ -1,29 +1,51 @@
 # Copyright (c) 2022 RWTH Aachen - Werkzeugmaschinenlabor (WZL)
 # Contact: Simon Cramer, s.cramer@wzl-mq.rwth-aachen.de
 
-from orakel.models import DataFrame, Product, ProcessStep, ProcessStepSpecification, SensorReading
+from orakel.models import DataFrame, DataFramePartition, Product, ProcessStep, ProcessStepSpecification, SensorReading, SensorReadingSummary
 
-from celery import Task
+from celery import Task, chord, group
+from celery.utils.log import get_task_logger
 from job_scheduler import job_scheduler
+from .merge_dataframe_partitions import MergeDataframePartitions
+from .feature_statistics import segment_methods, segment_starts, segment_statistics
+from .dataframe_artifacts import DataFrameArtifacts
+from .instrumentation import Instrumentation
+from .progress import BuildProgress, BuildCancelled
+from .checkpoints import BuildCheckpoint
+from .alignment import IdAlignment
 
 import pandas as pd
 import numpy as np
 
-from django.db.models import Min, Max, Avg, StdDev, When, Case, IntegerField, Value
+from django.conf import settings
+from django.db import connections
+from django.utils import timezone
+from django.db.models import Min, Max, Avg, StdDev, Variance, Count, F, Exists, OuterRef, Value, ExpressionWrapper, FloatField
+from django.db.models.functions import Mod
 from django.core.exceptions import ValidationError
 
 from s3_smart_open import to_pd_fth
+from smart_open import open as smart_open
+from more_itertools import chunked
 
+import pyarrow as pa
 from pyarrow import feather  # Avoid local import error of s3_smart_open
 
 import time
+import json
+import shutil
+import hashlib
+from itertools import chain
+
+
+logger = get_task_logger(__name__)
 
 
 class CreateDataframe(Task):
     """Celery task to create a pandas DataFrame from SensorReading instances.
 
     Raises:
-        ValidationError: When methods_per_feature values are not one of [Min,Max,Avg,StdDev]
+        ValidationError: When methods_per_feature values are not one of feature_statistics.segment_methods or StackedDataFrame
 
     Returns:
         [Exception]: Returns Exception Message if an error occurs.
@@ -32,25 +54,42 @@ class CreateDataframe(Task):
     ignore_result = False # Will save the return value / Task result in the database.
     decription = "Create a pandas DataFrame from sensorreadings."
     queue = "large_task"
+    # Maximum amount of product ids per query.
+    product_chunk_size = 10000
+    # Rows per chunk when partitions stream timeseries without a streaming_chunk_size of the dataframe.
+    default_streaming_chunk_size = 100000
+    # Compute the summary_methods from the SensorReadingSummary instances instead of the sensorreadings. Products without summaries fall back to their sensorreadings.
+    use_sensorreading_summary = settings.DATAFRAME_USE_SENSORREADING_SUMMARY
+    summary_methods = ["Min", "Max", "Avg", "StdDev", "Count", "Range", "RMS"]
+    # Dataframes of a build, saved as files at the save_path.
+    artifact_names = ("x", "y")
+    # Statuses of a build that partitions do not leave.
+    terminal_statuses = ("Failed", "Cancelled")
 
     # Use .using(self.db) for every queryset!
 
-    def __call__(self, pk, database_name, methods_per_feature , product_ids=None,*args, **kwargs):
+    def __call__(self, pk, database_name, methods_per_feature , product_ids=None, partition=None, refresh=False, *args, **kwargs):
         """Set initial values and call the run method.
 
         Args:
             pk (int): pirmary key of the dataframe instance.
             database_name (str): Name of the database where the dataframe object is stored
             methods_per_feature (list[str]: Methods that are applied on the features.
+            product_ids (list[int], optional): Product ids to use instead of selecting them from the dataframe relations.
+            partition (int, optional): Index of the DataFramePartition that is built by this task. Partitions save partial dataframes only.
+            refresh (bool, optional): Only build the products that were added since the last successful build and append them to its files.
+                Products that a complete build would not select anymore are dropped. Defaults to False.
 
         Raises:
-            ValidationError: If methods_per_feature elements are implemented / not in decode_methods_per_feature.keys().
+            ValidationError: If methods_per_feature elements are not implemented / not in feature_statistics.segment_methods.
 
         Returns:
             [None or errors]: returns result from the run method
         """
         self.pk = pk
         self.db = database_name
+        self.partition = partition
+        self.refresh = refresh
         # Wethere to create a dataframe to check the correctness of the method. The process can take a very long time!
         self.validate_processparameter_df = False
         self.decode_methods_per_feature = { "Min": Min('value'),
@@ -64,40 +103,580 @@ class CreateDataframe(Task):
             if method == "StackedDataFrame":
                 self.tsfresh_bool = True
                 break
-            elif method not in self.decode_methods_per_feature.keys():
+            elif method not in segment_methods:
                 DataFrame.objects.using(self.db).filter(pk=self.pk).update(**{"status": "Failed"})
-                raise ValidationError("Provided Method is None of {}".format(self.decode_methods_per_feature.keys()))
+                raise ValidationError("Provided Method is None of {}".format(segment_methods))
         # Only apply each method one time per feature
-        self.methods_per_feature = set(methods_per_feature)
+        self.methods_per_feature = list(dict.fromkeys(methods_per_feature))
 
         return self.run(product_ids=product_ids, *args, **kwargs)
 
+    def query_products(self, df):
+        """Query the products of the productspecification of the dataframe that have a processstep of its processstepspecifications.
+        The processsteps are checked with EXISTS, so the products are not joined with all their processsteps.
+
+        Args:
+            df (DataFrame): Dataframe instance.
+
+        Returns:
+            [QuerySet]: Product instances without ordering.
+        """
+        processsteps = ProcessStep.objects.using(self.db).filter(product=OuterRef('pk'), processstepspecification__in=df.processstepspecification.all())
+        return Product.objects.using(self.db).filter(Exists(processsteps), productspecification=df.productspecification_id).order_by()
+
+    @staticmethod
+    def product_sample_key(seed, field="pk"):
+        """Expression that orders the product ids pseudo-randomly by a seeded multiplicative hash, which is computed by the database.
+        ((id mod 2**31) * multiplier + offset) mod 2**31 is a permutation of the ids below 2**31 for an odd multiplier, the first product_amount ids are the sample.
+        The id is reduced before the multiplication and the multiplier is below 2**22, so the intermediate values stay below 2**53. They neither overflow a signed BIGINT
+        nor lose precision in the floating point MOD of SQLite. Larger ids share the keys of smaller ids, the ties are ordered by id.
+
+        Args:
+            seed (int): Seed of the sample.
+            field (str, optional): Name of the id field or annotation. Defaults to "pk".
+
+        Returns:
+            [Expression]: Sort key of the products.
+        """
+        rng = np.random.default_rng(seed)
+        multiplier = int(rng.integers(2**16, 2**22 - 1)) | 1
+        offset = int(rng.integers(0, 2**31))
+        return Mod(Mod(F(field), Value(2**31)) * Value(multiplier) + Value(offset), Value(2**31))
+
+    def product_id_chunks(self):
+        """Split self.product_ids into ascending chunks of at most self.product_chunk_size ids.
+        Keeps the size of the IN clauses of the generated queries independent of the amount of products.
+
+        Yields:
+            [list[int]]: ascending product ids of one chunk
+        """
+        product_ids = np.sort(self.product_ids)
+        for start in range(0, product_ids.shape[0], self.product_chunk_size):
+            yield product_ids[start:start + self.product_chunk_size].tolist()
+            # The chunk was processed when the next chunk is requested.
+            self.progress.update(steps=1)
+
+    def query_stacked_values(self, feature_field, features):
+        """Query the sensorreading values of the features annotated with the product id of their processstep.
+        The product id is joined through the processstep instead of being mapped in the query, so the query size does not grow with the amount of processsteps.
+
+        Args:
+            feature_field (str): Name of the SensorReading field that relates to the features. One of 'processparameter' or 'qualitycharacteristics'.
+            features (list[objects]): List of processparameter or qualitycharacteristics objects.
+
+        Yields:
+            [QuerySet]: [(product id, date, feature id, sensorreading value)...] per product id chunk, ordered by product id, feature id and date.
+        """
+        for product_ids in self.product_id_chunks():
+            sr_queryset = SensorReading.objects.using(self.db).filter(**{
+                                                                feature_field + "__in": features,
+                                                                "processstep__product__in": product_ids,
+                                                                "processstep__processstepspecification": F(feature_field + "__processstepspecification"),
+                                                                })
+            # Order by the id columns. Ordering by the relations would apply the default ordering of the related models.
+            sr_queryset = sr_queryset.order_by("processstep__product_id", feature_field + "_id", "date")
+            yield sr_queryset.values_list("processstep__product_id", "date", feature_field + "_id", "value")
+
+    def create_stacked_dataframe(self, feature_field, features, name=None):
+        """Creates a dataframe in tsfresh format with the columns id (product id), time (date), kind (feature id) and value.
+
+        Args:
+            feature_field (str): Name of the SensorReading field that relates to the features. One of 'processparameter' or 'qualitycharacteristics'.
+            features (list[objects]): List of processparameter or qualitycharacteristics objects.
+            name (str, optional): Name of the stages in the progress and instrumentation, e.g. target_value. Defaults to None (feature_field).
+
+        Returns:
+            [pd.DataFrame]: Pandas DataFrame that contains values by product (id), feature (kind) and date (time).
+        """
+        name = name or feature_field
+        self.progress.update(stage="query_" + name)
+        with self.instrumentation.stage("query_" + name) as stage:
+            rows = []
+            for sr_queryset in self.query_stacked_values(feature_field, features):
+                rows.extend(sr_queryset)
+            stage["rows"] = len(rows)
+        self.progress.update(features=len(features), rows=len(rows))
+
+        return pd.DataFrame(rows, columns=['id', 'time', 'kind', 'value'])
+
+    def query_feature_values(self, feature_field, features, methods=None):
+        """Query the sensorreading values of all features with one grouped query keyed by (product id, feature id) per product id chunk.
+        The sensorreadings are joined through their processstep, which has to belong to the processstepspecification of the feature.
+
+        Args:
+            feature_field (str): Name of the SensorReading field that relates to the features. One of 'processparameter' or 'qualitycharacteristics'.
+            features (list[objects]): List of processparameter or qualitycharacteristics objects.
+            methods (list[str], optional): Keys of decode_methods_per_feature that are applied per (product, feature) group. Defaults to None.
+
+        Yields:
+            [QuerySet]: methods given: [(product id, feature id, method_1 value, ..., method_n value)...]
+            [QuerySet]: methods is None: [(product id, feature id, sensorreading value)...]
+        """
+        for product_ids in self.product_id_chunks():
+            sr_queryset = SensorReading.objects.using(self.db).filter(**{
+                                                                feature_field + "__in": features,
+                                                                "processstep__product__in": product_ids,
+                                                                "processstep__processstepspecification": F(feature_field + "__processstepspecification"),
+                                                                })
+            # Clear the default ordering of the model, otherwise the ordering field would be added to the GROUP BY clause.
+            sr_queryset = sr_queryset.order_by()
+            if methods:
+                aggregations = {method: self.decode_methods_per_feature.get(method) for method in methods}
+                yield sr_queryset.values("processstep__product", feature_field).annotate(**aggregations).values_list("processstep__product", feature_field, *methods)
+            else:
+                yield sr_queryset.values_list("processstep__product", feature_field, "value")
+
+    def query_unsummarized_products(self, feature_field, features, product_ids):
+        """Query the products with a processstep that has sensorreadings of a feature but no summary of this feature,
+        e.g. after imports that bypass the summaries and before the Rollup_SensorReadings task caught them up.
+
+        Args:
+            feature_field (str): Name of the SensorReadingSummary field that relates to the features. One of 'processparameter' or 'qualitycharacteristics'.
+            features (list[objects]): List of processparameter or qualitycharacteristics objects.
+            product_ids (list[int]): Product ids of one chunk.
+
+        Returns:
+            [list[int]]: Product ids.
+        """
+        has_summary = Exists(SensorReadingSummary.objects.using(self.db).filter(**{"processstep": OuterRef("processstep"), feature_field: OuterRef(feature_field)}))
+        has_unsummarized_readings = Exists(SensorReading.objects.using(self.db).filter(**{"processstep": OuterRef("pk"), feature_field + "__in": features, "value__isnull": False}).filter(~has_summary))
+        processsteps = ProcessStep.objects.using(self.db).filter(product__in=product_ids, processstepspecification__in={feature.processstepspecification_id for feature in features})
+        return list(processsteps.filter(has_unsummarized_readings).order_by().values_list("product", flat=True).distinct())
+
+    def query_feature_summaries(self, feature_field, features):
+        """Query the summaries of the sensorreadings per (product id, feature id, processstep) and product id chunk.
+        The summaries of a product are joined through their processstep, which has to belong to the processstepspecification of the feature.
+        Products with processsteps without summaries are aggregated from their sensorreadings.
+
+        Args:
+            feature_field (str): Name of the SensorReadingSummary field that relates to the features. One of 'processparameter' or 'qualitycharacteristics'.
+            features (list[objects]): List of processparameter or qualitycharacteristics objects.
+
+        Yields:
+            [QuerySet]: [(product id, feature id, count, mean, m2, min, max)...]
+        """
+        for product_ids in self.product_id_chunks():
+            unsummarized_product_ids = self.query_unsummarized_products(feature_field, features, product_ids)
+            summary_queryset = SensorReadingSummary.objects.using(self.db).filter(**{
+                                                                feature_field + "__in": features,
+                                                                "processstep__product__in": product_ids,
+                                                                "processstep__processstepspecification": F(feature_field + "__processstepspecification"),
+                                                                }).exclude(processstep__product__in=unsummarized_product_ids)
+            yield summary_queryset.order_by().values_list("processstep__product", feature_field, "count", "mean", "m2", "min", "max")
+
+            if unsummarized_product_ids:
+                sr_queryset = SensorReading.objects.using(self.db).filter(**{
+                                                                feature_field + "__in": features,
+                                                                "processstep__product__in": unsummarized_product_ids,
+                                                                "processstep__processstepspecification": F(feature_field + "__processstepspecification"),
+                                                                "value__isnull": False,
+                                                                })
+                sr_queryset = sr_queryset.order_by().values("processstep__product", feature_field).annotate(
+                                                                total_count=Count("value"),
+                                                                total_mean=Avg("value"),
+                                                                total_m2=ExpressionWrapper(Variance("value") * Count("value"), output_field=FloatField()),
+                                                                total_min=Min("value"),
+                                                                total_max=Max("value"),
+                                                                )
+                yield sr_queryset.values_list("processstep__product", feature_field, "total_count", "total_mean", "total_m2", "total_min", "total_max")
+
+    @staticmethod
+    def summary_feature_values(rows, methods):
+        """Merge the summaries per (product id, feature id) and apply the methods on them.
+        The means and the sums of squared deviations (m2) are merged with the formula of Chan et al.
+        StdDev is the population standard deviation like the StdDev aggregate of the database.
+
+        Args:
+            rows (iterable[tuple]): (product id, feature id, count, mean, m2, min, max) rows, e.g. the results of query_feature_summaries.
+            methods (list[str]): Methods out of summary_methods.
+
+        Returns:
+            [np.ndarray]: float64 array with the columns product id, feature id, method_1 value, ..., method_n value
+        """
+        summaries = np.array(list(rows), dtype="float64").reshape(-1, 7)
+        summaries = summaries[np.lexsort((summaries[:, 1], summaries[:, 0]))]
+        if summaries.shape[0] == 0:
+            return np.empty((0, 2 + len(methods)))
+        starts = segment_starts(summaries[:, 0], summaries[:, 1])
+        segment_ids = np.repeat(np.arange(starts.shape[0]), np.diff(np.append(starts, summaries.shape[0])))
+
+        counts, means, m2s = summaries[:, 2], summaries[:, 3], summaries[:, 4]
+        count = np.add.reduceat(counts, starts)
+        mean = np.add.reduceat(counts * means, starts) / count
+        deviations = means - mean[segment_ids]
+        m2 = np.add.reduceat(m2s + counts * deviations * deviations, starts)
+        variance = m2 / count
+        minimum = np.minimum.reduceat(summaries[:, 5], starts)
+        maximum = np.maximum.reduceat(summaries[:, 6], starts)
+        method_values = {"Min": minimum,
+                         "Max": maximum,
+                         "Avg": mean,
+                         "StdDev": np.sqrt(variance),
+                         "Count": count,
+                         "Range": maximum - minimum,
+                         "RMS": np.sqrt(mean * mean + variance),
+                         }
+
+        return np.column_stack([summaries[starts, :2]] + [method_values[method] for method in methods])
+
+    def create_statistics_values(self, feature_field, features, methods):
+        """Fetch the sensorreading values of all features once per product id chunk and compute all methods with segment reductions.
+        A segment contains the values of one (product, feature) group ordered by date.
+
+        Args:
+            feature_field (str): Name of the SensorReading field that relates to the features. One of 'processparameter' or 'qualitycharacteristics'.
+            features (list[objects]): List of processparameter or qualitycharacteristics objects.
+            methods (list[str]): Methods out of feature_statistics.segment_methods.
+
+        Yields:
+            [np.ndarray]: float64 array with the columns product id, feature id, method_1 value, ..., method_n value per product id chunk
+        """
+        for sr_queryset in self.query_stacked_values(feature_field, features):
+            rows = np.array(list(sr_queryset.values_list("processstep__product_id", feature_field + "_id", "value")), dtype="float64").reshape(-1, 3)
+            # Sensorreadings without value are ignored like in the aggregations of the database.
+            rows = rows[~np.isnan(rows[:, 2])]
+            if rows.shape[0] == 0:
+                continue
+            starts = segment_starts(rows[:, 0], rows[:, 1])
+            yield np.column_stack([rows[starts, :2], segment_statistics(rows[:, 2], starts, methods)])
+
+    @property
+    def product_alignment(self):
+        """Alignment of product ids to the rows of the dataframe (self.product_ids). It is built once per product selection and shared by all features."""
+        if getattr(self, "_product_alignment", None) is None or self._product_alignment.ids is not self.product_ids:
+            self._product_alignment = IdAlignment(self.product_ids)
+        return self._product_alignment
+
+    def pivot_feature_values(self, rows, features, n_values):
+        """Pivot the (product id, feature id, values...) rows into a wide array aligned with self.product_ids.
+        Products without sensorreadings are filled with NaN, rows of other products or features are ignored.
+
+        Args:
+            rows (iterable[tuple]): (product id, feature id, value_1, ..., value_n) rows, e.g. the results of query_feature_values.
+            features (list[objects]): Features that define the column order. Each feature owns n_values consecutive columns.
+            n_values (int): Amount of values per row and feature.
+
+        Returns:
+            [np.ndarray]: float64 array with shape (len(self.product_ids), len(features) * n_values)
+        """
+        values = np.array(list(rows), dtype="float64").reshape(-1, 2 + n_values)
+        # Map product ids to row positions and feature ids to column blocks.
+        feature_alignment = IdAlignment([feature.pk for feature in features])
+
+        return self.product_alignment.align(values[:, 0], values[:, 1], values[:, 2:], feature_alignment)
+
+    def create_feature_dataframe(self, feature_field, features, methods=None, name=None):
+        """Creates a dataframe with product ids as index and one column per feature and method.
+
+        Args:
+            feature_field (str): Name of the SensorReading field that relates to the features. One of 'processparameter' or 'qualitycharacteristics'.
+            features (list[objects]): List of processparameter or qualitycharacteristics objects.
+            methods (list[str], optional): Methods that are applied on the features. If None, the sensorreading value itself is used and the column is named by the feature. Defaults to None.
+            name (str, optional): Name of the stages in the progress and instrumentation, e.g. target_value. Defaults to None (feature_field).
+
+        Returns:
+            [pd.DataFrame]: Pandas DataFrame that contains the values of the methods that are applied on the sensorreading values.
+        """
+        if methods:
+            columns = [str(feature) + method for feature in features for method in methods]
+        else:
+            columns = [str(feature) for feature in features]
+
+        name = name or feature_field
+        self.progress.update(stage="query_" + name)
+        with self.instrumentation.stage("query_" + name) as stage:
+            if methods and self.use_sensorreading_summary and set(methods) <= set(self.summary_methods):
+                rows = self.summary_feature_values(chain.from_iterable(self.query_feature_summaries(feature_field, features)), methods)
+            elif methods and not set(methods) <= set(self.decode_methods_per_feature.keys()):
+                rows = list(chain.from_iterable(self.create_statistics_values(feature_field, features, methods)))
+            else:
+                rows = list(chain.from_iterable(self.query_feature_values(feature_field, features, methods)))
+            stage["rows"] = len(rows)
+
+        with self.instrumentation.stage("pivot_" + name) as stage:
+            values = self.pivot_feature_values(rows, features, len(methods) if methods else 1)
+            stage["rows"] = values.shape[0]
+        self.progress.update(features=len(features), rows=len(rows))
+
+        return pd.DataFrame(values, index=self.product_ids, columns=columns)
+
+    def stream_rows(self, sr_queryset):
+        """Fetch the rows of a values_list queryset in chunks of self.streaming_chunk_size rows.
+        On MySQL an unbuffered server-side cursor is used, other databases use the queryset iterator.
+
+        Args:
+            sr_queryset (QuerySet): values_list queryset
+
+        Yields:
+            [list[tuple]]: rows of one chunk
+        """
+        connection = connections[self.db]
+        if connection.vendor == "mysql":
+            from MySQLdb.cursors import SSCursor
+            sql, params = sr_queryset.query.get_compiler(using=self.db).as_sql()
+            connection.ensure_connection()
+            cursor = connection.connection.cursor(SSCursor)
+            try:
+                # The server-side cursor bypasses the execute wrappers of the instrumentation.
+                self.instrumentation.count_query()
+                cursor.execute(sql, params)
+                rows = cursor.fetchmany(self.streaming_chunk_size)
+                while rows:
+                    yield rows
+                    rows = cursor.fetchmany(self.streaming_chunk_size)
+            finally:
+                cursor.close()
+        else:
+            yield from chunked(sr_queryset.iterator(chunk_size=self.streaming_chunk_size), self.streaming_chunk_size)
+
     @staticmethod
-    def sort_sensorreadings(processsteps, unsorted):
-        """Sort an unsorted list with the order of processstep, sensorreading pairs.
+    def rows_to_record_batch(rows, schema):
+        """Convert (id, time, kind, value) rows into a typed Arrow record batch.
 
         Args:
-            processsteps (list[int]): orderd processstep ids which predefine the order of the sensorreading values
-            unsorted (list[tuples]):  (processstep id, sensorreading value) pairs
+            rows (list[tuple]): rows with one value per schema field
+            schema (pa.Schema): schema of the record batch
 
         Returns:
-            [list[float]]: ordered list of sensorreading values
+            [pa.RecordBatch]: record batch with the columns of the schema
         """
-        assert len(processsteps) == len(unsorted)
-        objects = dict(unsorted)
-        return [objects[x] for x in processsteps]
+        columns = list(zip(*rows))
+        return pa.RecordBatch.from_arrays([pa.array(column, type=field.type) for column, field in zip(columns, schema)], schema=schema)
 
-    def feature_methods_on_sensorreadings(self, sr_queryset, method):
-        """Apply Django Aggregations on the given queryset.
+    def stream_stacked_dataframe(self, feature_field, features, filename):
+        """Writes the features in tsfresh format to a file at the save_path without holding the dataset in memory.
+        The sensorreadings are fetched in chunks and appended as Arrow record batches, so the peak memory is set by self.streaming_chunk_size.
 
         Args:
-            sr_queryset ([type]): queryset of sensorreading instances
-            method (object): One of Min('value'),Max(...),Avg(...),StdDev(...) to apply on the queryset.
+            feature_field (str): Name of the SensorReading field that relates to the features. One of 'processparameter' or 'qualitycharacteristics'.
+            features (list[objects]): List of processparameter or qualitycharacteristics objects.
+            filename (str): Name of the file in the artifact format.
 
         Returns:
-            [list[tuple]]: Returns [(sensorreading value, processstep id)...]
+            [int]: Amount of written rows.
         """
-        return sr_queryset.annotate(self.decode_methods_per_feature.get(method)).values_list('processstep', 'value')
+        schema = pa.schema([('id', pa.int64()), ('time', pa.timestamp('ns', tz='UTC')), ('kind', pa.int64()), ('value', pa.float64())])
+        self.progress.update(stage="stream_" + feature_field)
+        with self.instrumentation.stage("stream_" + feature_field) as stage:
+            with self.artifacts.stream(filename, schema) as write:
+                for sr_queryset in self.query_stacked_values(feature_field, features):
+                    for rows in self.stream_rows(sr_queryset):
+                        write(self.rows_to_record_batch(rows, schema))
+                        stage["rows"] += len(rows)
+                        self.progress.update(rows=len(rows))
+        self.progress.update(features=len(features))
+
+        return stage["rows"]
+
+    def artifact_path(self, filename):
+        """Path of a file at the save_path of the dataframe."""
+        return self.artifacts.path(filename)
+
+    def build_config(self, df, processparameter, qualitycharacteristics, target_value, product_ids=None):
+        """Configuration of a build, which defines the columns, the product selection and the format of the files.
+
+        Args:
+            df (DataFrame): Dataframe instance.
+            processparameter (list[objects]): Processparameters of the dataframe.
+            qualitycharacteristics (list[objects]): Qualitycharacteristics of the dataframe.
+            target_value (list[objects]): Target values (qualitycharacteristics) of the dataframe.
+            product_ids (list[int], optional): Given product ids. Defaults to None.
+
+        Returns:
+            [dict]: Configuration of the build.
+        """
+        return {
+            "productspecification": df.productspecification_id,
+            "processstepspecification": sorted(df.processstepspecification.values_list('pk', flat=True)),
+            "processparameter": sorted(pp.pk for pp in processparameter),
+            "qualitycharacteristics": sorted(qc.pk for qc in qualitycharacteristics),
+            "target_value": sorted(qc.pk for qc in target_value),
+            "feature_config": self.methods_per_feature,
+            "product_amount": df.product_amount,
+            "random_records": df.random_records,
+            "random_seed": df.random_seed if df.random_records else None,
+            "product_ids": sorted(int(product_id) for product_id in product_ids) if product_ids else None,
+            "artifacts": [df.artifact_format, df.compression, df.float32, df.row_group_size],
+        }
+
+    @staticmethod
+    def hash_config(config):
+        """Hex digest of a JSON serializable configuration."""
+        return hashlib.sha256(json.dumps(config, sort_keys=True).encode()).hexdigest()
+
+    def build_fingerprint(self, df, processparameter, qualitycharacteristics, target_value, product_ids=None):
+        """Hash of the build configuration, of the candidate products and of the highest sensorreading id per processparameter and qualitycharacteristic.
+        New sensorreadings of a feature change the fingerprint, changed values or dates of existing sensorreadings do not.
+        New candidate products change the fingerprint, even without sensorreadings of the features, because they change the selected products.
+        Random product selections are identified by the random_seed of the dataframe.
+
+        Args:
+            df (DataFrame): Dataframe instance.
+            processparameter (list[objects]): Processparameters of the dataframe.
+            qualitycharacteristics (list[objects]): Qualitycharacteristics of the dataframe.
+            target_value (list[objects]): Target values (qualitycharacteristics) of the dataframe.
+            product_ids (list[int], optional): Given product ids. Defaults to None.
+
+        Returns:
+            [str]: Hex digest of the fingerprint.
+        """
+        high_water_marks = {}
+        for feature_field, features in (("processparameter", processparameter), ("qualitycharacteristics", qualitycharacteristics + target_value)):
+            if features:
+                sr_queryset = SensorReading.objects.using(self.db).filter(**{feature_field + "__in": features}).order_by().values(feature_field)
+                high_water_marks[feature_field] = sorted(sr_queryset.annotate(last_id=Max('id')).values_list(feature_field, 'last_id'))
+
+        # Given product ids are part of the configuration, otherwise the selection depends on the highest id and the amount of the candidates.
+        candidates = None
+        if not product_ids:
+            candidates = self.query_products(df).aggregate(last_id=Max('pk'), amount=Count('pk'))
+
+        config = dict(self.build_config(df, processparameter, qualitycharacteristics, target_value, product_ids), products=candidates, sensorreadings=high_water_marks)
+        return self.hash_config(config)
+
+    def copy_artifacts(self, source_path):
+        """Copy the files of a build at source_path to the save_path. Raises an error when a file does not exist.
+
+        Args:
+            source_path (str): save_path of the reused build.
+        """
+        for filename in map(self.artifacts.filename, self.artifact_names):
+            with smart_open(source_path.rstrip('/') + '/' + filename, 'rb') as f_in:
+                # The files of an own previous build are already at the save_path.
+                if source_path.rstrip('/') == self.save_path.rstrip('/'):
+                    continue
+                with smart_open(self.artifact_path(filename), 'wb') as f_out:
+                    shutil.copyfileobj(f_in, f_out)
+
+    def reuse_cached_build(self, fingerprint):
+        """Reuse the files of a previous build with the same fingerprint. The own previous build is preferred.
+        The fingerprint of a dataframe is only set after a successful build and reset when a new build starts.
+
+        Args:
+            fingerprint (str): Fingerprint of the requested build.
+
+        Returns:
+            [bool]: True if the files of a previous build are at the save_path.
+        """
+        if not self.save_path:
+            return False
+
+        candidates = DataFrame.objects.using(self.db).filter(fingerprint=fingerprint).exclude(save_path=None).values_list('pk', 'save_path', 'product_high_water_mark')
+        for pk, source_path, product_high_water_mark in sorted(candidates, key=lambda candidate: candidate[0] != self.pk):
+            try:
+                self.copy_artifacts(source_path)
+                self.product_high_water_mark = product_high_water_mark
+                return True
+            except Exception as e:
+                # Files were moved or deleted, try the next build.
+                logger.warning("Cached build of dataframe %s is not available: %s", pk, e)
+
+        return False
+
+    def merge_previous_build(self, name, dataframe):
+        """Append the dataframe of the new products to the dataframe of the previous build.
+        Products of the previous build that are not selected anymore (self.previous_product_ids) are dropped.
+
+        Args:
+            name (str): Name of the dataframe, x or y.
+            dataframe (pd.DataFrame): Dataframe of the new products.
+
+        Returns:
+            [pd.DataFrame]: Merged dataframe in the order of a complete build.
+        """
+        previous_dataframe = self.artifacts.read(name)
+        # Feather and parquet files store the column names as strings, e.g. the qualitycharacteristic ids of the timeseries targets.
+        dataframe = dataframe.rename(columns=str)
+        # Timeseries are ordered by ascending product id, new products have higher ids.
+        if self.tsfresh_bool:
+            previous_dataframe = previous_dataframe[previous_dataframe['id'].isin(self.previous_product_ids)]
+            return pd.concat([previous_dataframe, dataframe], ignore_index=name == "x")
+
+        previous_dataframe = previous_dataframe[previous_dataframe.index.isin(self.previous_product_ids)]
+        return pd.concat([previous_dataframe, dataframe]).sort_index(ascending=False)
+
+    def merge_previous_stacked_build(self, name):
+        """Append the streamed timeseries of the new products to the file of the previous build without loading them at once.
+        The new timeseries are streamed to refresh/<filename> before, products that are not selected anymore are dropped.
+
+        Args:
+            name (str): Name of the dataframe of the previous build.
+        """
+        filename = self.artifacts.filename(name)
+        merged_filename = "refresh/merged_" + filename
+        self.artifacts.concat([filename, "refresh/" + filename], merged_filename, ids=np.concatenate([self.previous_product_ids, self.product_ids]))
+        with smart_open(self.artifact_path(merged_filename), 'rb') as f_in:
+            with smart_open(self.artifact_path(filename), 'wb') as f_out:
+                shutil.copyfileobj(f_in, f_out)
+
+    def save_dataframe(self, name, dataframe):
+        """Save a dataframe as file in the artifact format at the save_path.
+        Partitions pickle their partial dataframe including the index, it is concatenated by the MergeDataframePartitions task.
+        Refreshes append the dataframe to the file of the previous build.
+
+        Args:
+            name (str): Name of the dataframe, x or y.
+            dataframe (pd.DataFrame): Dataframe to save.
+        """
+        self.progress.update(stage="upload_" + name)
+        with self.instrumentation.stage("upload_" + name) as stage:
+            if self.partition is None:
+                if self.refresh:
+                    dataframe = self.merge_previous_build(name, dataframe)
+                self.artifacts.write(name, dataframe)
+            else:
+                partial_filename = MergeDataframePartitions.partition_filename(name + ".pkl", self.partition)
+                with smart_open(self.artifact_path(partial_filename), 'wb') as f:
+                    dataframe.to_pickle(f)
+            stage["rows"] = dataframe.shape[0]
+
+    def update_status(self, status):
+        """Update the status of the DataFrame instance. Partitions do not move the build out of a terminal status, e.g. when a sibling partition failed before."""
+        df_queryset = DataFrame.objects.using(self.db).filter(pk=self.pk)
+        if self.partition is not None:
+            df_queryset = df_queryset.exclude(status__in=self.terminal_statuses)
+        df_queryset.update(status=status)
+
+    def update_partition(self, **kwargs):
+        """Update the DataFramePartition instance of this task. Does nothing when the task builds the whole dataframe."""
+        if self.partition is not None:
+            DataFramePartition.objects.using(self.db).filter(dataframe=self.pk, partition=self.partition).update(**kwargs)
+
+    def submit_partitions(self, partitions, resume=False):
+        """Split the product ids into ascending ranges and build them in parallel with a chord of CreateDataframe tasks.
+        The MergeDataframePartitions task concatenates the partial dataframes when all partitions succeeded.
+
+        Args:
+            partitions (int): Amount of partitions.
+            resume (bool, optional): Whether the build resumes from checkpoints. Succeeded partitions with the same product range are not built again. Defaults to False.
+        """
+        product_id_ranges = [product_ids for product_ids in np.array_split(np.sort(self.product_ids), partitions) if product_ids.shape[0] > 0]
+
+        partition_queryset = DataFramePartition.objects.using(self.db).filter(dataframe=self.pk)
+        succeeded = set()
+        if resume:
+            succeeded = set(partition_queryset.filter(status="Succeeded").values_list('partition', 'product_amount', 'first_product_id', 'last_product_id'))
+        signatures = []
+        for partition, product_ids in enumerate(product_id_ranges):
+            # The partial files of the partition were written by the interrupted build.
+            if (partition, product_ids.shape[0], int(product_ids[0]), int(product_ids[-1])) in succeeded:
+                continue
+            partition_queryset.filter(partition=partition).delete()
+            signature = self.signature(kwargs={"pk": self.pk, "database_name": self.db, "methods_per_feature": self.methods_per_feature,
+                                               "product_ids": product_ids.tolist(), "partition": partition}, immutable=True)
+            signature.freeze()
+            DataFramePartition.objects.using(self.db).create(dataframe_id=self.pk, partition=partition, task_id=signature.id, product_amount=product_ids.shape[0],
+                                                             first_product_id=int(product_ids[0]), last_product_id=int(product_ids[-1]))
+            signatures.append(signature)
+
+        partition_queryset.filter(partition__gte=len(product_id_ranges)).delete()
+
+        callback = MergeDataframePartitions().signature(kwargs={"pk": self.pk, "database_name": self.db, "partitions": len(product_id_ranges), "time_series": self.tsfresh_bool,
+                                                                  "fingerprint": self.fingerprint, "config_fingerprint": self.config_fingerprint, "product_high_water_mark": self.product_high_water_mark})
+        if signatures:
+            chord(group(signatures))(callback)
+        else:
+            callback.apply_async(args=([],))
 
     def create_processparameter_dataframe(self, processparameter):
         """Creates a dataframe built with products ids and processparameter names.
@@ -107,29 +686,8 @@ class CreateDataframe(Task):
         Returns:
             [pd.DataFrame]: Pandas DataFrame that contains the values of the methods thate are applied on the sensorreading values.
         """
-        # Generate processparameter columns with
-        pp_columns = []
-        for pp in processparameter:
-            pp_columns.extend([str(pp) + x for x in self.methods_per_feature])
-
-        # Optional for debugging and time comparison
-        startTime = time.perf_counter()
-        # Allocate memory for the dataframe
-        df_pp = pd.DataFrame(None, index=self.product_ids, columns=pp_columns).astype('float64')
-
-
-        for pp in processparameter:
-            # Get sensorreading objects. ProcessParameter(one) --> ProcessStepSpecifcation(one) --> processsteps(several, descending ordered by product ids) --> unordered sensorreading instances.
-            processstepspec = ProcessStepSpecification.objects.using(self.db).filter(processparameter=pp).values_list('id', flat=True)[0]
-            processsteps = ProcessStep.objects.using(self.db).filter(product__in=self.product_ids, processstepspecification=processstepspec).order_by('-product_id').values_list('pk', flat=True)
-            unsorted_sr_queryset = SensorReading.objects.using(self.db).filter(processstep__in=processsteps, processparameter=pp).all()
-            # Apply each method on the processparameter and sort them using the ordered processsteps.
-            for method in self.methods_per_feature:
-                unsorted = self.feature_methods_on_sensorreadings(unsorted_sr_queryset, method)
-                df_pp[str(pp)+method] = self.sort_sensorreadings(processsteps, unsorted)
-
-        # Optional for debugging and time comparison
-        print('Elapsed time: {:6.3f} seconds df_pp'.format(time.perf_counter() - startTime))
+        # Apply all methods on all processparameters within one grouped query.
+        df_pp = self.create_feature_dataframe("processparameter", processparameter, self.methods_per_feature)
 
         # Much slower way, but 100% secure way to build the dataframe.
         # Serves to compare it with the processparameter dataframe.
@@ -165,29 +723,8 @@ class CreateDataframe(Task):
         Returns:
             [pd.DataFrame]: Pandas DataFrame that contains values by product (id), processparameter (kind) and date (time).
         """
-
-        # Optional for debugging and time comparison
-        startTime = time.perf_counter()
-        # Get sensorreading objects. ProcessParameter(one) --> ProcessStepSpecifcation(one) --> processsteps(several, descending ordered by product ids) --> unordered sensorreading instances.
-        processstepspec = ProcessStepSpecification.objects.using(self.db).filter(processparameter__in=processparameter).values_list('id', flat=True)[0]
-        processsteps = ProcessStep.objects.using(self.db).filter(product__in=self.product_ids, processstepspecification=processstepspec).order_by('-product_id').values_list('pk', flat=True)
-        unsorted_sr_queryset = SensorReading.objects.using(self.db).filter(processstep__in=processsteps, processparameter__in=processparameter).all()
-
-        # Annotate each sensorreading with the corresponding product id.
-        processsteps_dict = dict((o.pk, o.product_id) for o in ProcessStep.objects.using(self.db).filter(product__in=self.product_ids, processstepspecification=processstepspec).only('pk','product_id'))
-        whens = [When(processstep_id=int(k), then=Value(v)) for k, v in processsteps_dict.items()]
-        unsorted_sr_queryset = unsorted_sr_queryset.annotate(product_id=Case(*whens, output_field=IntegerField(), default=Value(0)))
-        # Sort queryset
-        sr_queryset = unsorted_sr_queryset.order_by('product_id', 'processparameter', 'date')
-        sr_queryset = sr_queryset.values('product_id', 'date', 'processparameter_id', 'value')
-        # create DataFrame from Queryset
-        df_pp = pd.DataFrame(sr_queryset)
-        # rename columns to match tsfresh format
-        df_pp = df_pp.rename(columns={'product_id':'id', 'date':'time', 'processparameter_id':'kind'})
-        # rearrange column ordering
-        df_pp = df_pp[['id','time','kind','value']]
-        # Optional for debugging and time comparison
-        print('Elapsed time: {:6.3f} seconds df_pp'.format(time.perf_counter() - startTime))
+        # Get the sensorreadings ordered by product, processparameter and date in tsfresh format.
+        df_pp = self.create_stacked_dataframe("processparameter", processparameter)
 
         return df_pp
 
@@ -200,31 +737,37 @@ class CreateDataframe(Task):
             [pd.DataFrame]: target=False: Pandas DataFrame that contains the values of the methods thate are applied on the sensorreading values.
             [pd.DataFrame]: target=True: Pandas DataFrame that contains the sensorreading values of the target_value (qualitycharacteristic).
         """
-        # Create the columns for the dataframe
+        # Wether to create the target_dataframe (y) with the plain sensorreading values or create features from the qualitycharacteristics and methods.
         if target:
-            qc_columns = [str(x) for x in qualitycharacteristics]
+            df_qc = self.create_feature_dataframe("qualitycharacteristics", qualitycharacteristics, name="target_value")
         else:
-            qc_columns = []
-            for qc in qualitycharacteristics:
-                qc_columns.extend([str(qc) + "_" + x for x in self.methods_per_feature])
-
-        df_qc = pd.DataFrame(None, index=self.product_ids, columns=qc_columns).astype('float64')
-        # Get sensorreading objects. QualityCharacteristics(one) --> ProcessStepSpecifcation(one) --> ProcessSteps(several, descending ordered by product ids) --> unordered SensorReading objects.
-        for qc in qualitycharacteristics:
-            processstepspec = ProcessStepSpecification.objects.using(self.db).filter(qualitycharacteristics=qc).values_list('id', flat=True)[0]
-            processsteps = ProcessStep.objects.using(self.db).filter(product__in=self.product_ids, processstepspecification=processstepspec).order_by('-product_id').values_list('pk', flat=True)
-            unsorted_sr_queryset = SensorReading.objects.using(self.db).filter(processstep__in=processsteps, qualitycharacteristics=qc).all()
-            # Wether to create the target_dataframe (y) or create features from the qualitycharacteristics and methods.
-            if target:
-                df_qc[str(qc)] = self.sort_sensorreadings(processsteps, unsorted_sr_queryset.values_list('processstep', 'value'))
-            else:
-                # Apply each method on the processparameter and sort them using the ordered processsteps.
-                for method in self.methods_per_feature:
-                    unsorted = self.feature_methods_on_sensorreadings(unsorted_sr_queryset, method)
-                    df_qc[str(qc)+method] = self.sort_sensorreadings(processsteps, unsorted)
+            df_qc = self.create_feature_dataframe("qualitycharacteristics", qualitycharacteristics, self.methods_per_feature)
 
         return df_qc
 
+    @staticmethod
+    def pivot_target_timeseries(df_qc):
+        """Pivot stacked target values to one row per product (id) and one column per qualitycharacteristic (kind).
+        When a product has several values of one qualitycharacteristic, the first value is used. Missing values are NaN.
+
+        Args:
+            df_qc (pd.DataFrame): Stacked target values with the columns id, time, kind and value, ordered by id, kind and time.
+
+        Returns:
+            [pd.DataFrame]: Pandas DataFrame indexed by product id. The first column is the product id (id), followed by one column per kind.
+        """
+        # Keep the order of first appearance for products and qualitycharacteristics.
+        product_ids = df_qc['id'].unique()
+        column_names = df_qc['kind'].unique()
+        df_target = df_qc.drop_duplicates(subset=['id', 'kind'], keep='first').pivot(index='id', columns='kind', values='value')
+        df_target = df_target.reindex(index=product_ids, columns=column_names).astype('float64')
+        df_target.index.name = None
+        df_target.columns.name = None
+        # set the product ids as first column
+        df_target.insert(0, 'id', df_target.index)
+
+        return df_target
+
     def create_target_timeseries(self, qualitycharacteristics):
         """Creates a dataframe with target values for timeseries analysis. Rows are the Products, columns are the QualityCharacteristics (first column is product id).
         Args:
@@ -233,51 +776,53 @@ class CreateDataframe(Task):
         Returns:
             [pd.DataFrame]: Pandas DataFrame that contains values by product (id), qualitycharacteristic (kind) and date (time).
         """
+        # Get the sensorreadings ordered by product, qualitycharacteristic and date in tsfresh format.
+        df_qc = self.create_stacked_dataframe("qualitycharacteristics", qualitycharacteristics, name="target_value")
+        # pivot the stacked values to one row per product and one column per qualitycharacteristic
+        with self.instrumentation.stage("pivot_target_value") as stage:
+            df_target = self.pivot_target_timeseries(df_qc)
+            stage["rows"] = df_target.shape[0]
 
-        # Optional for debugging and time comparison
-        startTime = time.perf_counter()
-        # Get sensorreading objects. QualityCharacteristics(one) --> ProcessStepSpecifcation(one) --> processsteps(several, descending ordered by product ids) --> unordered sensorreading instances.
-        processstepspec = ProcessStepSpecification.objects.using(self.db).filter(qualitycharacteristics__in=qualitycharacteristics).values_list('id', flat=True)[0]
-        processsteps = ProcessStep.objects.using(self.db).filter(product__in=self.product_ids, processstepspecification=processstepspec).order_by('-product_id').values_list('pk', flat=True)
-        unsorted_sr_queryset = SensorReading.objects.using(self.db).filter(processstep__in=processsteps, qualitycharacteristics__in=qualitycharacteristics).all()
-
-        # Annotate each sensorreading with the corresponding product id.
-        processsteps_dict = dict((o.pk, o.product_id) for o in ProcessStep.objects.using(self.db).filter(product__in=self.product_ids, processstepspecification=processstepspec).only('pk','product_id'))
-        whens = [When(processstep_id=int(k), then=Value(v)) for k, v in processsteps_dict.items()]
-        unsorted_sr_queryset = unsorted_sr_queryset.annotate(product_id=Case(*whens, output_field=IntegerField(), default=Value(0)))
-        # Sort queryset
-        sr_queryset = unsorted_sr_queryset.order_by('product_id', 'qualitycharacteristics', 'date')
-        sr_queryset = sr_queryset.values('product_id', 'date', 'qualitycharacteristics_id', 'value')
-        # create DataFrame from Queryset
-        df_qc = pd.DataFrame(sr_queryset)
-        # rename columns to match tsfresh format
-        df_qc = df_qc.rename(columns={'product_id':'id', 'date':'time', 'qualitycharacteristics_id':'kind'})
-        # create empty DataFrame in correct output format
-        column_names = df_qc['kind'].unique()
-        df_target = pd.DataFrame(columns=column_names)
-        # fill the DataFrame with values
-        for product in df_qc['id'].unique():
-            values = []
-            for column in column_names:
-                temp = list(df_qc.loc[(df_qc['id']==product) & (df_qc['kind']==column), 'value'])
-                if temp:
-                    values.append(df_qc.loc[(df_qc['id']==product) & (df_qc['kind']==column), 'value'].values[0])
-                else:
-                    values.append(np.NaN)
-            values = [values]
-            df_target = df_target.append(pd.DataFrame(values, columns=column_names, index=[product]))
-        # set index of DataFrame as column id containing the product ids
-        df_target['id'] = df_target.index
-        # rearrange column ordering
-        product_id = df_target['id']
-        df_target.drop(labels=['id'], axis=1,inplace = True)
-        df_target.insert(0, 'id', product_id)
+        return df_target
 
+    def save_instrumentation(self):
+        """Store the recorded stages at the DataFramePartition instance of a partition or else at the DataFrame instance."""
+        if self.partition is None:
+            DataFrame.objects.using(self.db).filter(pk=self.pk).update(instrumentation=self.instrumentation.to_dict())
+        else:
+            self.update_partition(instrumentation=self.instrumentation.to_dict())
 
-        # Optional for debugging and time comparison
-        print('Elapsed time: {:6.3f} seconds df_qc'.format(time.perf_counter() - startTime))
+    def save_progress(self, progress):
+        """Mirror the progress into the DataFramePartition instance of a partition or else into the DataFrame instance."""
+        if self.partition is None:
+            DataFrame.objects.using(self.db).filter(pk=self.pk).update(progress=progress)
+        else:
+            self.update_partition(progress=progress)
 
-        return df_target
+    def is_cancelled(self):
+        """Whether the cancellation of the build was requested."""
+        return DataFrame.objects.using(self.db).filter(pk=self.pk, cancel_requested=True).exists()
+
+    def checkpointed(self, name, features, create):
+        """Load a feature dataframe from the checkpoint of a previous build or create it and save the checkpoint.
+
+        Args:
+            name (str): Name of the checkpoint, e.g. processparameter.
+            features (list[objects]): Features of the dataframe, the progress advances by them when the checkpoint is loaded.
+            create (callable): Function that creates the dataframe.
+
+        Returns:
+            [pd.DataFrame]: Dataframe of the features.
+        """
+        if self.checkpoint is None:
+            return create()
+        if self.checkpoint.is_completed(name):
+            self.progress.update(stage="checkpoint_" + name, steps=self.product_chunks, features=len(features))
+            return self.checkpoint.load(name)
+
+        dataframe = create()
+        self.checkpoint.save(name, dataframe)
+        return dataframe
 
     def run(self, product_ids=None, *args, **kwargs):
         """Creation of the dataframes.
@@ -285,8 +830,12 @@ class CreateDataframe(Task):
         Returns:
             [None or error]: if an error occurs, the error message will be returned. Else None.
         """
+        self.instrumentation = Instrumentation(self.db)
+        self.progress = BuildProgress(self, self.save_progress, cancelled=self.is_cancelled)
         try:
-            DataFrame.objects.using(self.db).filter(pk=self.pk).update(**{"status": "Running"})
+            self.update_status("Running")
+            self.update_partition(status="Running", started=timezone.now())
+            self.progress.update(stage="Running")
 
             # Get attributes from the dataframe object
             df = DataFrame.objects.using(self.db).get(pk=self.pk)
@@ -294,31 +843,117 @@ class CreateDataframe(Task):
             qualitycharacteristics = list(df.qualitycharacteristics.all())
             target_value = list(df.target_value.all())
             self.save_path = df.save_path
+            self.artifacts = DataFrameArtifacts.from_dataframe(df)
+            self.streaming_chunk_size = df.streaming_chunk_size
+            # Partitions always stream timeseries, the partial files are appended batch by batch.
+            if self.partition is not None and self.tsfresh_bool and not self.streaming_chunk_size:
+                self.streaming_chunk_size = self.default_streaming_chunk_size
             rows = df.product_amount
             random_r = df.random_records
+            # Store the seed of a random product selection, so the same products can be selected again.
+            if random_r and df.random_seed is None:
+                df.random_seed = int(np.random.randint(0, 2**31 - 1))
+                DataFrame.objects.using(self.db).filter(pk=self.pk).update(random_seed=df.random_seed)
+
+            # The files of a build with another configuration, e.g. other features, methods or artifact format, are not extended but built again.
+            self.config_fingerprint = self.hash_config(self.build_config(df, processparameter, qualitycharacteristics, target_value, product_ids))
+            if self.refresh and df.config_fingerprint != self.config_fingerprint:
+                logger.info("Configuration of dataframe %s changed since the last build, all products are built.", self.pk)
+                self.refresh = False
+
+            # A refreshed build differs from a complete build when sensorreadings of previous products changed, it is not reused.
+            self.fingerprint = None
+            self.product_high_water_mark = None
+            # Reuse the files of an identical build instead of querying the sensorreadings again.
+            if not self.refresh and self.partition is None:
+                with self.instrumentation.stage("cache_lookup"):
+                    self.fingerprint = self.build_fingerprint(df, processparameter, qualitycharacteristics, target_value, product_ids)
+                    cache_hit = self.reuse_cached_build(self.fingerprint)
+                if cache_hit:
+                    DataFrame.objects.using(self.db).filter(pk=self.pk).update(status="Succeeded", fingerprint=self.fingerprint, config_fingerprint=self.config_fingerprint, cache_hits=F('cache_hits') + 1,
+                                                                               product_high_water_mark=self.product_high_water_mark)
+                    self.progress.finish()
+                    return None
+                DataFrame.objects.using(self.db).filter(pk=self.pk).update(fingerprint=None, cache_misses=F('cache_misses') + 1)
+
+            # Resume from the checkpoints of an interrupted or cancelled build with the same configuration, even if sensorreadings or products were added since.
+            # The checkpointed products are used again, the given product ids of a partition are part of its configuration.
+            self.checkpoint = None
+            if not self.refresh:
+                prefix = "checkpoints/" if self.partition is None else "checkpoints/partition_{}/".format(self.partition)
+                self.checkpoint = BuildCheckpoint(self.artifacts, self.config_fingerprint, prefix=prefix)
+                # The checkpoints can be older than the sensorreadings of the fingerprint, a resumed build is not reused by identical builds.
+                if self.checkpoint.open():
+                    self.fingerprint = None
 
             # Get product ids
-            if not product_ids:
-                # Get all product ids that match to the productspecification and the processstepspecifications.
-                processsteps_ids =  ProcessStep.objects.using(self.db).filter(processstepspecification__in=df.processstepspecification.all()).distinct().values_list('pk', flat=True)
-                products_ids = Product.objects.using(self.db).filter(productspecification=df.productspecification.pk, processstep__in=processsteps_ids).distinct().values_list('pk', flat=True)
-                product_ids = np.array(products_ids)
-            # Use given product ids
-            else:
-                product_ids = np.array(product_ids)
-
-            # Shortens the product ids array if more products are available than defined by dataframe.product_amount.
-            # Get random products ids if specified.
-            if rows < product_ids.shape[0]:
-                if random_r:
-                    product_ids = np.random.choice(product_ids, rows, replace=False)
+            with self.instrumentation.stage("product_selection") as stage:
+                if self.checkpoint is not None and self.checkpoint.product_ids is not None:
+                    # Use the (random) products of the checkpointed build.
+                    self.product_ids = np.array(self.checkpoint.product_ids)
+                    self.product_high_water_mark = self.checkpoint.manifest["product_high_water_mark"]
                 else:
-                    product_ids = product_ids[:rows]
-
-            # Set descending order
-            product_ids.sort()
-            self.product_ids = np.flip(product_ids)
-
+                    if not product_ids:
+                        products = self.query_products(df)
+                        # Products up to this id were considered by the build, including products that were not selected.
+                        product_high_water_mark = products.aggregate(last_id=Max('pk'))['last_id']
+                        self.product_high_water_mark = product_high_water_mark if product_high_water_mark is not None else df.product_high_water_mark
+                        # Only product_amount ids are transferred, either a seeded random sample or the newest products.
+                        # The newest products are the first product_amount ids of the former query, which kept the '-id' ordering of the model.
+                        if random_r:
+                            products = products.order_by(self.product_sample_key(df.random_seed), 'pk')
+                        else:
+                            products = products.order_by('-pk')
+                        product_ids = np.array(products.values_list('pk', flat=True)[:rows], dtype=np.int64)
+                        if self.refresh:
+                            # Select the products of a complete build. Only the products that were added since the last successful build are built,
+                            # the selected products of the previous build are kept and the others are dropped from its files.
+                            previous = product_ids <= df.product_high_water_mark
+                            self.previous_product_ids = product_ids[previous]
+                            product_ids = product_ids[~previous]
+                    # Use given product ids
+                    else:
+                        product_ids = np.array(product_ids)
+
+                        # Shortens the product ids array if more products are given than defined by dataframe.product_amount.
+                        # Get random products ids if specified.
+                        if rows < product_ids.shape[0]:
+                            if random_r:
+                                product_ids = np.random.default_rng(df.random_seed).choice(product_ids, rows, replace=False)
+                            else:
+                                product_ids = product_ids[:rows]
+
+                    # Set descending order
+                    product_ids.sort()
+                    self.product_ids = np.flip(product_ids)
+
+                    if self.checkpoint is not None:
+                        self.checkpoint.save_product_ids(self.product_ids, self.product_high_water_mark)
+                stage["rows"] = self.product_ids.shape[0]
+
+            # Nothing to append when no new product is selected.
+            if self.refresh and self.product_ids.shape[0] == 0:
+                DataFrame.objects.using(self.db).filter(pk=self.pk).update(**{"status": "Succeeded", "config_fingerprint": self.config_fingerprint, "product_high_water_mark": self.product_high_water_mark})
+                self.progress.finish()
+                return None
+
+            # Build the dataframe in parallel partitions. The status is updated by the partitions and the merge task.
+            if self.partition is None and not self.refresh and df.partitions > 1 and self.product_ids.shape[0] > 1:
+                # Store the stages before the MergeDataframePartitions task appends its stages.
+                self.save_instrumentation()
+                self.instrumentation = None
+                # The progress of the partitions is combined by the progress endpoint.
+                self.progress.update(stage="partitions", force=True)
+                self.submit_partitions(df.partitions, resume=self.checkpoint.resumed)
+                return None
+
+            # One step per product chunk and feature field.
+            if self.tsfresh_bool:
+                feature_fields = [features for features in (processparameter, target_value) if features]
+            else:
+                feature_fields = [features for features in (processparameter, qualitycharacteristics, target_value) if features]
+            self.product_chunks = -(-self.product_ids.shape[0] // self.product_chunk_size)
+            self.progress.start(steps_total=len(feature_fields) * self.product_chunks, features_total=sum(len(features) for features in feature_fields))
 
             # Check, whether aggregation is applied or data for time series are returned.
             if not self.tsfresh_bool:
@@ -326,21 +961,22 @@ class CreateDataframe(Task):
                 # Create a dataframe with features from the processparameters.
                 if processparameter:
                     df_pp_bool = True
-                    df_pp = self.create_processparameter_dataframe(processparameter=processparameter)
+                    df_pp = self.checkpointed("processparameter", processparameter, lambda: self.create_processparameter_dataframe(processparameter=processparameter))
                 else:
                     df_pp_bool = False
 
                 # Create a dataframe with features from the qualitycharacteristics.
                 if qualitycharacteristics:
                     df_qc_bool = True
-                    df_qc = self.create_qualiycharacteristics_dataframe(qualitycharacteristics=qualitycharacteristics, target=False)
+                    df_qc = self.checkpointed("qualitycharacteristics", qualitycharacteristics,
+                                              lambda: self.create_qualiycharacteristics_dataframe(qualitycharacteristics=qualitycharacteristics, target=False))
                 else:
                     df_qc_bool = False
 
                 # Create a dataframe with targets from the target_value(qualitycharacteristics).
                 if target_value:
                     df_target_bool = True
-                    df_target = self.create_qualiycharacteristics_dataframe(qualitycharacteristics=target_value, target=True)
+                    df_target = self.checkpointed("target_value", target_value, lambda: self.create_qualiycharacteristics_dataframe(qualitycharacteristics=target_value, target=True))
                 else:
                     df_target_bool = False
 
@@ -348,7 +984,24 @@ class CreateDataframe(Task):
                 # Create a dataframe in tsfresh format with features from the processparameters.
                 if processparameter:
                     df_pp_bool = True
-                    df_pp = self.create_processparameter_timeseries(processparameter=processparameter)
+                    if self.streaming_chunk_size:
+                        # Stream the sensorreadings directly to the x file in order to keep the memory usage bounded.
+                        if self.refresh:
+                            filename = "refresh/" + self.artifacts.filename("x")
+                        elif self.partition is None:
+                            filename = self.artifacts.filename("x")
+                        else:
+                            filename = MergeDataframePartitions.partition_filename(self.artifacts.filename("x"), self.partition)
+                        if self.checkpoint is None or not self.checkpoint.is_completed("processparameter"):
+                            self.stream_stacked_dataframe("processparameter", processparameter, filename=filename)
+                            if self.checkpoint is not None:
+                                self.checkpoint.save("processparameter")
+                        if self.refresh:
+                            with self.instrumentation.stage("upload_x"):
+                                self.merge_previous_stacked_build("x")
+                        df_pp = None
+                    else:
+                        df_pp = self.checkpointed("processparameter", processparameter, lambda: self.create_processparameter_timeseries(processparameter=processparameter))
                 else:
                     df_pp_bool = False
 
@@ -358,33 +1011,57 @@ class CreateDataframe(Task):
                 # Create a dataframe with targets from the target_value(qualitycharacteristics).
                 if target_value:
                     df_target_bool = True
-                    df_target = self.create_target_timeseries(qualitycharacteristics=target_value)
+                    df_target = self.checkpointed("target_value", target_value, lambda: self.create_target_timeseries(qualitycharacteristics=target_value))
                 else:
                     df_target_bool = False
 
             # Check if nessesary dataframes were created and update status.
             if (not df_pp_bool and not df_qc_bool) or not df_target_bool:
-                DataFrame.objects.using(self.db).filter(pk=self.pk).update(**{"status": "Failed"})
+                self.update_status("Failed")
+                self.update_partition(status="Failed", ended=timezone.now())
                 return
 
             # Merge processparameter_featuers dataframe and quality_features dataframe in order to save them as one dataframe.
             if df_pp_bool and df_qc_bool:
-                to_pd_fth(output_path=self.save_path, filename="x.fth", dataframe=pd.merge(df_pp, df_qc, left_index=True, right_index=True))
+                with self.instrumentation.stage("merge") as stage:
+                    df_x = pd.merge(df_pp, df_qc, left_index=True, right_index=True)
+                    stage["rows"] = df_x.shape[0]
+                self.save_dataframe("x", df_x)
             elif df_pp_bool:
-                to_pd_fth(output_path=self.save_path, filename="x.fth", dataframe=df_pp)
+                # A streamed dataframe was already written to the x file.
+                if df_pp is not None:
+                    self.save_dataframe("x", df_pp)
             elif df_qc_bool:
-                to_pd_fth(output_path=self.save_path, filename="x.fth", dataframe=df_qc)
+                self.save_dataframe("x", df_qc)
             else:
-                DataFrame.objects.using(self.db).filter(pk=self.pk).update(**{"status": "Failed"})
+                self.update_status("Failed")
 
             # Save the target dataframe.
-            to_pd_fth(output_path=self.save_path, filename="y.fth", dataframe=df_target)
-            # Update the dataframe status
-            DataFrame.objects.using(self.db).filter(pk=self.pk).update(**{"status": "Succeeded"})
+            self.save_dataframe("y", df_target)
+            # Update the dataframe status. The status of partitioned builds is set by the MergeDataframePartitions task.
+            if self.partition is None:
+                DataFrame.objects.using(self.db).filter(pk=self.pk).update(**{"status": "Succeeded", "fingerprint": self.fingerprint, "config_fingerprint": self.config_fingerprint,
+                                                                           "product_high_water_mark": self.product_high_water_mark})
+            self.update_partition(status="Succeeded", ended=timezone.now())
+            if self.checkpoint is not None:
+                self.checkpoint.clear()
+            self.progress.finish()
+            return None
+        except BuildCancelled:
+            # Keep the checkpoints, a re-submitted build resumes from them.
+            self.update_status("Cancelled")
+            self.update_partition(status="Cancelled", ended=timezone.now())
+            self.progress.stage = "Cancelled"
+            self.progress.publish(force=True)
             return None
         except Exception as e:
-            DataFrame.objects.using(self.db).filter(pk=self.pk).update(**{"status": "Failed"})
+            self.update_status("Failed")
+            self.update_partition(status="Failed", ended=timezone.now())
+            self.progress.publish(force=True)
             raise e
+        finally:
+            if self.instrumentation is not None:
+                self.save_instrumentation()
 
 
 
@@ -0,0 +1,171 @@
+# Copyright (c) 2022 RWTH Aachen - Werkzeugmaschinenlabor (WZL)
+# Contact: Simon Cramer, s.cramer@wzl-mq.rwth-aachen.de
+
+import os
+from contextlib import contextmanager
+
+from s3_smart_open import to_pd_fth
+from smart_open import open as smart_open
+
+import pyarrow as pa
+from pyarrow import feather  # Avoid local import error of s3_smart_open
+from pyarrow import compute as pc
+from pyarrow import ipc
+from pyarrow import parquet as pq
+
+
+class DataFrameArtifacts:
+    """Reads and writes the files (artifacts) of a dataframe build at its save_path in the artifact format of the dataframe.
+    Uncompressed float64 feather files are written with s3_smart_open.to_pd_fth, all other formats with pyarrow.
+
+    Parquet files are split into row groups with column statistics and dictionary encode the id and kind columns of timeseries in tsfresh format.
+    The Arrow IPC file format of feather does not support the replacement of dictionaries between streamed record batches, feather files are not dictionary encoded.
+    """
+    extensions = {"feather": "fth", "parquet": "parquet"}
+    # Columns of timeseries in tsfresh format with few distinct values.
+    dictionary_columns = ["id", "kind"]
+
+    def __init__(self, save_path, artifact_format="feather", compression="uncompressed", float32=False, row_group_size=None):
+        """Set the artifact format.
+
+        Args:
+            save_path (str): Directory or S3 prefix of the files.
+            artifact_format (str, optional): One of feather or parquet. Defaults to "feather".
+            compression (str, optional): One of uncompressed, zstd, lz4 or snappy (parquet only). Defaults to "uncompressed".
+            float32 (bool, optional): Whether to downcast float64 columns to float32. Defaults to False.
+            row_group_size (int, optional): Maximum amount of rows per parquet row group. Defaults to the pyarrow default.
+        """
+        self.save_path = save_path
+        self.artifact_format = artifact_format
+        self.compression = None if compression == "uncompressed" else compression
+        self.float32 = float32
+        self.row_group_size = row_group_size
+
+    @classmethod
+    def from_dataframe(cls, df):
+        """Create the artifacts of a DataFrame instance."""
+        return cls(df.save_path, df.artifact_format, df.compression, df.float32, df.row_group_size)
+
+    @property
+    def legacy(self):
+        """Whether the files are uncompressed float64 feather files of to_pd_fth."""
+        return self.artifact_format == "feather" and self.compression is None and not self.float32
+
+    def filename(self, name):
+        """Name of the file of a dataframe, e.g. x.fth or x.parquet."""
+        return "{}.{}".format(name, self.extensions[self.artifact_format])
+
+    def path(self, filename):
+        """Path of a file at the save_path. The directories of local paths are created, e.g. checkpoints/ or partitions/, URIs like s3:// do not need them."""
+        path = self.save_path.rstrip('/') + '/' + filename
+        if "://" not in path:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        return path
+
+    def output_schema(self, schema):
+        """Schema of the written files, float64 fields are downcasted to float32 if specified."""
+        if not self.float32:
+            return schema
+        return pa.schema([pa.field(field.name, pa.float32()) if field.type == pa.float64() else field for field in schema], metadata=schema.metadata)
+
+    def cast(self, data, schema):
+        """Cast a record batch or table to the schema."""
+        columns = [column.cast(field.type) for column, field in zip(data.columns, schema)]
+        return type(data).from_arrays(columns, schema=schema)
+
+    @contextmanager
+    def stream(self, filename, schema):
+        """Open a writer that appends record batches to a file at the save_path.
+
+        Args:
+            filename (str): Name of the file.
+            schema (pa.Schema): Schema of the record batches.
+
+        Yields:
+            [callable]: Function that writes a record batch or table.
+        """
+        output_schema = self.output_schema(schema)
+        with smart_open(self.path(filename), 'wb') as f:
+            if self.artifact_format == "parquet":
+                use_dictionary = [name for name in self.dictionary_columns if name in output_schema.names]
+                with pq.ParquetWriter(f, output_schema, compression=self.compression or "none", use_dictionary=use_dictionary, write_statistics=True) as writer:
+                    yield lambda data: writer.write_table(self.cast(pa.Table.from_batches([data]) if isinstance(data, pa.RecordBatch) else data, output_schema), row_group_size=self.row_group_size)
+            else:
+                with ipc.new_file(f, output_schema, options=ipc.IpcWriteOptions(compression=self.compression)) as writer:
+                    yield lambda data: writer.write(self.cast(data, output_schema))
+
+    def write(self, name, dataframe):
+        """Write a dataframe to the file of the name at the save_path. The index is stored unless it is a RangeIndex.
+
+        Args:
+            name (str): Name of the dataframe, e.g. x or y.
+            dataframe (pd.DataFrame): Dataframe to save.
+        """
+        if self.legacy:
+            to_pd_fth(output_path=self.save_path, filename=self.filename(name), dataframe=dataframe)
+            return
+
+        table = pa.Table.from_pandas(dataframe, preserve_index=None)
+        with self.stream(self.filename(name), table.schema) as write:
+            write(table)
+
+    def iter_batches(self, filename):
+        """Read the record batches of a file at the save_path one after another.
+
+        Args:
+            filename (str): Name of the file.
+
+        Yields:
+            [pa.RecordBatch]: record batches of the file
+        """
+        with smart_open(self.path(filename), 'rb') as f:
+            if filename.endswith(".parquet"):
+                yield from pq.ParquetFile(f).iter_batches()
+            else:
+                reader = ipc.open_file(f)
+                for i in range(reader.num_record_batches):
+                    yield reader.get_batch(i)
+
+    def read_schema(self, filename):
+        """Read the schema of a file at the save_path."""
+        with smart_open(self.path(filename), 'rb') as f:
+            if filename.endswith(".parquet"):
+                return pq.ParquetFile(f).schema_arrow
+            return ipc.open_file(f).schema
+
+    def read(self, name):
+        """Read the dataframe of the name from the save_path.
+
+        Args:
+            name (str): Name of the dataframe, e.g. x or y.
+
+        Returns:
+            [pd.DataFrame]: Dataframe with the product ids as index, timeseries in tsfresh format keep their RangeIndex.
+        """
+        with smart_open(self.path(self.filename(name)), 'rb') as f:
+            if self.artifact_format == "parquet":
+                dataframe = pq.read_table(f).to_pandas()
+            else:
+                dataframe = feather.read_feather(f)
+        # Restore the product ids when the index was stored as plain column.
+        if 'index' in dataframe.columns:
+            dataframe = dataframe.set_index('index')
+            dataframe.index.name = None
+
+        return dataframe
+
+    def concat(self, input_filenames, output_filename, ids=None):
+        """Append the record batches of files with the same schema to one file without loading them at once.
+
+        Args:
+            input_filenames (list[str]): Names of the files at the save_path in the order of concatenation.
+            output_filename (str): Name of the concatenated file.
+            ids (list[int], optional): Only rows whose id column is one of the ids are kept. Defaults to None (all rows).
+        """
+        value_set = None if ids is None else pa.array(ids, type=pa.int64())
+        with self.stream(output_filename, self.read_schema(input_filenames[0])) as write:
+            for input_filename in input_filenames:
+                for batch in self.iter_batches(input_filename):
+                    if value_set is not None:
+                        batch = batch.filter(pc.is_in(batch.column('id').cast(pa.int64()), value_set=value_set))
+                    write(batch)
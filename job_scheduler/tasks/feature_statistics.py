@@ -0,0 +1,94 @@
+# Copyright (c) 2022 RWTH Aachen - Werkzeugmaschinenlabor (WZL)
+# Contact: Simon Cramer, s.cramer@wzl-mq.rwth-aachen.de
+
+import numpy as np
+
+
+# Quantiles that are available as methods.
+quantile_methods = {"Median": 0.5, "P05": 0.05, "P25": 0.25, "P75": 0.75, "P95": 0.95}
+# All methods that are computed by segment_statistics.
+segment_methods = ["Min", "Max", "Avg", "StdDev", "Count", "Range", "RMS", "Skew", "Kurtosis", "First", "Last"] + list(quantile_methods.keys())
+
+
+def segment_starts(*keys):
+    """Find the first position of each segment of equal consecutive keys.
+
+    Args:
+        keys (np.ndarray): Arrays of equal length that define the segments, e.g. product ids and feature ids.
+
+    Returns:
+        [np.ndarray]: Positions of the first element of each segment.
+    """
+    changes = np.zeros(keys[0].shape[0], dtype=bool)
+    changes[:1] = True
+    for key in keys:
+        changes[1:] |= key[1:] != key[:-1]
+
+    return np.flatnonzero(changes)
+
+
+def segment_quantiles(values, starts, counts, quantile):
+    """Quantile of each segment with linear interpolation like np.quantile.
+
+    Args:
+        values (np.ndarray): Values that are sorted within each segment.
+        starts (np.ndarray): Positions of the first element of each segment.
+        counts (np.ndarray): Amount of values per segment.
+        quantile (float): Quantile between 0 and 1.
+
+    Returns:
+        [np.ndarray]: Quantile of each segment.
+    """
+    position = quantile * (counts - 1)
+    lower = np.floor(position).astype(np.int64)
+    upper = np.ceil(position).astype(np.int64)
+    lower_values = values[starts + lower]
+    upper_values = values[starts + upper]
+
+    return lower_values + (position - lower) * (upper_values - lower_values)
+
+
+def segment_statistics(values, starts, methods):
+    """Compute the methods for all segments of values with one pass of segment reductions.
+    StdDev, Skew and Kurtosis are population statistics, Kurtosis is the excess kurtosis. They are NaN for constant segments.
+
+    Args:
+        values (np.ndarray): float64 values without NaN, ordered by date within each segment.
+        starts (np.ndarray): Positions of the first element of each segment, see segment_starts.
+        methods (list[str]): Methods out of segment_methods.
+
+    Returns:
+        [np.ndarray]: float64 array with shape (len(starts), len(methods)).
+    """
+    ends = np.append(starts[1:], values.shape[0])
+    counts = ends - starts
+    statistics = {"Count": counts.astype("float64"),
+                  "First": values[starts],
+                  "Last": values[ends - 1],
+                  "Min": np.minimum.reduceat(values, starts),
+                  "Max": np.maximum.reduceat(values, starts),
+                  }
+    statistics["Range"] = statistics["Max"] - statistics["Min"]
+    statistics["Avg"] = np.add.reduceat(values, starts) / counts
+    statistics["RMS"] = np.sqrt(np.add.reduceat(values * values, starts) / counts)
+
+    # Central moments
+    if {"StdDev", "Skew", "Kurtosis"} & set(methods):
+        deviations = values - np.repeat(statistics["Avg"], counts)
+        squared_deviations = deviations * deviations
+        m2 = np.add.reduceat(squared_deviations, starts) / counts
+        statistics["StdDev"] = np.sqrt(m2)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            m2 = np.where(m2 > 0, m2, np.nan)
+            statistics["Skew"] = np.add.reduceat(squared_deviations * deviations, starts) / counts / m2 ** 1.5
+            statistics["Kurtosis"] = np.add.reduceat(squared_deviations * squared_deviations, starts) / counts / m2 ** 2 - 3
+
+    # Quantiles of the values sorted within each segment.
+    if set(quantile_methods.keys()) & set(methods):
+        segment_ids = np.repeat(np.arange(starts.shape[0]), counts)
+        sorted_values = values[np.lexsort((values, segment_ids))]
+        for method, quantile in quantile_methods.items():
+            if method in methods:
+                statistics[method] = segment_quantiles(sorted_values, starts, counts, quantile)
+
+    return np.column_stack([statistics[method] for method in methods])
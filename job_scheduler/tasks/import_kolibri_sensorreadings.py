@@ -3,8 +3,9 @@ from more_itertools import chunked
 from absl import logging
 from celery import shared_task
 import django
+from django.db import transaction
 
-from orakel.models.basic import ProcessParameter, ProcessStep, QualityCharacteristics, SensorReading
+from orakel.models.basic import ProcessParameter, ProcessStep, QualityCharacteristics, SensorReading, SensorReadingSummary, SensorReadingRollup, SensorReadingDateRange
 from orakel_api.settings import DATABASES
 
 
@@ -73,8 +74,13 @@ def c_import_kolibri_sensorreadings(sensorreadings):
 
         # save batches of objects in database
         logging.debug('Generated a batch of {} sensorreadings. Entering into DB now.'.format(len(objs)))
-        for batch in list(chunked(objs,batch_size)):
-            SensorReading.objects.using(db_name).bulk_create(objs=batch, batch_size=batch_size)
+        with transaction.atomic(using=db_name):
+            for batch in list(chunked(objs,batch_size)):
+                SensorReading.objects.using(db_name).bulk_create(objs=batch, batch_size=batch_size)
+            # update the summaries of the processsteps, the rollups and the date ranges with the new sensorreadings
+            SensorReadingSummary.objects.add_readings(objs, using=db_name)
+            SensorReadingRollup.objects.add_readings(objs, using=db_name)
+            SensorReadingDateRange.objects.add_readings(objs, using=db_name)
         logging.info('Entered {} sensorreadings into DB.'.format(len(objs)))
     except Exception as e:
         raise e
@@ -0,0 +1,83 @@
+# Copyright (c) 2022 RWTH Aachen - Werkzeugmaschinenlabor (WZL)
+# Contact: Simon Cramer, s.cramer@wzl-mq.rwth-aachen.de
+
+from contextlib import contextmanager
+import resource
+import time
+
+from django.db import connections
+from django.utils import timezone
+
+from celery.utils.log import get_task_logger
+
+
+logger = get_task_logger(__name__)
+
+
+def peak_rss_mb():
+    """Peak resident set size of the worker process in MB (ru_maxrss is reported in KB on Linux)."""
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+
+
+class Instrumentation:
+    """Records the wall time, fetched rows, SQL queries and peak RSS of the stages of a task.
+    The stages are stored in the order they finished, nested stages are contained in the values of their parent stage.
+    """
+
+    def __init__(self, database_name):
+        """
+        Args:
+            database_name (str): Name of the database whose queries are counted.
+        """
+        self.db = database_name
+        self.started = timezone.now()
+        self.start_time = time.perf_counter()
+        self.stages = []
+        # Records of the stages that have not finished yet.
+        self.active_stages = []
+
+    @contextmanager
+    def stage(self, name):
+        """Record a stage. Increase the rows of the yielded record with the amount of fetched or written rows.
+        Queries are counted when they are executed with a Django cursor of the database within the stage.
+
+        Args:
+            name (str): Name of the stage.
+
+        Yields:
+            [dict]: Record of the stage.
+        """
+        record = {"stage": name, "seconds": None, "rows": 0, "queries": 0, "peak_rss_mb": None}
+
+        def count_queries(execute, sql, params, many, context):
+            record["queries"] += 1
+            return execute(sql, params, many, context)
+
+        start_time = time.perf_counter()
+        self.active_stages.append(record)
+        try:
+            with connections[self.db].execute_wrapper(count_queries):
+                yield record
+        finally:
+            self.active_stages.remove(record)
+            record["seconds"] = round(time.perf_counter() - start_time, 3)
+            record["peak_rss_mb"] = peak_rss_mb()
+            self.stages.append(record)
+            logger.info("Elapsed time: %6.3f seconds %s", record["seconds"], name)
+
+    def count_query(self):
+        """Count a query that is executed without the execute wrappers of Django, e.g. with a raw server-side cursor."""
+        for record in self.active_stages:
+            record["queries"] += 1
+
+    def to_dict(self):
+        """Summary of the recorded stages for the instrumentation JSON field.
+
+        Returns:
+            [dict]: started, seconds, peak_rss_mb and the list of stages.
+        """
+        return {"started": self.started.isoformat(),
+                "seconds": round(time.perf_counter() - self.start_time, 3),
+                "peak_rss_mb": peak_rss_mb(),
+                "stages": self.stages,
+                }
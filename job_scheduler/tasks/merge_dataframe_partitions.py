@@ -0,0 +1,149 @@
+# Copyright (c) 2022 RWTH Aachen - Werkzeugmaschinenlabor (WZL)
+# Contact: Simon Cramer, s.cramer@wzl-mq.rwth-aachen.de
+
+from orakel.models import DataFrame, DataFramePartition
+
+from celery import Task
+from job_scheduler import job_scheduler
+
+from .dataframe_artifacts import DataFrameArtifacts
+from .instrumentation import Instrumentation
+from .progress import BuildProgress
+from .checkpoints import BuildCheckpoint
+
+import pandas as pd
+
+from smart_open import open as smart_open
+
+
+class MergeDataframePartitions(Task):
+    """Celery task to concatenate the partial dataframes of a partitioned CreateDataframe build into the x and y files.
+    The task is the callback of the chord of partition tasks and runs when all partitions succeeded.
+
+    Returns:
+        [Exception]: Returns Exception Message if an error occurs.
+    """
+    name = "Merge_pd.DataFrame_Partitions"
+    ignore_result = False # Will save the return value / Task result in the database.
+    decription = "Concatenate the partial pandas DataFrames of a partitioned build."
+    queue = "large_task"
+
+    # Use .using(self.db) for every queryset!
+
+    @staticmethod
+    def partition_filename(filename, partition):
+        """Name of the partial file of a partition, e.g. partitions/x_3.fth.
+
+        Args:
+            filename (str): Name of the file without partition index.
+            partition (int): Index of the partition.
+
+        Returns:
+            [str]: Name of the partial file relative to the save_path.
+        """
+        name, extension = filename.rsplit('.', 1)
+        return "partitions/{}_{}.{}".format(name, partition, extension)
+
+    def artifact_path(self, filename):
+        """Path of a file at the save_path of the dataframe."""
+        return self.artifacts.path(filename)
+
+    def read_partitions(self, filename):
+        """Read and concatenate the pickled partial dataframes of all partitions.
+
+        Args:
+            filename (str): Name of the partial files, e.g. x.pkl.
+
+        Returns:
+            [pd.DataFrame]: Concatenated partial dataframes in partition order.
+        """
+        partial_dataframes = []
+        for partition in range(self.partitions):
+            with smart_open(self.artifact_path(self.partition_filename(filename, partition)), 'rb') as f:
+                partial_dataframes.append(pd.read_pickle(f))
+
+        return pd.concat(partial_dataframes)
+
+    def concat_stacked_partitions(self, filename):
+        """Append the Arrow record batches of the partial timeseries files to one file without loading them at once.
+
+        Args:
+            filename (str): Name of the final file and of the partial files.
+        """
+        self.artifacts.concat([self.partition_filename(filename, partition) for partition in range(self.partitions)], filename)
+
+    def run(self, results, pk, database_name, partitions, time_series, fingerprint=None, config_fingerprint=None, product_high_water_mark=None, *args, **kwargs):
+        """Concatenate the partial dataframes and update the dataframe status.
+
+        Args:
+            results (list): Results of the partition tasks (unused).
+            pk (int): primary key of the dataframe instance.
+            database_name (str): Name of the database where the dataframe object is stored.
+            partitions (int): Amount of partitions.
+            time_series (bool): Whether the partitions contain timeseries in tsfresh format (StackedDataFrame).
+            fingerprint (str, optional): Fingerprint of the build, stored when the files were saved. Defaults to None.
+            config_fingerprint (str, optional): Fingerprint of the configuration of the build, stored when the files were saved. Defaults to None.
+            product_high_water_mark (int, optional): Highest product id that was considered by the build. Defaults to None.
+
+        Returns:
+            [None or error]: if an error occurs, the error message will be returned. Else None.
+        """
+        self.pk = pk
+        self.db = database_name
+        self.partitions = partitions
+        self.instrumentation = Instrumentation(self.db)
+        try:
+            df = DataFrame.objects.using(self.db).get(pk=self.pk)
+            self.artifacts = DataFrameArtifacts.from_dataframe(df)
+
+            # Cancelled partitions finish without error, the partial files are incomplete.
+            partition_queryset = DataFramePartition.objects.using(self.db).filter(dataframe=self.pk)
+            if df.cancel_requested or partition_queryset.exclude(status="Succeeded").exists():
+                progress = BuildProgress.combine(partition_queryset.values_list('progress', flat=True))
+                progress.update(stage="Cancelled")
+                DataFrame.objects.using(self.db).filter(pk=self.pk).update(**{"status": "Cancelled", "progress": progress})
+                return None
+
+            if time_series:
+                # Partitions cover ascending product ranges, the timeseries stay ordered by product id.
+                with self.instrumentation.stage("upload_x"):
+                    self.concat_stacked_partitions(self.artifacts.filename("x"))
+                with self.instrumentation.stage("upload_y") as stage:
+                    df_y = self.read_partitions("y.pkl")
+                    self.artifacts.write("y", df_y)
+                    stage["rows"] = df_y.shape[0]
+            else:
+                # Restore the descending product order of a single build.
+                for name in ("x", "y"):
+                    with self.instrumentation.stage("upload_" + name) as stage:
+                        dataframe = self.read_partitions(name + ".pkl").sort_index(ascending=False)
+                        self.artifacts.write(name, dataframe)
+                        stage["rows"] = dataframe.shape[0]
+
+            DataFrame.objects.using(self.db).filter(pk=self.pk).update(**{"status": "Succeeded", "fingerprint": fingerprint, "config_fingerprint": config_fingerprint,
+                                                                       "product_high_water_mark": product_high_water_mark})
+            # The checkpoints of the partitions were cleared by the partitions.
+            BuildCheckpoint(self.artifacts, config_fingerprint).clear()
+            # Store the combined progress of the finished partitions.
+            progress = BuildProgress.combine(partition_queryset.values_list('progress', flat=True))
+            progress.update(stage="Succeeded", percent=100.0, eta_seconds=0.0)
+            DataFrame.objects.using(self.db).filter(pk=self.pk).update(progress=progress)
+            return None
+        except Exception as e:
+            DataFrame.objects.using(self.db).filter(pk=self.pk).update(**{"status": "Failed"})
+            raise e
+        finally:
+            self.save_instrumentation()
+
+    def save_instrumentation(self):
+        """Append the recorded stages of the merge to the instrumentation of the dataframe, which was stored by the task that submitted the partitions."""
+        instrumentation = DataFrame.objects.using(self.db).filter(pk=self.pk).values_list('instrumentation', flat=True).first() or {}
+        merge = self.instrumentation.to_dict()
+        instrumentation["stages"] = instrumentation.get("stages", []) + merge["stages"]
+        instrumentation["merge_seconds"] = merge["seconds"]
+        instrumentation["merge_peak_rss_mb"] = merge["peak_rss_mb"]
+        DataFrame.objects.using(self.db).filter(pk=self.pk).update(instrumentation=instrumentation)
+
+
+# Register the task
+job_scheduler.tasks.register(MergeDataframePartitions())
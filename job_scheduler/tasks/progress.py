@@ -0,0 +1,148 @@
+# Copyright (c) 2022 RWTH Aachen - Werkzeugmaschinenlabor (WZL)
+# Contact: Simon Cramer, s.cramer@wzl-mq.rwth-aachen.de
+
+import time
+
+from django.utils import timezone
+
+
+class BuildCancelled(Exception):
+    """Raised by BuildProgress when the cancellation of the build was requested."""
+
+
+class BuildProgress:
+    """Tracks the progress of a dataframe build and publishes it as Celery task state (PROGRESS) and through a save function,
+    which mirrors it into the database. Publishing is throttled to at most once per min_interval seconds.
+
+    The progress is measured in steps, one step is one product chunk of one feature field (processparameter, qualitycharacteristics or target_value).
+    Each publication of an update also checks whether the build was cancelled, so running builds stop cooperatively.
+    """
+
+    def __init__(self, task=None, save=None, min_interval=2.0, cancelled=None):
+        """
+        Args:
+            task (celery.Task, optional): Task whose state is updated. The state is only published when the task runs with a task id. Defaults to None.
+            save (callable, optional): Function that stores the progress dict, e.g. in the DataFrame instance. Defaults to None.
+            min_interval (float, optional): Minimum amount of seconds between two publications. Defaults to 2.0.
+            cancelled (callable, optional): Function that returns whether the cancellation of the build was requested. Defaults to None.
+        """
+        self.task = task
+        self.save = save
+        self.min_interval = min_interval
+        self.cancelled = cancelled
+        self.stage = "Scheduled"
+        self.steps_total = 0
+        self.steps_done = 0
+        self.features_total = 0
+        self.features_done = 0
+        self.rows = 0
+        self.finished = False
+        self.start_time = time.perf_counter()
+        self.published_time = None
+
+    def start(self, steps_total, features_total):
+        """Set the total amount of steps and features of the build and publish the progress.
+
+        Args:
+            steps_total (int): Amount of product chunks of all feature fields.
+            features_total (int): Amount of processparameters, qualitycharacteristics and target_values.
+        """
+        self.steps_total = steps_total
+        self.features_total = features_total
+        self.publish(force=True)
+
+    def update(self, stage=None, steps=0, features=0, rows=0, force=False):
+        """Advance the progress and publish it if the last publication is older than min_interval.
+        Raises BuildCancelled when the progress was published and the cancellation of the build was requested.
+
+        Args:
+            stage (str, optional): Name of the current stage. Defaults to None (unchanged).
+            steps (int, optional): Amount of finished steps. Defaults to 0.
+            features (int, optional): Amount of finished features. Defaults to 0.
+            rows (int, optional): Amount of processed rows. Defaults to 0.
+            force (bool, optional): Publish regardless of the interval. Defaults to False.
+        """
+        if stage is not None:
+            self.stage = stage
+        self.steps_done += steps
+        self.features_done += features
+        self.rows += rows
+        if self.publish(force) and self.cancelled is not None and self.cancelled():
+            raise BuildCancelled()
+
+    def finish(self, stage="Succeeded"):
+        """Mark the build as finished and publish the progress."""
+        self.stage = stage
+        self.finished = True
+        self.publish(force=True)
+
+    def to_dict(self):
+        """Progress of the build.
+
+        Returns:
+            [dict]: stage, percent, steps, features, rows, elapsed and estimated remaining seconds and the time of the update.
+        """
+        elapsed = time.perf_counter() - self.start_time
+        if self.finished:
+            fraction = 1.0
+        elif self.steps_total:
+            fraction = min(self.steps_done / self.steps_total, 1.0)
+        else:
+            fraction = 0.0
+        # Assume that the remaining steps take as long as the finished ones.
+        eta = round(elapsed * (1 - fraction) / fraction, 1) if fraction > 0 else None
+
+        return {"stage": self.stage,
+                "percent": round(100 * fraction, 1),
+                "steps_done": self.steps_done,
+                "steps_total": self.steps_total,
+                "features_done": self.features_done,
+                "features_total": self.features_total,
+                "rows": self.rows,
+                "elapsed_seconds": round(elapsed, 1),
+                "eta_seconds": eta,
+                "updated": timezone.now().isoformat(),
+                }
+
+    def publish(self, force=False):
+        """Publish the progress as task state and save it, unless it was published less than min_interval seconds ago.
+
+        Args:
+            force (bool, optional): Publish regardless of the interval. Defaults to False.
+
+        Returns:
+            [bool]: Whether the progress was published.
+        """
+        now = time.perf_counter()
+        if not force and self.published_time is not None and now - self.published_time < self.min_interval:
+            return False
+        self.published_time = now
+
+        progress = self.to_dict()
+        # Task instances that are not bound to the app (e.g. called directly) have no request.
+        if self.task is not None and self.task.request_stack is not None and self.task.request.id:
+            self.task.update_state(state="PROGRESS", meta=progress)
+        if self.save is not None:
+            self.save(progress)
+        return True
+
+    @staticmethod
+    def combine(progresses):
+        """Combine the progress of the partitions of a build.
+
+        Args:
+            progresses (list[dict or None]): Progress dicts of the partitions, None for partitions that have not started.
+
+        Returns:
+            [dict]: percent, features, rows and the estimated remaining seconds of the slowest partition.
+        """
+        progresses = [progress or {} for progress in progresses]
+        etas = [progress.get("eta_seconds") for progress in progresses]
+
+        return {"stage": "partitions",
+                "percent": round(sum(progress.get("percent", 0) for progress in progresses) / max(len(progresses), 1), 1),
+                "features_done": sum(progress.get("features_done", 0) for progress in progresses),
+                "features_total": sum(progress.get("features_total", 0) for progress in progresses),
+                "rows": sum(progress.get("rows", 0) for progress in progresses),
+                "eta_seconds": max(etas) if etas and None not in etas else None,
+                }
@@ -0,0 +1,136 @@
+# Copyright (c) 2022 RWTH Aachen - Werkzeugmaschinenlabor (WZL)
+# Contact: Simon Cramer, s.cramer@wzl-mq.rwth-aachen.de
+
+import datetime
+
+from django.conf import settings
+from django.db.models import Exists, OuterRef, Q
+from django.utils import timezone
+
+from orakel.models import ProcessParameter, ProcessStep, QualityCharacteristics, Sensor, SensorReading, SensorReadingDateRange, SensorReadingRollup, SensorReadingSummary
+
+from celery import Task
+from job_scheduler import job_scheduler
+from more_itertools import chunked
+
+
+class RollupSensorReadings(Task):
+    """Celery task to catch up the SensorReadingRollup, SensorReadingSummary and SensorReadingDateRange instances. The task is performed periodically.
+    Rollups and summaries are rebuilt for processsteps with sensorreadings but without rollups or summaries, e.g. after imports that bypass them or for sensorreadings
+    that were written before they existed, and for processsteps that started or ended within the lookback period to include late sensorreadings.
+    The rollups of sensorreadings without processstep are rebuilt for series without such rollups.
+    The date ranges of the series of these processsteps are rebuilt as well. Series with sensorreadings but without date range or that are not marked as rolled up are caught up
+    completely: the rollups of all their sensorreadings and their date ranges are rebuilt and the series are marked as rolled up.
+
+    Returns:
+        [dict]: Amount of processsteps whose rollups and summaries were rebuilt per database.
+    """
+    name = "Rollup_SensorReadings"
+    ignore_result = False # Will save the return value / Task result in the database.
+    decription = "Catch up the multi-resolution rollups, the summaries and the date ranges of the sensorreadings."
+    queue = "small_task"
+
+    # Use .using(self.db) for every queryset!
+
+    def pending_processsteps(self, lookback):
+        """Ids of the processsteps whose rollups and summaries have to be rebuilt.
+
+        Args:
+            lookback (datetime.timedelta): Processsteps that started or ended within this period are rebuilt.
+
+        Returns:
+            [QuerySet]: Ids of the processsteps.
+        """
+        since = timezone.now() - lookback
+        recent = Q(started__gte=since) | Q(ended__gte=since)
+        has_readings = Exists(SensorReading.objects.using(self.db).filter(processstep=OuterRef('pk'), value__isnull=False, date__isnull=False))
+        has_rollups = Exists(SensorReadingRollup.objects.using(self.db).filter(processstep=OuterRef('pk')))
+        # Only sensorreadings of processparameters and qualitycharacteristics are summarized.
+        has_feature_readings = Exists(SensorReading.objects.using(self.db).filter(Q(processparameter__isnull=False) | Q(qualitycharacteristics__isnull=False),
+                                                                                  processstep=OuterRef('pk'), value__isnull=False))
+        has_summaries = Exists(SensorReadingSummary.objects.using(self.db).filter(processstep=OuterRef('pk')))
+        queryset = ProcessStep.objects.using(self.db).filter((Q(has_readings) & (~Q(has_rollups) | recent)) | (Q(has_feature_readings) & (~Q(has_summaries) | recent)))
+        return queryset.order_by('pk').values_list('pk', flat=True)
+
+    def series_without_date_range(self):
+        """Series with sensorreadings but without date range.
+
+        Returns:
+            [dict]: Ids of the sensors, processparameters and qualitycharacteristics per series field.
+        """
+        series = {}
+        for series_field, model in (('sensor', Sensor), ('processparameter', ProcessParameter), ('qualitycharacteristics', QualityCharacteristics)):
+            has_readings = Exists(SensorReading.objects.using(self.db).filter(**{series_field: OuterRef('pk'), 'date__isnull': False}))
+            has_date_range = Exists(SensorReadingDateRange.objects.using(self.db).filter(**{series_field: OuterRef('pk')}))
+            series[series_field] = set(model.objects.using(self.db).filter(has_readings).filter(~has_date_range).order_by().values_list('pk', flat=True))
+        return series
+
+    def series_without_rollups(self):
+        """Series with sensorreadings without processstep but without rollups of them.
+
+        Returns:
+            [dict]: Ids of the sensors, processparameters and qualitycharacteristics per series field.
+        """
+        series = {}
+        for series_field, model in (('sensor', Sensor), ('processparameter', ProcessParameter), ('qualitycharacteristics', QualityCharacteristics)):
+            has_readings = Exists(SensorReading.objects.using(self.db).filter(**{series_field: OuterRef('pk'), 'processstep__isnull': True, 'value__isnull': False, 'date__isnull': False}))
+            has_rollups = Exists(SensorReadingRollup.objects.using(self.db).filter(**{series_field: OuterRef('pk'), 'processstep__isnull': True}))
+            series[series_field] = set(model.objects.using(self.db).filter(has_readings).filter(~has_rollups).order_by().values_list('pk', flat=True))
+        return series
+
+    def processsteps_of(self, series):
+        """Ids of the processsteps with sensorreadings of series.
+
+        Args:
+            series (dict): Ids of the sensors, processparameters and qualitycharacteristics per series field.
+
+        Returns:
+            [set]: Ids of the processsteps.
+        """
+        processstep_ids = set()
+        for series_field, series_ids in series.items():
+            for batch in chunked(list(series_ids), SensorReadingDateRange.objects.batch_size):
+                sr_queryset = SensorReading.objects.using(self.db).filter(**{series_field + '__in': batch, 'processstep__isnull': False})
+                processstep_ids |= set(sr_queryset.order_by().values_list('processstep', flat=True).distinct())
+        return processstep_ids
+
+    def run(self, database_name=None, processstep_ids=None, lookback_hours=24, batch_size=500, *args, **kwargs):
+        """Rebuild the rollups and the summaries of the pending or of the given processsteps.
+
+        Args:
+            database_name (str, optional): Name of the database. Defaults to None (all databases).
+            processstep_ids (list[int], optional): Ids of the processsteps that are rebuilt instead of the pending processsteps. Defaults to None.
+            lookback_hours (int, optional): Processsteps that started or ended within this amount of hours are rebuilt. Defaults to 24.
+            batch_size (int, optional): Amount of processsteps that are rebuilt per transaction. Defaults to 500.
+
+        Returns:
+            [dict]: Amount of processsteps whose rollups and summaries were rebuilt per database.
+        """
+        rebuilt = {}
+        for db in [database_name] if database_name else settings.DATABASES.keys():
+            self.db = db
+            ids = processstep_ids if processstep_ids is not None else list(self.pending_processsteps(datetime.timedelta(hours=lookback_hours)))
+            series, caught_up = {}, {}
+            if processstep_ids is None:
+                # Every sensorreading of the series without date range or not rolled up is rolled up again, afterwards the series are rolled up.
+                without_date_range, not_rolled_up = self.series_without_date_range(), SensorReadingDateRange.objects.series_not_rolled_up(using=self.db)
+                caught_up = {series_field: without_date_range[series_field] | not_rolled_up[series_field] for series_field in without_date_range}
+                ids = sorted(set(ids) | self.processsteps_of(caught_up))
+            for batch in chunked(ids, batch_size):
+                SensorReadingRollup.objects.rebuild(batch, using=self.db)
+                SensorReadingSummary.objects.rebuild(batch, using=self.db)
+                for series_field, series_ids in SensorReadingDateRange.objects.series_of_processsteps(batch, using=self.db).items():
+                    series[series_field] = series.get(series_field, set()) | series_ids
+            if processstep_ids is None:
+                without_rollups = self.series_without_rollups()
+                SensorReadingRollup.objects.rebuild_without_processstep({series_field: without_rollups[series_field] | caught_up[series_field] for series_field in without_rollups},
+                                                                        using=self.db)
+            SensorReadingDateRange.objects.rebuild({series_field: series_ids - caught_up.get(series_field, set()) for series_field, series_ids in series.items()}, using=self.db)
+            SensorReadingDateRange.objects.rebuild(caught_up, using=self.db, rolled_up=True)
+            rebuilt[self.db] = len(ids)
+
+        return rebuilt
+
+
+# Register the task
+job_scheduler.tasks.register(RollupSensorReadings())
@@ -1,7 +1,7 @@
 # Copyright (c) 2022 RWTH Aachen - Werkzeugmaschinenlabor (WZL)
 # Contact: Simon Cramer, s.cramer@wzl-mq.rwth-aachen.de
 
-from orakel.models.basic import ProcessParameter, ProcessStep, QualityCharacteristics, SensorReading
+from orakel.models.basic import ProcessParameter, ProcessStep, QualityCharacteristics, SensorReading, SensorReadingSummary, SensorReadingRollup, SensorReadingDateRange
 from celery import shared_task
 from orakel_api.settings import DATABASES
 import datetime
@@ -29,11 +29,16 @@ def c_update_date(request):
         product_id = request.get("product_id")
 
 
-        processstep_ids = list(ProcessStep.objects.using(db_name).filter(product_id=product_id).values_list('id'))
-        sensorreadings = SensorReading.objects.using(db_name).filter(processstep_id__in=processstep_ids).all()
+        processstep_ids = list(ProcessStep.objects.using(db_name).filter(product_id=product_id).values_list('id', flat=True))
+        # The default ordering would sort the sensorreadings of the processsteps.
+        sensorreadings = SensorReading.objects.using(db_name).filter(processstep_id__in=processstep_ids).order_by()
         for object in sensorreadings:
             object.date = object.date.replace(year=int(year), month=int(month), day=int(day))
             object.save(using=db_name)
+        # the first and last values of the summaries, the buckets of the rollups and the date ranges depend on the dates
+        SensorReadingSummary.objects.rebuild(processstep_ids, using=db_name)
+        SensorReadingRollup.objects.rebuild(processstep_ids, using=db_name)
+        SensorReadingDateRange.objects.rebuild(SensorReadingDateRange.objects.series_of_processsteps(processstep_ids, using=db_name), using=db_name)
 
     except Exception as e:
         return e.args
@@ -0,0 +1,539 @@
+# Copyright (c) 2022 RWTH Aachen - Werkzeugmaschinenlabor (WZL)
+# Contact: Simon Cramer, s.cramer@wzl-mq.rwth-aachen.de
+
+import os
+import datetime
+import shutil
+import tempfile
+from unittest import mock
+
+import numpy as np
+import pandas as pd
+
+from django.conf import settings
+from django.test import SimpleTestCase, TestCase
+from django.db.models import Min, Max, Avg, StdDev, QuerySet, F, Value, ExpressionWrapper, BigIntegerField
+
+from orakel.models import DataFrame, DataFramePartition, Product, ProductSpecification, ProcessParameter, ProcessStep, ProcessStepSpecification, QualityCharacteristics, SensorReading, SensorReadingSummary
+from job_scheduler import job_scheduler
+from job_scheduler.tasks import CreateDataframe, RollupSensorReadings
+from job_scheduler.tasks.feature_statistics import segment_methods, segment_starts, segment_statistics
+from job_scheduler.tasks.instrumentation import Instrumentation
+from job_scheduler.tasks.progress import BuildProgress, BuildCancelled
+from job_scheduler.tasks.alignment import IdAlignment
+from job_scheduler.tasks.dataframe_artifacts import DataFrameArtifacts
+from job_scheduler.tasks.checkpoints import BuildCheckpoint
+
+
+TEST_DATASET = os.path.join(settings.BASE_DIR, "test_data", "test_dataset.json")
+
+
+def legacy_pivot_target_timeseries(df_qc):
+    """Reference implementation of the former per-product loop in CreateDataframe.create_target_timeseries.
+    pd.concat replaces DataFrame.append, which is not available in newer pandas versions.
+    """
+    column_names = df_qc['kind'].unique()
+    df_target = pd.DataFrame(columns=column_names)
+    for product in df_qc['id'].unique():
+        values = []
+        for column in column_names:
+            temp = list(df_qc.loc[(df_qc['id']==product) & (df_qc['kind']==column), 'value'])
+            if temp:
+                values.append(temp[0])
+            else:
+                values.append(np.NaN)
+        df_target = pd.concat([df_target, pd.DataFrame([values], columns=column_names, index=[product])])
+    df_target['id'] = df_target.index
+    product_id = df_target['id']
+    df_target.drop(labels=['id'], axis=1, inplace=True)
+    df_target.insert(0, 'id', product_id)
+    return df_target.astype({column: 'float64' for column in column_names})
+
+
+class CreateTargetTimeseriesTest(TestCase):
+    """Compare the vectorized target pivot with the former per-product implementation."""
+
+    fixtures = [TEST_DATASET]
+
+    def setUp(self):
+        self.task = CreateDataframe()
+        self.task.db = "default"
+        self.task.instrumentation = Instrumentation("default")
+        self.task.progress = BuildProgress()
+        self.task.product_ids = np.flip(np.sort(np.array(Product.objects.values_list('pk', flat=True))))
+        self.qualitycharacteristics = list(QualityCharacteristics.objects.all())
+
+    def stacked_target_values(self):
+        sr_queryset = SensorReading.objects.filter(qualitycharacteristics__in=self.qualitycharacteristics, processstep__product__in=self.task.product_ids)
+        sr_queryset = sr_queryset.order_by('processstep__product_id', 'qualitycharacteristics_id', 'date').values('processstep__product', 'date', 'qualitycharacteristics', 'value')
+        return pd.DataFrame(sr_queryset).rename(columns={'processstep__product': 'id', 'date': 'time', 'qualitycharacteristics': 'kind'})
+
+    def test_pivot_matches_legacy_on_test_dataset(self):
+        df_qc = self.stacked_target_values()
+        pd.testing.assert_frame_equal(CreateDataframe.pivot_target_timeseries(df_qc), legacy_pivot_target_timeseries(df_qc))
+
+    def test_pivot_matches_legacy_with_missing_and_duplicate_values(self):
+        df_qc = self.stacked_target_values()
+        # Add a second qualitycharacteristic for every other product and a duplicated value that has to be ignored.
+        extra = df_qc.iloc[::2].assign(kind=-1, value=lambda df: df['value'] * 2)
+        df_qc = pd.concat([df_qc, extra, extra.assign(value=0.0)]).sort_values(['id', 'kind'], kind='stable').reset_index(drop=True)
+        pd.testing.assert_frame_equal(CreateDataframe.pivot_target_timeseries(df_qc), legacy_pivot_target_timeseries(df_qc))
+
+    def test_create_target_timeseries_matches_legacy(self):
+        df_target = self.task.create_target_timeseries(self.qualitycharacteristics)
+        pd.testing.assert_frame_equal(df_target, legacy_pivot_target_timeseries(self.stacked_target_values()))
+
+
+class SensorReadingSummaryTest(TestCase):
+    """Compare the features computed from the SensorReadingSummary instances with the grouped sensorreading queries."""
+
+    fixtures = [TEST_DATASET]
+
+    def setUp(self):
+        SensorReadingSummary.objects.rebuild(ProcessStep.objects.values_list('pk', flat=True))
+        self.task = CreateDataframe()
+        self.task.db = "default"
+        self.task.instrumentation = Instrumentation("default")
+        self.task.progress = BuildProgress()
+        self.task.decode_methods_per_feature = {"Min": Min('value'), "Max": Max('value'), "Avg": Avg('value'), "StdDev": StdDev('value')}
+        self.task.product_ids = np.flip(np.sort(np.array(Product.objects.values_list('pk', flat=True))))
+
+    def feature_dataframes(self, feature_field, features):
+        methods = ["Min", "Max", "Avg", "StdDev"]
+        self.task.use_sensorreading_summary = True
+        df_summary = self.task.create_feature_dataframe(feature_field, features, methods)
+        self.task.use_sensorreading_summary = False
+        df_sensorreadings = self.task.create_feature_dataframe(feature_field, features, methods)
+        return df_summary, df_sensorreadings
+
+    def test_statistics_features_match_sensorreadings(self):
+        features = list(ProcessParameter.objects.all())
+        self.task.use_sensorreading_summary = False
+        df_sensorreadings = self.task.create_feature_dataframe("processparameter", features, ["Min", "Max", "Avg", "StdDev"])
+        df_statistics = self.task.create_feature_dataframe("processparameter", features, ["Min", "Max", "Avg", "StdDev", "Median"])
+        pd.testing.assert_frame_equal(df_statistics.drop(columns=[str(feature) + "Median" for feature in features]), df_sensorreadings)
+
+    def test_summary_features_match_sensorreadings(self):
+        for feature_field, features in (("processparameter", list(ProcessParameter.objects.all())), ("qualitycharacteristics", list(QualityCharacteristics.objects.all()))):
+            df_summary, df_sensorreadings = self.feature_dataframes(feature_field, features)
+            pd.testing.assert_frame_equal(df_summary, df_sensorreadings)
+
+    def test_products_without_summaries_use_sensorreadings(self):
+        # Sensorreadings that were loaded without summaries, e.g. by loaddata.
+        SensorReadingSummary.objects.filter(processstep__in=ProcessStep.objects.order_by('pk').values_list('pk', flat=True)[::2]).delete()
+        for feature_field, features in (("processparameter", list(ProcessParameter.objects.all())), ("qualitycharacteristics", list(QualityCharacteristics.objects.all()))):
+            df_summary, df_sensorreadings = self.feature_dataframes(feature_field, features)
+            self.assertFalse(df_sensorreadings.isna().all().all())
+            pd.testing.assert_frame_equal(df_summary, df_sensorreadings)
+
+    def test_features_without_summaries_use_sensorreadings(self):
+        # Summaries of single features are missing, e.g. after a rebuild that was interrupted or an import of one processparameter.
+        features = list(ProcessParameter.objects.all())
+        SensorReadingSummary.objects.filter(processparameter=features[0], processstep__in=ProcessStep.objects.order_by('pk').values_list('pk', flat=True)[::2]).delete()
+        df_summary, df_sensorreadings = self.feature_dataframes("processparameter", features)
+        self.assertFalse(df_sensorreadings.isna().all().all())
+        pd.testing.assert_frame_equal(df_summary, df_sensorreadings)
+
+    def test_catch_up_missing_summaries(self):
+        fields = ('processstep', 'processparameter', 'qualitycharacteristics', 'count', 'mean', 'min', 'max')
+        rebuilt = list(SensorReadingSummary.objects.order_by(*fields[:3]).values_list(*fields))
+        SensorReadingSummary.objects.all().delete()
+        RollupSensorReadings().run(database_name="default", lookback_hours=0)
+        self.assertEqual(list(SensorReadingSummary.objects.order_by(*fields[:3]).values_list(*fields)), rebuilt)
+        # Caught up processsteps are not pending anymore.
+        task = RollupSensorReadings()
+        task.db = "default"
+        self.assertFalse(task.pending_processsteps(datetime.timedelta(0)).exists())
+
+    def test_add_readings_matches_rebuild(self):
+        processstep_id = SensorReading.objects.exclude(processparameter=None).values_list('processstep', flat=True).first()
+        readings = list(SensorReading.objects.filter(processstep=processstep_id).order_by('id'))
+        for reading in readings:
+            reading.pk = None
+            reading.value = reading.value * 2 + 1
+        SensorReading.objects.bulk_create(readings)
+        SensorReadingSummary.objects.add_readings(readings)
+        fields = ('processparameter', 'qualitycharacteristics', 'count', 'mean', 'm2', 'min', 'max', 'first_date', 'last_date', 'first_value', 'last_value')
+        merged = pd.DataFrame(SensorReadingSummary.objects.filter(processstep=processstep_id).order_by('processparameter', 'qualitycharacteristics').values(*fields))
+        SensorReadingSummary.objects.rebuild([processstep_id])
+        rebuilt = pd.DataFrame(SensorReadingSummary.objects.filter(processstep=processstep_id).order_by('processparameter', 'qualitycharacteristics').values(*fields))
+        pd.testing.assert_frame_equal(merged, rebuilt)
+
+    def test_add_readings_merges_concurrent_summaries(self):
+        processstep_id = SensorReading.objects.exclude(processparameter=None).values_list('processstep', flat=True).first()
+        readings = list(SensorReading.objects.filter(processstep=processstep_id).order_by('id'))
+        for reading in readings:
+            reading.pk = None
+        SensorReading.objects.bulk_create(readings)
+
+        select_for_update = QuerySet.select_for_update
+        missed = []
+        def concurrent_select_for_update(queryset, *args, **kwargs):
+            # The summaries of a concurrent transaction are inserted after the first locking read.
+            if not missed:
+                missed.append(True)
+                return queryset.none()
+            return select_for_update(queryset, *args, **kwargs)
+        with mock.patch.object(QuerySet, "select_for_update", autospec=True, side_effect=concurrent_select_for_update):
+            SensorReadingSummary.objects.add_readings(readings)
+
+        fields = ('processparameter', 'qualitycharacteristics', 'count', 'mean', 'm2', 'min', 'max', 'first_date', 'last_date', 'first_value', 'last_value')
+        merged = pd.DataFrame(SensorReadingSummary.objects.filter(processstep=processstep_id).order_by('processparameter', 'qualitycharacteristics').values(*fields))
+        SensorReadingSummary.objects.rebuild([processstep_id])
+        rebuilt = pd.DataFrame(SensorReadingSummary.objects.filter(processstep=processstep_id).order_by('processparameter', 'qualitycharacteristics').values(*fields))
+        pd.testing.assert_frame_equal(merged, rebuilt)
+
+    def test_stddev_of_large_values(self):
+        # Values with a large mean and small deviations cancel out in a sum of squares.
+        reading = SensorReading.objects.exclude(processparameter=None).exclude(processstep=None).first()
+        SensorReading.objects.filter(processstep=reading.processstep, processparameter=reading.processparameter).delete()
+        values = 1e8 + np.random.default_rng(0).normal(0, 0.5, 10000)
+        readings = [SensorReading(processstep=reading.processstep, processparameter=reading.processparameter, value=value, date=reading.date) for value in values]
+        # Half of the values are merged into the rebuilt summary of the other half.
+        SensorReading.objects.bulk_create(readings[:5000])
+        SensorReadingSummary.objects.rebuild([reading.processstep_id])
+        SensorReading.objects.bulk_create(readings[5000:])
+        SensorReadingSummary.objects.add_readings(readings[5000:])
+
+        self.task.product_ids = np.array([reading.processstep.product_id])
+        df_summary, df_sensorreadings = self.feature_dataframes("processparameter", [reading.processparameter])
+        pd.testing.assert_frame_equal(df_summary, df_sensorreadings)
+        self.assertAlmostEqual(df_summary.iloc[0][str(reading.processparameter) + "StdDev"], values.std(), places=6)
+
+
+class DataFrameBuildTest(TestCase):
+    """Build dataframes of the test dataset at local save_paths and compare cached builds with complete builds."""
+
+    fixtures = [TEST_DATASET]
+    methods_per_feature = ["Min", "Max"]
+
+    def create_dataframe(self, **kwargs):
+        save_path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, save_path, ignore_errors=True)
+        kwargs = dict({"product_amount": 20, "random_records": False}, **kwargs)
+        df = DataFrame.objects.create(productspecification=ProductSpecification.objects.first(), save_path=save_path, **kwargs)
+        df.processstepspecification.set(ProcessStepSpecification.objects.all())
+        df.processparameter.set(ProcessParameter.objects.order_by('pk')[:3])
+        df.target_value.set(QualityCharacteristics.objects.all())
+        return df
+
+    def build(self, df, methods_per_feature=None, **kwargs):
+        CreateDataframe()(pk=df.pk, database_name="default", methods_per_feature=methods_per_feature or self.methods_per_feature, **kwargs)
+        df.refresh_from_db()
+        return df
+
+    def read(self, df):
+        artifacts = DataFrameArtifacts.from_dataframe(df)
+        return artifacts.read("x"), artifacts.read("y")
+
+    def add_product(self, copy_from=None):
+        """Add a product with a processstep but without sensorreadings or with copies of the processsteps and sensorreadings of another product."""
+        product = Product.objects.create(productspecification=ProductSpecification.objects.first())
+        if copy_from is None:
+            ProcessStep.objects.create(product=product, processstepspecification=ProcessStepSpecification.objects.first())
+        for processstep in ProcessStep.objects.filter(product=copy_from):
+            readings = list(SensorReading.objects.filter(processstep=processstep))
+            processstep.pk = None
+            processstep.product = product
+            processstep.save()
+            for reading in readings:
+                reading.pk = None
+                reading.processstep = processstep
+            SensorReading.objects.bulk_create(readings)
+        return product
+
+    def assert_builds_equal(self, df, other):
+        for dataframe, other_dataframe in zip(self.read(df), self.read(other)):
+            pd.testing.assert_frame_equal(dataframe, other_dataframe)
+
+    def test_identical_build_is_reused(self):
+        df = self.build(self.create_dataframe())
+        cached = self.build(self.create_dataframe())
+
+        self.assertEqual((cached.status, cached.cache_hits, cached.fingerprint), ("Succeeded", 1, df.fingerprint))
+        self.assert_builds_equal(cached, df)
+
+    def test_new_product_changes_fingerprint(self):
+        df = self.build(self.create_dataframe())
+        product = self.add_product()
+        df = self.build(df)
+
+        self.assertEqual((df.status, df.cache_hits, df.cache_misses), ("Succeeded", 0, 2))
+        self.assertEqual(self.read(df)[1].index[0], product.pk)
+        self.assert_builds_equal(df, self.build(self.create_dataframe()))
+
+    def test_build_uses_summaries(self):
+        SensorReadingSummary.objects.rebuild(ProcessStep.objects.values_list('pk', flat=True))
+        query_feature_values = CreateDataframe.query_feature_values
+        def sensorreading_values(task, feature_field, features, methods=None):
+            # Only the target values are queried from the sensorreadings.
+            self.assertIsNone(methods)
+            return query_feature_values(task, feature_field, features, methods)
+        with mock.patch.object(CreateDataframe, "query_feature_values", autospec=True, side_effect=sensorreading_values):
+            df = self.build(self.create_dataframe(product_amount=1000))
+        # A random sample of all products selects the same products with another fingerprint, so the build is not reused.
+        with mock.patch.object(CreateDataframe, "use_sensorreading_summary", False):
+            expected = self.build(self.create_dataframe(product_amount=1000, random_records=True, random_seed=7))
+
+        self.assertEqual((df.status, expected.cache_hits), ("Succeeded", 0))
+        self.assert_builds_equal(df, expected)
+
+    def test_partitioned_build_matches_single_build(self):
+        # Run the chord of the partitions and the merge task in the test process instead of sending it to the broker.
+        job_scheduler.conf.update(task_always_eager=True)
+        self.addCleanup(job_scheduler.conf.update, task_always_eager=False)
+        for methods_per_feature in (None, ["StackedDataFrame"]):
+            with self.subTest(methods_per_feature=methods_per_feature):
+                df = self.build(self.create_dataframe(partitions=3, product_amount=50), methods_per_feature)
+
+                self.assertEqual(df.status, "Succeeded")
+                partitions = DataFramePartition.objects.filter(dataframe=df).order_by('partition')
+                self.assertEqual(list(partitions.values_list('status', flat=True)), ["Succeeded"] * 3)
+                # The partitions cover ascending product ranges.
+                ranges = list(partitions.values_list('first_product_id', 'last_product_id'))
+                self.assertEqual(ranges, sorted(ranges))
+                self.assertTrue(all(last < first for (_, last), (first, _) in zip(ranges, ranges[1:])))
+                self.assert_builds_equal(df, self.build(self.create_dataframe(product_amount=50), methods_per_feature))
+
+    def test_partition_keeps_terminal_status(self):
+        df = self.create_dataframe(partitions=2)
+        product_ids = list(Product.objects.order_by('pk').values_list('pk', flat=True)[:5])
+        for status in ("Failed", "Cancelled"):
+            with self.subTest(status=status):
+                DataFrame.objects.filter(pk=df.pk).update(status=status)
+                # A partition that starts after a sibling partition failed or was cancelled.
+                self.build(df, product_ids=product_ids, partition=1)
+                self.assertEqual(df.status, status)
+
+    def assert_refresh_matches_build(self, methods_per_feature=None, **kwargs):
+        df = self.build(self.create_dataframe(**kwargs), methods_per_feature)
+        # The product_amount is reached, the new products replace the oldest or the products with the highest sample keys.
+        for product_id in Product.objects.order_by('-pk').values_list('pk', flat=True)[:5]:
+            self.add_product(copy_from=product_id)
+        df = self.build(df, methods_per_feature, refresh=True)
+
+        self.assertEqual(df.status, "Succeeded")
+        self.assertEqual(df.product_high_water_mark, Product.objects.order_by('pk').last().pk)
+        self.assert_builds_equal(df, self.build(self.create_dataframe(**kwargs), methods_per_feature))
+
+    def test_refresh_matches_build(self):
+        self.assert_refresh_matches_build()
+
+    def test_refresh_below_product_amount_matches_build(self):
+        self.assert_refresh_matches_build(product_amount=1000)
+
+    def test_refresh_of_random_sample_matches_build(self):
+        self.assert_refresh_matches_build(random_records=True, random_seed=7, product_amount=300)
+
+    def test_refresh_of_timeseries_matches_build(self):
+        self.assert_refresh_matches_build(["StackedDataFrame"])
+
+    def test_refresh_of_streamed_timeseries_matches_build(self):
+        self.assert_refresh_matches_build(["StackedDataFrame"], streaming_chunk_size=100, artifact_format="parquet")
+
+    def assert_resume_matches_build(self, methods_per_feature, cancelled_method, resumed_method, **kwargs):
+        df = self.create_dataframe(**kwargs)
+        with mock.patch.object(CreateDataframe, cancelled_method, side_effect=BuildCancelled):
+            self.assertEqual(self.build(df, methods_per_feature).status, "Cancelled")
+        # The checkpointed part is loaded instead of being queried again.
+        with mock.patch.object(CreateDataframe, resumed_method, side_effect=AssertionError("{} was not resumed".format(resumed_method))):
+            df = self.build(df, methods_per_feature)
+
+        self.assertEqual(df.status, "Succeeded")
+        self.assert_builds_equal(df, self.build(self.create_dataframe(**kwargs), methods_per_feature))
+
+    def test_resume_cancelled_build(self):
+        self.assert_resume_matches_build(None, "create_qualiycharacteristics_dataframe", "create_processparameter_dataframe", random_records=True, random_seed=7)
+
+    def test_resume_cancelled_streamed_timeseries(self):
+        self.assert_resume_matches_build(["StackedDataFrame"], "create_target_timeseries", "stream_stacked_dataframe", streaming_chunk_size=100)
+
+    def test_resume_after_new_product(self):
+        df = self.create_dataframe()
+        with mock.patch.object(CreateDataframe, "create_qualiycharacteristics_dataframe", side_effect=BuildCancelled):
+            self.build(df)
+        expected = self.build(self.create_dataframe())
+        # Ingest between the cancellation and the resubmission changes the fingerprint but not the configuration.
+        product = self.add_product(copy_from=Product.objects.order_by('-pk').values_list('pk', flat=True).first())
+        with mock.patch.object(CreateDataframe, "create_processparameter_dataframe", side_effect=AssertionError("create_processparameter_dataframe was not resumed")):
+            df = self.build(df)
+
+        # The checkpointed products are built, the files are not reused by identical builds.
+        self.assertEqual((df.status, df.fingerprint), ("Succeeded", None))
+        self.assertNotIn(product.pk, self.read(df)[1].index)
+        self.assert_builds_equal(df, expected)
+
+    def test_changed_configuration_does_not_resume(self):
+        df = self.create_dataframe()
+        with mock.patch.object(CreateDataframe, "create_qualiycharacteristics_dataframe", side_effect=BuildCancelled):
+            self.build(df)
+        df.processparameter.set(ProcessParameter.objects.order_by('pk')[:4])
+        with mock.patch.object(CreateDataframe, "create_processparameter_dataframe", autospec=True, side_effect=CreateDataframe.create_processparameter_dataframe) as create:
+            df = self.build(df)
+
+        create.assert_called_once()
+        self.assertEqual(df.status, "Succeeded")
+        expected = self.create_dataframe()
+        expected.processparameter.set(ProcessParameter.objects.order_by('pk')[:4])
+        self.assert_builds_equal(df, self.build(expected))
+
+    def test_refresh_without_new_products(self):
+        df = self.build(self.create_dataframe())
+        x, y = self.read(df)
+        df = self.build(df, refresh=True)
+
+        self.assertEqual(df.status, "Succeeded")
+        pd.testing.assert_frame_equal(self.read(df)[0], x)
+        pd.testing.assert_frame_equal(self.read(df)[1], y)
+
+    def test_refresh_of_changed_configuration_builds_all_products(self):
+        df = self.build(self.create_dataframe())
+        self.add_product(copy_from=Product.objects.order_by('-pk').values_list('pk', flat=True).first())
+        # The features of the previous files differ, the refresh must not merge them.
+        df.processparameter.set(ProcessParameter.objects.all()[:4])
+        df = self.build(df, refresh=True)
+
+        self.assertEqual(df.status, "Succeeded")
+        expected = self.create_dataframe()
+        expected.processparameter.set(ProcessParameter.objects.all()[:4])
+        self.assert_builds_equal(df, self.build(expected))
+
+
+class ProductSamplingTest(TestCase):
+    """Compare the EXISTS product query with the former join and check the seeded sample order of the database."""
+
+    fixtures = [TEST_DATASET]
+
+    def setUp(self):
+        self.task = CreateDataframe()
+        self.task.db = "default"
+        self.df = DataFrame.objects.create(productspecification=ProductSpecification.objects.first())
+        self.df.processstepspecification.set(ProcessStepSpecification.objects.all()[:2])
+
+    def test_query_products_matches_join(self):
+        processsteps_ids = ProcessStep.objects.filter(processstepspecification__in=self.df.processstepspecification.all()).values_list('pk', flat=True)
+        products_ids = Product.objects.filter(productspecification=self.df.productspecification, processstep__in=processsteps_ids).distinct().values_list('pk', flat=True)
+        self.assertEqual(sorted(self.task.query_products(self.df).values_list('pk', flat=True)), sorted(products_ids))
+
+    def test_newest_products_match_join(self):
+        # The former join kept the ordering of the model.
+        processsteps_ids = ProcessStep.objects.filter(processstepspecification__in=self.df.processstepspecification.all()).distinct().values_list('pk', flat=True)
+        products_ids = Product.objects.filter(productspecification=self.df.productspecification, processstep__in=processsteps_ids).distinct().values_list('pk', flat=True)
+        self.assertEqual(list(self.task.query_products(self.df).order_by('-pk').values_list('pk', flat=True)[:20]), list(products_ids)[:20])
+
+    def test_sample_key_of_large_ids(self):
+        # Ids that are shifted by 2**52 share the keys of the ids, their products with the multiplier would overflow a signed BIGINT.
+        # Larger shifts are not exact in the floating point MOD of SQLite.
+        products = Product.objects.annotate(large_id=ExpressionWrapper(F('pk') + Value(2**52), output_field=BigIntegerField()))
+        keys = list(products.annotate(key=CreateDataframe.product_sample_key(42), large_key=CreateDataframe.product_sample_key(42, 'large_id')).values_list('key', 'large_key'))
+
+        self.assertEqual([key for key, _ in keys], [large_key for _, large_key in keys])
+        self.assertTrue(all(0 <= key < 2**31 for key, _ in keys))
+
+    def test_sample_is_reproducible(self):
+        products = self.task.query_products(self.df)
+        sample = list(products.order_by(CreateDataframe.product_sample_key(42), 'pk').values_list('pk', flat=True)[:50])
+
+        self.assertEqual(sample, list(products.order_by(CreateDataframe.product_sample_key(42), 'pk').values_list('pk', flat=True)[:50]))
+        self.assertNotEqual(sample, list(products.order_by(CreateDataframe.product_sample_key(43), 'pk').values_list('pk', flat=True)[:50]))
+        self.assertEqual(len(set(sample)), 50)
+
+
+class SegmentStatisticsTest(SimpleTestCase):
+    """Compare the segment reductions with per segment NumPy computations."""
+
+    def reference_statistics(self, values):
+        mean = values.mean()
+        std = values.std()
+        moments = {"Skew": np.nan, "Kurtosis": np.nan}
+        if std > 0:
+            moments = {"Skew": ((values - mean) ** 3).mean() / std ** 3, "Kurtosis": ((values - mean) ** 4).mean() / std ** 4 - 3}
+        return dict(moments, Min=values.min(), Max=values.max(), Avg=mean, StdDev=std, Count=values.shape[0], Range=np.ptp(values),
+                    RMS=np.sqrt((values ** 2).mean()), First=values[0], Last=values[-1], Median=np.median(values),
+                    P05=np.quantile(values, 0.05), P25=np.quantile(values, 0.25), P75=np.quantile(values, 0.75), P95=np.quantile(values, 0.95))
+
+    def test_segment_statistics_match_reference(self):
+        rng = np.random.default_rng(0)
+        counts = np.array([1, 2, 3, 10, 57, 4])
+        keys = np.repeat(np.arange(counts.shape[0]), counts)
+        values = rng.normal(size=keys.shape[0])
+        values[keys == 2] = 1.5  # constant segment
+
+        starts = segment_starts(keys)
+        statistics = segment_statistics(values, starts, segment_methods)
+
+        np.testing.assert_array_equal(starts, np.cumsum(counts) - counts)
+        for segment, start in enumerate(starts):
+            reference = self.reference_statistics(values[start:start + counts[segment]])
+            np.testing.assert_allclose(statistics[segment], [reference[method] for method in segment_methods], rtol=1e-9, atol=1e-12)
+
+
+class IdAlignmentTest(SimpleTestCase):
+    """Compare the index array alignment with a pandas pivot."""
+
+    def test_align_matches_pivot(self):
+        product_ids = np.array([9, 3, 7, 1])
+        feature_ids = np.array([20, 10])
+        # Product 7 has no values, product 5 and feature 30 are not part of the dataframe.
+        rows = np.array([[3, 10, 1.0, 2.0], [9, 20, 3.0, 4.0], [1, 10, 5.0, 6.0], [5, 10, 7.0, 8.0], [3, 30, 9.0, 9.0]])
+
+        aligned = IdAlignment(product_ids).align(rows[:, 0], rows[:, 1], rows[:, 2:], IdAlignment(feature_ids))
+
+        reference = pd.DataFrame(rows, columns=['product', 'feature', 'a', 'b']).pivot(index='product', columns='feature', values=['a', 'b'])
+        reference = reference.swaplevel(axis=1).reindex(index=product_ids, columns=pd.MultiIndex.from_product([feature_ids, ['a', 'b']]))
+        np.testing.assert_array_equal(aligned, reference.to_numpy())
+        np.testing.assert_array_equal(IdAlignment(product_ids).positions([1, 5, 9]), [3, -1, 0])
+
+
+class BuildProgressTest(SimpleTestCase):
+    """Check the throttled publication and the combination of partition progress."""
+
+    def test_updates_are_throttled(self):
+        published = []
+        progress = BuildProgress(save=published.append, min_interval=3600)
+        progress.start(steps_total=4, features_total=2)
+        for _ in range(3):
+            progress.update(steps=1, rows=10)
+        progress.finish()
+
+        self.assertEqual([p["percent"] for p in published], [0.0, 100.0])
+        self.assertEqual(published[-1]["rows"], 30)
+        self.assertEqual(progress.to_dict()["eta_seconds"], 0.0)
+
+    def test_update_raises_when_cancelled(self):
+        requested = []
+        progress = BuildProgress(min_interval=0, cancelled=lambda: bool(requested))
+        progress.update(steps=1)
+        requested.append(True)
+        with self.assertRaises(BuildCancelled):
+            progress.update(steps=1)
+
+    def test_combine_partitions(self):
+        combined = BuildProgress.combine([{"percent": 50.0, "features_done": 3, "features_total": 6, "rows": 10, "eta_seconds": 4.0},
+                                          {"percent": 100.0, "features_done": 6, "features_total": 6, "rows": 20, "eta_seconds": 0.0}])
+        self.assertEqual(combined["percent"], 75.0)
+        self.assertEqual(combined["features_done"], 9)
+        self.assertEqual(combined["eta_seconds"], 4.0)
+        # Partitions that have not started yet have no estimate.
+        self.assertIsNone(BuildProgress.combine([{"percent": 50.0, "eta_seconds": 4.0}, None])["eta_seconds"])
+
+
+class BuildCheckpointTest(SimpleTestCase):
+    """Write and resume checkpoints at a local save_path, whose checkpoint directories do not exist yet."""
+
+    def test_resume_from_local_checkpoints(self):
+        save_path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, save_path, ignore_errors=True)
+        artifacts = DataFrameArtifacts(save_path)
+        dataframe = pd.DataFrame({"value": [1.0, 2.0]}, index=[3, 1])
+        for prefix in ("checkpoints/", "checkpoints/partition_2/"):
+            with self.subTest(prefix=prefix):
+                checkpoint = BuildCheckpoint(artifacts, "key", prefix=prefix)
+                self.assertFalse(checkpoint.open())
+                checkpoint.save_product_ids(np.array([3, 1]), 3)
+                checkpoint.save("processparameter", dataframe)
+
+                resumed = BuildCheckpoint(artifacts, "key", prefix=prefix)
+                self.assertTrue(resumed.open())
+                self.assertEqual(resumed.product_ids, [3, 1])
+                pd.testing.assert_frame_equal(resumed.load("processparameter"), dataframe)
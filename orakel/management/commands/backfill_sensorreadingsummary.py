@@ -0,0 +1,29 @@
+# Copyright (c) 2022 RWTH Aachen - Werkzeugmaschinenlabor (WZL)
+# Contact: Simon Cramer, s.cramer@wzl-mq.rwth-aachen.de
+
+from django.core.management.base import BaseCommand
+from django.db import DEFAULT_DB_ALIAS
+
+from orakel.models import ProcessStep, SensorReadingSummary
+
+from more_itertools import chunked
+
+
+class Command(BaseCommand):
+    help = "Rebuild the SensorReadingSummary instances of all processsteps from their sensorreadings."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--database', default=DEFAULT_DB_ALIAS, help="Name of the database. Defaults to 'default'.")
+        parser.add_argument('--batch-size', type=int, default=1000, help="Amount of processsteps that are rebuilt per transaction.")
+
+    def handle(self, *args, **options):
+        database = options['database']
+        processstep_ids = ProcessStep.objects.using(database).order_by('pk').values_list('pk', flat=True)
+
+        n_processsteps = 0
+        for batch in chunked(processstep_ids.iterator(), options['batch_size']):
+            SensorReadingSummary.objects.rebuild(batch, using=database)
+            n_processsteps += len(batch)
+            self.stdout.write("Rebuilt the summaries of {} processsteps.".format(n_processsteps))
+
+        self.stdout.write(self.style.SUCCESS("Backfilled the summaries of {} processsteps in database {}.".format(n_processsteps, database)))
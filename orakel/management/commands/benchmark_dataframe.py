@@ -0,0 +1,257 @@
+# Copyright (c) 2022 RWTH Aachen - Werkzeugmaschinenlabor (WZL)
+# Contact: Simon Cramer, s.cramer@wzl-mq.rwth-aachen.de
+
+from collections import defaultdict
+from datetime import timedelta
+from pathlib import Path
+import json
+import os
+import platform
+import statistics
+import tempfile
+
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+from django.db.models import Max
+from django.utils import timezone
+
+from orakel.models import (DataFrame, ProcessParameter, ProcessStep, ProcessStepSpecification, Product, ProductSpecification, QualityCharacteristics,
+                           SensorReading, SensorReadingSummary)
+from job_scheduler.tasks import CreateDataframe
+
+from more_itertools import chunked
+import numpy as np
+
+
+class Command(BaseCommand):
+    help = ("Benchmark the CreateDataframe paths on a synthetic dataset. The test dataset is loaded into an empty database and its products are cloned "
+            "with noisy sensorreadings until the requested amount of products is reached. The timings are written as JSON and compared with a baseline.")
+
+    # Name of the productspecification of the synthetic products, its description stores the configuration of the synthetic dataset.
+    productspecification_name = "benchmark"
+    default_fixture = Path(__file__).resolve().parents[3] / "test_data" / "test_dataset.json"
+
+    # Benchmarked CreateDataframe paths and their dataframe configuration.
+    cases = {
+        "aggregated": {"methods": ["Min", "Max", "Avg", "StdDev"], "qualitycharacteristics": True},
+        "statistics": {"methods": ["Min", "Max", "Avg", "StdDev", "Median"], "qualitycharacteristics": True},
+        "stacked": {"methods": ["StackedDataFrame"], "qualitycharacteristics": False},
+        "streamed": {"methods": ["StackedDataFrame"], "qualitycharacteristics": False, "streaming_chunk_size": 50000},
+    }
+
+    def add_arguments(self, parser):
+        parser.add_argument('--database', default=DEFAULT_DB_ALIAS, help="Name of the database. Defaults to 'default'.")
+        parser.add_argument('--allow-writes', action='store_true', help="Allow writing the synthetic dataset into a database that is not SQLite.")
+        parser.add_argument('--fixture', default=str(self.default_fixture), help="Fixture that is loaded into an empty database. Defaults to test_data/test_dataset.json.")
+        parser.add_argument('--products', type=int, default=5000, help="Amount of synthetic products. Defaults to 5000.")
+        parser.add_argument('--readings-factor', type=int, default=1, help="Amount of synthetic sensorreadings per sensorreading of the cloned product. Defaults to 1.")
+        parser.add_argument('--seed', type=int, default=0, help="Seed of the noise of the synthetic sensorreadings. Defaults to 0.")
+        parser.add_argument('--cases', default=",".join(self.cases), help="Comma separated cases out of {}.".format(", ".join(self.cases)))
+        parser.add_argument('--repeat', type=int, default=3, help="Runs per case, the median is reported. Defaults to 3.")
+        parser.add_argument('--save-path', default=None, help="Directory of the built files. Defaults to a temporary directory.")
+        parser.add_argument('--artifact-format', default='feather', choices=[choice for choice, _ in DataFrame.artifact_format_choices])
+        parser.add_argument('--compression', default='lz4', choices=[choice for choice, _ in DataFrame.compression_choices])
+        parser.add_argument('--output', default="dataframe_benchmark.json", help="File of the results. Defaults to dataframe_benchmark.json.")
+        parser.add_argument('--baseline', default=None, help="Results of a previous run, timings that are slower by more than the tolerance are reported as regressions.")
+        parser.add_argument('--tolerance', type=float, default=0.2, help="Allowed relative slowdown against the baseline. Defaults to 0.2.")
+        parser.add_argument('--min-seconds', type=float, default=0.05, help="Timings whose baseline is shorter are not reported as regressions. Defaults to 0.05.")
+        parser.add_argument('--fail-on-regression', action='store_true', help="Exit with an error when a regression was found.")
+
+    def handle(self, *args, **options):
+        database = options['database']
+        if connections[database].vendor != "sqlite" and not options['allow_writes']:
+            raise CommandError("The benchmark writes a synthetic dataset into database {}, pass --allow-writes to use a database that is not SQLite.".format(database))
+        case_names = [name for name in options['cases'].split(",") if name]
+        unknown_cases = set(case_names) - set(self.cases)
+        if unknown_cases:
+            raise CommandError("Unknown cases: {}".format(", ".join(sorted(unknown_cases))))
+
+        if not Product.objects.using(database).exists():
+            self.stdout.write("Loading {} into database {}.".format(options['fixture'], database))
+            call_command('loaddata', options['fixture'], database=database, verbosity=0)
+        productspecification = self.synthetic_dataset(database, options['products'], options['readings_factor'], options['seed'])
+
+        save_path = options['save_path'] or tempfile.mkdtemp(prefix="orakel_benchmark_")
+        results = {"created": timezone.now().isoformat(),
+                   "config": {"database": connections[database].vendor,
+                              "products": options['products'],
+                              "readings_factor": options['readings_factor'],
+                              "sensorreadings": SensorReading.objects.using(database).filter(processstep__product__productspecification=productspecification).count(),
+                              "seed": options['seed'],
+                              "repeat": options['repeat'],
+                              "artifact_format": options['artifact_format'],
+                              "compression": options['compression'],
+                              "python": platform.python_version(),
+                              "numpy": np.__version__,
+                              },
+                   "cases": {},
+                   "timings": {},
+                   }
+        for name in case_names:
+            case = self.run_case(database, name, productspecification, save_path, options)
+            results["cases"][name] = case
+            results["timings"][name] = case["seconds"]
+            # The target stages are reported as the targets path of the case.
+            results["timings"][name + ".targets"] = round(sum(seconds for stage, seconds in case["stages"].items() if stage.endswith("target_value")), 3)
+            self.stdout.write("{:<24} {:8.3f} seconds".format(name, case["seconds"]))
+
+        if options['baseline']:
+            with open(options['baseline']) as f:
+                baseline = json.load(f)
+            results["comparison"] = self.compare(baseline.get("timings", {}), results["timings"], options['tolerance'], options['min_seconds'])
+            self.report(results["comparison"])
+
+        with open(options['output'], 'w') as f:
+            json.dump(results, f, indent=2)
+        self.stdout.write(self.style.SUCCESS("Wrote the results to {}.".format(options['output'])))
+
+        if options['fail_on_regression'] and results.get("comparison", {}).get("regressions"):
+            raise CommandError("Regressions: {}".format(", ".join(results["comparison"]["regressions"])))
+
+    def synthetic_dataset(self, database, products, readings_factor, seed):
+        """Clone the products of the fixture into the benchmark productspecification. An existing synthetic dataset with the same configuration is reused.
+
+        Args:
+            database (str): Name of the database.
+            products (int): Amount of synthetic products.
+            readings_factor (int): Amount of synthetic sensorreadings per sensorreading of the cloned product, the dates are shifted by one second each.
+            seed (int): Seed of the noise of the sensorreading values.
+
+        Returns:
+            [ProductSpecification]: Productspecification of the synthetic products.
+        """
+        config = json.dumps({"products": products, "readings_factor": readings_factor, "seed": seed}, sort_keys=True)
+        productspecification, _ = ProductSpecification.objects.using(database).get_or_create(name=self.productspecification_name)
+        if productspecification.description == config:
+            return productspecification
+
+        with transaction.atomic(using=database):
+            self.delete_synthetic_dataset(database, productspecification)
+
+            templates = list(Product.objects.using(database).exclude(productspecification=productspecification).filter(processstep__isnull=False)
+                             .distinct().order_by('pk').values_list('pk', flat=True))
+            if not templates:
+                raise CommandError("Database {} has no products with processsteps that can be cloned.".format(database))
+            steps_by_product = defaultdict(list)
+            for step in ProcessStep.objects.using(database).filter(product__in=templates).order_by('pk').values():
+                steps_by_product[step["product_id"]].append(step)
+            readings_by_step = defaultdict(list)
+            for reading in SensorReading.objects.using(database).filter(processstep__product__in=templates).order_by('pk').values(
+                    "processstep_id", "processparameter_id", "qualitycharacteristics_id", "sensor_id", "value", "date"):
+                readings_by_step[reading["processstep_id"]].append(reading)
+
+            # Explicit ids let the readings reference the new processsteps without reading them back.
+            next_product_id = (Product.objects.using(database).aggregate(last_id=Max('pk'))['last_id'] or 0) + 1
+            next_step_id = (ProcessStep.objects.using(database).aggregate(last_id=Max('pk'))['last_id'] or 0) + 1
+            rng = np.random.default_rng(seed)
+            new_products, new_steps, new_readings, new_step_ids = [], [], [], []
+            for i in range(products):
+                template = templates[i % len(templates)]
+                product_id = next_product_id + i
+                new_products.append(Product(pk=product_id, name="benchmark_{}".format(i), productspecification=productspecification))
+                for step in steps_by_product[template]:
+                    new_steps.append(ProcessStep(**dict(step, id=next_step_id, product_id=product_id, name="benchmark_{}".format(next_step_id))))
+                    new_step_ids.append(next_step_id)
+                    for reading in readings_by_step[step["id"]]:
+                        noise = rng.normal(0, 0.01, readings_factor)
+                        for k in range(readings_factor):
+                            value = reading["value"] * (1 + noise[k]) if reading["value"] is not None else None
+                            date = reading["date"] + timedelta(seconds=k) if reading["date"] is not None else None
+                            new_readings.append(SensorReading(**dict(reading, processstep_id=next_step_id, value=value, date=date)))
+                    next_step_id += 1
+                if len(new_readings) >= 50000 or i == products - 1:
+                    Product.objects.using(database).bulk_create(new_products)
+                    ProcessStep.objects.using(database).bulk_create(new_steps)
+                    SensorReading.objects.using(database).bulk_create(new_readings, batch_size=5000)
+                    self.stdout.write("Created {} synthetic products.".format(i + 1))
+                    new_products, new_steps, new_readings = [], [], []
+
+            for batch in chunked(new_step_ids, 1000):
+                SensorReadingSummary.objects.rebuild(batch, using=database)
+
+            ProductSpecification.objects.using(database).filter(pk=productspecification.pk).update(description=config)
+
+        return productspecification
+
+    def delete_synthetic_dataset(self, database, productspecification):
+        """Delete the synthetic products, their processsteps, sensorreadings and summaries."""
+        steps = ProcessStep.objects.using(database).filter(product__productspecification=productspecification)
+        SensorReading.objects.using(database).filter(processstep__in=steps).delete()
+        SensorReadingSummary.objects.using(database).filter(processstep__in=steps).delete()
+        steps.delete()
+        Product.objects.using(database).filter(productspecification=productspecification).delete()
+
+    def run_case(self, database, name, productspecification, save_path, options):
+        """Build the dataframe of a case repeat times. Every run starts without cached build and without checkpoints.
+
+        Args:
+            database (str): Name of the database.
+            name (str): Name of the case.
+            productspecification (ProductSpecification): Productspecification of the synthetic products.
+            save_path (str): Directory of the built files.
+            options (dict): Options of the command.
+
+        Returns:
+            [dict]: Median seconds, peak RSS, queries and rows of the runs and the median seconds per stage.
+        """
+        case = self.cases[name]
+        case_path = os.path.join(save_path, name)
+
+        runs = []
+        for _ in range(options['repeat']):
+            DataFrame.objects.using(database).filter(name="benchmark_" + name).delete()
+            df = DataFrame.objects.using(database).create(name="benchmark_" + name, save_path=case_path, product_amount=options['products'], random_records=False,
+                                                          feature_config=case["methods"], productspecification=productspecification,
+                                                          streaming_chunk_size=case.get("streaming_chunk_size"), artifact_format=options['artifact_format'],
+                                                          compression=options['compression'])
+            df.processstepspecification.set(ProcessStepSpecification.objects.using(database).all())
+            df.processparameter.set(ProcessParameter.objects.using(database).all())
+            if case["qualitycharacteristics"]:
+                df.qualitycharacteristics.set(QualityCharacteristics.objects.using(database).all())
+            df.target_value.set(QualityCharacteristics.objects.using(database).all())
+
+            CreateDataframe()(pk=df.pk, database_name=database, methods_per_feature=case["methods"])
+            df.refresh_from_db()
+            if df.status != "Succeeded":
+                raise CommandError("The build of case {} ended with status {}.".format(name, df.status))
+            runs.append(df.instrumentation)
+            df.delete()
+
+        stages = defaultdict(list)
+        for run in runs:
+            for stage in run["stages"]:
+                stages[stage["stage"]].append(stage["seconds"])
+
+        return {"seconds": statistics.median(run["seconds"] for run in runs),
+                "runs": [run["seconds"] for run in runs],
+                "peak_rss_mb": max(run["peak_rss_mb"] for run in runs),
+                "queries": sum(stage["queries"] for stage in runs[-1]["stages"]),
+                "rows": {stage["stage"]: stage["rows"] for stage in runs[-1]["stages"]},
+                "stages": {stage: round(statistics.median(seconds), 3) for stage, seconds in stages.items()},
+                }
+
+    @staticmethod
+    def compare(baseline, timings, tolerance, min_seconds=0.0):
+        """Compare the timings with the timings of a baseline.
+
+        Args:
+            baseline (dict): Seconds by timing name of the baseline.
+            timings (dict): Seconds by timing name of this run.
+            tolerance (float): Allowed relative slowdown.
+            min_seconds (float, optional): Timings whose baseline is shorter are too noisy to be reported as regressions. Defaults to 0.0.
+
+        Returns:
+            [dict]: Ratio of the seconds to the baseline by timing name and the names of the regressions.
+        """
+        ratios = {name: round(seconds / baseline[name], 3) for name, seconds in timings.items() if baseline.get(name)}
+        return {"tolerance": tolerance,
+                "ratios": ratios,
+                "regressions": sorted(name for name, ratio in ratios.items() if ratio > 1 + tolerance and baseline[name] >= min_seconds),
+                }
+
+    def report(self, comparison):
+        """Write the ratios to the baseline, regressions are highlighted."""
+        for name, ratio in comparison["ratios"].items():
+            line = "{:<24} {:6.2f}x baseline".format(name, ratio)
+            self.stdout.write(self.style.ERROR(line + " (regression)") if name in comparison["regressions"] else line)
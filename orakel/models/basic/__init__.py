@@ -9,6 +9,9 @@ from .product import Product, PreProduct
 from .productspecification import ProductSpecification
 from .sensor import Sensor
 from .sensorreading import SensorReading
+from .sensorreadingsummary import SensorReadingSummary
+from .sensorreadingrollup import SensorReadingRollup
+from .sensorreadingdaterange import SensorReadingDateRange
 from .shopfloor import ShopFloor
 from .tool import Tool
 from .operator import Operator
@@ -43,5 +43,6 @@ class ProcessStep(BaseModel):
         indexes = [models.Index(fields=['product']),
                    models.Index(fields=['machine']),
                    models.Index(fields=['processstepspecification']),
-                   models.Index(fields=['preproduct'])
+                   models.Index(fields=['preproduct']),
+                   models.Index(fields=['processstepspecification', 'product']),
                    ]
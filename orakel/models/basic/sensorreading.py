@@ -24,10 +24,16 @@ class SensorReading(BaseModel):
     qualitycharacteristics = models.ForeignKey('QualityCharacteristics', related_name='%(class)s', default=None ,null=True, blank=True,on_delete=models.SET_NULL)
 
     class Meta(BaseModel.Meta):
-        indexes = [models.Index(fields=['processparameter']),
-                  models.Index(fields=['qualitycharacteristics']),
+        indexes = [# Serve the time series of a feature or sensor ordered by date, the indexes replace the single column indexes.
+                  models.Index(fields=['processparameter', 'date']),
+                  models.Index(fields=['qualitycharacteristics', 'date']),
+                  models.Index(fields=['sensor', 'date']),
                   models.Index(fields=['processstep']),
-                  models.Index(fields=['sensor']),
+                  # Serve the stacked timeseries of the dataframe creation ordered by processstep, feature and date.
+                  models.Index(fields=['processstep', 'processparameter', 'date']),
+                  models.Index(fields=['processstep', 'qualitycharacteristics', 'date']),
+                  # Cover the value aggregates per processstep and processparameter without reading the table rows.
+                  models.Index(fields=['processstep', 'processparameter', 'value']),
                   ]
 
 
@@ -0,0 +1,242 @@
+# Copyright (c) 2022 RWTH Aachen - Werkzeugmaschinenlabor (WZL)
+# Contact: Simon Cramer, s.cramer@wzl-mq.rwth-aachen.de
+
+from django.db import models, router, transaction
+from django.db.models import Count, Min, Max, Q
+from orakel.models.utils import BaseModel
+from .sensorreading import SensorReading
+
+from more_itertools import chunked
+
+
+class SensorReadingDateRangeManager(models.Manager):
+    """Maintains the SensorReadingDateRange instances and answers the date range of the sensorreadings of sensors, processparameters or qualitycharacteristics.
+    The date ranges of a series are rebuilt from its sensorreadings or extended by appended sensorreadings.
+    """
+
+    series_fields = ('sensor', 'processparameter', 'qualitycharacteristics')
+    batch_size = 5000
+
+    def series_of(self, readings):
+        """Series of sensorreadings.
+
+        Args:
+            readings (list[SensorReading]): Sensorreadings.
+
+        Returns:
+            [dict]: Ids of the sensors, processparameters and qualitycharacteristics per series field.
+        """
+        series = {series_field: set() for series_field in self.series_fields}
+        for reading in readings:
+            for series_field in self.series_fields:
+                series_id = getattr(reading, series_field + "_id")
+                if series_id is not None:
+                    series[series_field].add(series_id)
+        return series
+
+    def series_of_processsteps(self, processstep_ids, using=None):
+        """Series of the sensorreadings of processsteps.
+
+        Args:
+            processstep_ids (list[int]): Ids of the processsteps.
+            using (str, optional): Name of the database. Defaults to the database of the router.
+
+        Returns:
+            [dict]: Ids of the sensors, processparameters and qualitycharacteristics per series field.
+        """
+        using = using or router.db_for_read(SensorReading)
+        series = {}
+        for series_field in self.series_fields:
+            sr_queryset = SensorReading.objects.using(using).filter(**{"processstep__in": processstep_ids, series_field + "__isnull": False})
+            series[series_field] = set(sr_queryset.order_by().values_list(series_field, flat=True).distinct())
+        return series
+
+    def rebuild(self, series, using=None, rolled_up=None):
+        """Recompute the date ranges of series from their sensorreadings.
+
+        Args:
+            series (dict): Ids of the sensors, processparameters and qualitycharacteristics per series field, e.g. from series_of.
+            using (str, optional): Name of the database. Defaults to the database of the router.
+            rolled_up (bool, optional): Whether the rollups of all sensorreadings of the series were rebuilt as well. Defaults to None (keep the marker of the existing date ranges,
+                new date ranges are not rolled up).
+        """
+        using = using or router.db_for_write(self.model)
+
+        for series_field, series_ids in series.items():
+            for batch in chunked([series_id for series_id in set(series_ids) if series_id is not None], self.batch_size):
+                sr_queryset = SensorReading.objects.using(using).filter(**{series_field + "__in": batch, "date__isnull": False})
+                sr_queryset = sr_queryset.order_by().values(series_field).annotate(first_date=Min("date"), last_date=Max("date"))
+
+                with transaction.atomic(using=using):
+                    existing = self.using(using).filter(**{series_field + "__in": batch})
+                    rolled_up_ids = set(existing.filter(rolled_up=True).values_list(series_field, flat=True)) if rolled_up is None else set()
+                    date_ranges = [self.model(first_date=group["first_date"], last_date=group["last_date"], rolled_up=rolled_up or group[series_field] in rolled_up_ids,
+                                              **{series_field + "_id": group[series_field]}) for group in sr_queryset]
+                    existing.delete()
+                    self.using(using).bulk_create(date_ranges, batch_size=self.batch_size)
+
+    def add_readings(self, readings, using=None, rolled_up=True):
+        """Extend the date ranges by sensorreadings that were appended to the database.
+        Call it within the transaction that creates the sensorreadings, after SensorReadingRollup.objects.add_readings.
+
+        Args:
+            readings (list[SensorReading]): Created sensorreadings.
+            using (str, optional): Name of the database. Defaults to the database of the router.
+            rolled_up (bool, optional): Whether the sensorreadings were added to the rollups. Otherwise their series are not rolled up until the Rollup_SensorReadings task
+                caught them up. Defaults to True.
+        """
+        using = using or router.db_for_write(self.model)
+
+        # First and last date of the new sensorreadings per (series field, series).
+        groups = {}
+        for reading in readings:
+            if reading.date is None:
+                continue
+            for series_field in self.series_fields:
+                series_id = getattr(reading, series_field + "_id")
+                if series_id is None:
+                    continue
+                key = (series_field, series_id)
+                if key not in groups:
+                    groups[key] = self.model(first_date=reading.date, last_date=reading.date, rolled_up=rolled_up, **{series_field + "_id": series_id})
+                groups[key].add_date(reading.date)
+
+        if not groups:
+            return
+
+        with transaction.atomic(using=using):
+            series_filter = Q()
+            for series_field in self.series_fields:
+                series_ids = [series_id for field, series_id in groups.keys() if field == series_field]
+                if series_ids:
+                    series_filter |= Q(**{series_field + "__in": series_ids})
+            existing = {}
+            for date_range in self.using(using).select_for_update().filter(series_filter).order_by():
+                series_field = next(series_field for series_field in self.series_fields if getattr(date_range, series_field + "_id") is not None)
+                existing[(series_field, getattr(date_range, series_field + "_id"))] = date_range
+
+            created, updated = [], []
+            for key, group in groups.items():
+                if key not in existing:
+                    created.append(group)
+                elif group.first_date < existing[key].first_date or group.last_date > existing[key].last_date or existing[key].rolled_up and not rolled_up:
+                    updated.append(existing[key].merge(group))
+
+            self.using(using).bulk_create(created, batch_size=self.batch_size)
+            for batch in chunked(updated, self.batch_size):
+                self.using(using).bulk_update(batch, ["first_date", "last_date", "rolled_up"])
+
+    def series_not_rolled_up(self, using=None):
+        """Series whose sensorreadings are not all contained in the rollups.
+
+        Args:
+            using (str, optional): Name of the database. Defaults to the database of the router.
+
+        Returns:
+            [dict]: Ids of the sensors, processparameters and qualitycharacteristics per series field.
+        """
+        queryset = self.using(using or router.db_for_read(self.model)).filter(rolled_up=False).order_by()
+        return {series_field: set(queryset.filter(**{series_field + "__isnull": False}).values_list(series_field, flat=True)) for series_field in self.series_fields}
+
+    def is_rolled_up(self, filter_kwargs, using=None):
+        """Whether the rollups contain every sensorreading of the series of a filter. Reads the date ranges of the series instead of the sensorreadings.
+        Series without date range are not rolled up, unless the filter selects all series.
+
+        Args:
+            filter_kwargs (dict): Filter of the sensorreadings, see range_filter.
+            using (str, optional): Name of the database. Defaults to the database of the router.
+
+        Returns:
+            [bool]: Whether the series of the filter are rolled up. False if the filter is not supported.
+        """
+        range_kwargs = self.range_filter(filter_kwargs)
+        if range_kwargs is None:
+            return False
+        key, value = next(iter(range_kwargs.items()), (None, None))
+        series_ids = set() if key is None else set(value) if key.endswith("__in") else {value}
+        counts = self.using(using or router.db_for_read(self.model)).filter(**range_kwargs).aggregate(count=Count("pk"), rolled_up=Count("pk", filter=Q(rolled_up=True)))
+        return counts["rolled_up"] == counts["count"] >= len(series_ids)
+
+    def range_filter(self, filter_kwargs):
+        """Translate SensorReading filter kwargs into the filter kwargs of the date ranges.
+
+        Args:
+            filter_kwargs (dict): Filter of the sensorreadings. Supported is no filter or a filter of the ids of one series field, e.g. processparameter_id__in.
+                Without filter the sensorreadings without sensor, processparameter and qualitycharacteristics are not considered.
+
+        Returns:
+            [dict or None]: Filter of the date ranges. None if the filter is not supported.
+        """
+        if not filter_kwargs:
+            return {}
+        if len(filter_kwargs) > 1:
+            return None
+        key, value = next(iter(filter_kwargs.items()))
+        if any(key in (series_field, series_field + "_id", series_field + "__in", series_field + "_id__in") for series_field in self.series_fields):
+            return {key: value}
+        return None
+
+    def date_range(self, filter_kwargs, using=None):
+        """Date of the oldest and of the youngest sensorreading of a filter with a single aggregate.
+        Filters of series are answered from the date ranges, other filters aggregate the sensorreadings.
+
+        Args:
+            filter_kwargs (dict): Filter of the sensorreadings.
+            using (str, optional): Name of the database. Defaults to the database of the router.
+
+        Returns:
+            [datetime.datetime or None]: Date of the oldest sensorreading, None without sensorreadings.
+            [datetime.datetime or None]: Date of the youngest sensorreading, None without sensorreadings.
+        """
+        range_kwargs = self.range_filter(filter_kwargs)
+        if range_kwargs is not None:
+            dates = self.using(using or router.db_for_read(self.model)).filter(**range_kwargs).aggregate(first_date=Min("first_date"), last_date=Max("last_date"))
+        else:
+            dates = SensorReading.objects.using(using or router.db_for_read(SensorReading)).filter(date__isnull=False, **filter_kwargs).aggregate(first_date=Min("date"), last_date=Max("date"))
+        return dates["first_date"], dates["last_date"]
+
+
+class SensorReadingDateRange(BaseModel):
+    """Date of the oldest and of the youngest sensorreading of a sensor, processparameter or qualitycharacteristic.
+    The date ranges are maintained when sensorreadings are imported or written by the api and caught up by the Rollup_SensorReadings task.
+    The daterange actions read them instead of searching the sensorreadings, the time window aggregations read whether the rollups contain the sensorreadings of the series.
+
+    Relationships:
+        SensorReadingDateRange to Sensor: OneToOne
+        SensorReadingDateRange to ProcessParameter: OneToOne
+        SensorReadingDateRange to QualityCharacteristics: OneToOne
+    """
+
+    first_date = models.DateTimeField()
+    last_date = models.DateTimeField()
+    # Whether the SensorReadingRollup instances contain every sensorreading of the series, see SensorReadingDateRangeManager.is_rolled_up.
+    rolled_up = models.BooleanField(default=False)
+
+    # Exactly one of sensor, processparameter and qualitycharacteristics is set.
+    sensor = models.OneToOneField('Sensor', related_name='%(class)s', default=None, null=True, blank=True, on_delete=models.CASCADE)
+    processparameter = models.OneToOneField('ProcessParameter', related_name='%(class)s', default=None, null=True, blank=True, on_delete=models.CASCADE)
+    qualitycharacteristics = models.OneToOneField('QualityCharacteristics', related_name='%(class)s', default=None, null=True, blank=True, on_delete=models.CASCADE)
+
+    objects = SensorReadingDateRangeManager()
+
+    def add_date(self, date):
+        """Add the date of a sensorreading of the series."""
+        self.first_date = min(self.first_date, date)
+        self.last_date = max(self.last_date, date)
+
+    def merge(self, other):
+        """Merge the date range of other sensorreadings of the same series. The series stays rolled up if the other sensorreadings are rolled up as well.
+
+        Args:
+            other (SensorReadingDateRange): Date range of the other sensorreadings.
+
+        Returns:
+            [SensorReadingDateRange]: The updated instance.
+        """
+        self.first_date = min(self.first_date, other.first_date)
+        self.last_date = max(self.last_date, other.last_date)
+        self.rolled_up = self.rolled_up and other.rolled_up
+        return self
+
+    def __str__(self):
+        return str(self.pk)
@@ -0,0 +1,324 @@
+# Copyright (c) 2022 RWTH Aachen - Werkzeugmaschinenlabor (WZL)
+# Contact: Simon Cramer, s.cramer@wzl-mq.rwth-aachen.de
+
+import datetime
+
+from django.db import models, router, transaction
+from django.db.models import Count, Avg, Variance, Min, Max, Q
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from orakel.models.utils import BaseModel, TimeBucket
+from .sensorreading import SensorReading
+from .sensorreadingdaterange import SensorReadingDateRange
+
+from more_itertools import chunked
+
+
+EPOCH = datetime.datetime(1970, 1, 1, tzinfo=datetime.timezone.utc)
+
+
+class SensorReadingRollupManager(models.Manager):
+    """Maintains the SensorReadingRollup instances and selects the rollup resolution of time window aggregations.
+    The rollups of a processstep or of the sensorreadings without processstep of a series are rebuilt from the sensorreadings or merged with appended sensorreadings.
+    """
+
+    series_fields = ('sensor', 'processparameter', 'qualitycharacteristics')
+    # Resolutions in seconds, every resolution divides a day, so the buckets start at midnight like the time windows of the aggregations.
+    resolutions = (1, 60, 3600, 86400)
+    batch_size = 5000
+    # Lookups of the relations that the rollups share with the sensorreadings.
+    relation_lookups = {field + lookup for field in ('processstep',) + series_fields for lookup in ('', '_id', '__in', '_id__in')}
+
+    @staticmethod
+    def bucket_start(date, resolution):
+        """Start of the bucket of the resolution that contains the date.
+
+        Args:
+            date (datetime.datetime): Date of a sensorreading. Naive dates are interpreted as UTC.
+            resolution (int): Length of the buckets in seconds.
+
+        Returns:
+            [datetime.datetime]: Start of the bucket in UTC.
+        """
+        if timezone.is_naive(date):
+            date = timezone.make_aware(date, datetime.timezone.utc)
+        window = datetime.timedelta(seconds=resolution)
+        return EPOCH + (date - EPOCH) // window * window
+
+    def group_rollups(self, sr_queryset, series_field, rollups):
+        """Roll up sensorreadings of a series field in all resolutions.
+        The finest resolution is grouped by the database, the coarser resolutions are combined from it.
+
+        Args:
+            sr_queryset (QuerySet): Sensorreadings.
+            series_field (str): One of series_fields.
+            rollups (dict): Rollups per (resolution, bucket start, processstep, series field, series), the rollups of the sensorreadings are merged into it.
+        """
+        finest = min(self.resolutions)
+        sr_queryset = sr_queryset.filter(**{series_field + "__isnull": False, "value__isnull": False, "date__isnull": False})
+        sr_queryset = sr_queryset.order_by().annotate(bucket=TimeBucket("date", EPOCH, datetime.timedelta(seconds=finest))).values("processstep", series_field, "bucket").annotate(
+                                                    count=Count("value"),
+                                                    mean=Avg("value"),
+                                                    variance=Variance("value"),
+                                                    min=Min("value"),
+                                                    max=Max("value"),
+                                                    )
+        for group in sr_queryset:
+            date = EPOCH + datetime.timedelta(seconds=group["bucket"] * finest)
+            finest_rollup = self.model(processstep_id=group["processstep"], count=group["count"], mean=group["mean"], m2=group["variance"] * group["count"],
+                                       min=group["min"], max=group["max"], **{series_field + "_id": group[series_field]})
+            for resolution in self.resolutions:
+                key = (resolution, self.bucket_start(date, resolution), group["processstep"], series_field, group[series_field])
+                if key not in rollups:
+                    rollups[key] = self.model(resolution=resolution, bucket_start=key[1], processstep_id=key[2], **{series_field + "_id": key[4]})
+                rollups[key].merge(finest_rollup)
+
+    def rebuild(self, processstep_ids, using=None):
+        """Recompute the rollups of the processsteps from their sensorreadings.
+
+        Args:
+            processstep_ids (list[int]): Ids of the processsteps.
+            using (str, optional): Name of the database. Defaults to the database of the router.
+        """
+        using = using or router.db_for_write(self.model)
+        processstep_ids = [processstep_id for processstep_id in set(processstep_ids) if processstep_id is not None]
+
+        rollups = {}
+        for series_field in self.series_fields:
+            self.group_rollups(SensorReading.objects.using(using).filter(processstep__in=processstep_ids), series_field, rollups)
+
+        with transaction.atomic(using=using):
+            self.using(using).filter(processstep__in=processstep_ids).delete()
+            self.using(using).bulk_create(rollups.values(), batch_size=self.batch_size)
+
+    def rebuild_without_processstep(self, series, using=None):
+        """Recompute the rollups of the sensorreadings without processstep of series.
+
+        Args:
+            series (dict): Ids of the sensors, processparameters and qualitycharacteristics per series field.
+            using (str, optional): Name of the database. Defaults to the database of the router.
+        """
+        using = using or router.db_for_write(self.model)
+
+        for series_field, series_ids in series.items():
+            for batch in chunked([series_id for series_id in set(series_ids) if series_id is not None], self.batch_size):
+                rollups = {}
+                self.group_rollups(SensorReading.objects.using(using).filter(**{"processstep__isnull": True, series_field + "__in": batch}), series_field, rollups)
+
+                with transaction.atomic(using=using):
+                    self.using(using).filter(**{"processstep__isnull": True, series_field + "__in": batch}).delete()
+                    self.using(using).bulk_create(rollups.values(), batch_size=self.batch_size)
+
+    def add_readings(self, readings, using=None):
+        """Merge sensorreadings that were appended to the database into the rollups of their buckets.
+        Call it within the transaction that creates the sensorreadings.
+
+        Args:
+            readings (list[SensorReading]): Created sensorreadings.
+            using (str, optional): Name of the database. Defaults to the database of the router.
+        """
+        using = using or router.db_for_write(self.model)
+
+        # Roll up the new sensorreadings per (resolution, bucket, processstep, series field, series).
+        groups = {}
+        for reading in readings:
+            if reading.value is None or reading.date is None:
+                continue
+            for series_field in self.series_fields:
+                series_id = getattr(reading, series_field + "_id")
+                if series_id is None:
+                    continue
+                for resolution in self.resolutions:
+                    key = (resolution, self.bucket_start(reading.date, resolution), reading.processstep_id, series_field, series_id)
+                    if key not in groups:
+                        groups[key] = self.model(resolution=resolution, bucket_start=key[1], processstep_id=reading.processstep_id, **{series_field + "_id": series_id})
+                    groups[key].add_value(reading.value)
+
+        if not groups:
+            return
+
+        with transaction.atomic(using=using):
+            processstep_ids = {processstep_id for _, _, processstep_id, _, _ in groups.keys()}
+            processstep_filter = Q(processstep__in=[processstep_id for processstep_id in processstep_ids if processstep_id is not None])
+            if None in processstep_ids:
+                processstep_filter |= Q(processstep__isnull=True)
+            # Only the buckets of the new sensorreadings are locked, concurrent imports of other buckets are not blocked.
+            existing = {}
+            for resolution in self.resolutions:
+                bucket_starts = sorted({bucket_start for group_resolution, bucket_start, _, _, _ in groups.keys() if group_resolution == resolution})
+                for batch in chunked(bucket_starts, self.batch_size):
+                    for rollup in self.using(using).select_for_update().filter(processstep_filter, resolution=resolution, bucket_start__in=batch).order_by():
+                        series_field = next(series_field for series_field in self.series_fields if getattr(rollup, series_field + "_id") is not None)
+                        existing[(rollup.resolution, rollup.bucket_start, rollup.processstep_id, series_field, getattr(rollup, series_field + "_id"))] = rollup
+
+            created, updated = [], []
+            for key, group in groups.items():
+                if key in existing:
+                    updated.append(existing[key].merge(group))
+                else:
+                    created.append(group)
+
+            self.using(using).bulk_create(created, batch_size=self.batch_size)
+            for batch in chunked(updated, self.batch_size):
+                self.using(using).bulk_update(batch, ["count", "mean", "m2", "min", "max"])
+
+    def rollup_filter(self, filter_kwargs):
+        """Translate SensorReading filter kwargs into the filter kwargs of the rollups.
+
+        Args:
+            filter_kwargs (dict): Filter of the sensorreadings. Supported are the series ids, the processstep ids and the date bounds date__gte and date__lte.
+
+        Returns:
+            [dict or None]: Filter of the rollups. None if the filter is not supported or a date bound can not be parsed.
+        """
+        rollup_kwargs = {}
+        for key, value in filter_kwargs.items():
+            if key in ("date__gte", "date__lte"):
+                date = value if isinstance(value, datetime.datetime) else parse_datetime(str(value))
+                if date is None:
+                    return None
+                rollup_kwargs[key] = timezone.make_aware(date, datetime.timezone.utc) if timezone.is_naive(date) else date
+            elif key in self.relation_lookups:
+                rollup_kwargs[key] = value
+            else:
+                return None
+        return rollup_kwargs
+
+    def resolution_for(self, window, filter_kwargs, using=None):
+        """Select the coarsest resolution whose buckets can be combined to the time windows of an aggregation.
+        The windows have to be multiples of the resolution and the date bounds have to be bucket boundaries.
+        An upper bound at the start of a bucket is only supported when no sensorreading has exactly this date.
+        The series of the filter have to be rolled up, see is_rolled_up.
+
+        Args:
+            window (datetime.timedelta): Length of the time windows.
+            filter_kwargs (dict): Filter of the sensorreadings.
+            using (str, optional): Name of the database. Defaults to the database of the router.
+
+        Returns:
+            [int or None]: Resolution in seconds, None if the sensorreadings have to be aggregated.
+        """
+        using = using or router.db_for_read(SensorReading)
+        rollup_kwargs = self.rollup_filter(filter_kwargs)
+        if rollup_kwargs is None:
+            return None
+        date_gte, date_lte = rollup_kwargs.get("date__gte"), rollup_kwargs.get("date__lte")
+
+        for resolution in sorted(self.resolutions, reverse=True):
+            bucket = datetime.timedelta(seconds=resolution)
+            if window % bucket:
+                continue
+            if date_gte is not None and (date_gte - EPOCH) % bucket:
+                continue
+            if date_lte is not None and (date_lte + datetime.timedelta(microseconds=1) - EPOCH) % bucket:
+                if (date_lte - EPOCH) % bucket or SensorReading.objects.using(using).filter(**dict(filter_kwargs, date__gte=date_lte)).exists():
+                    continue
+            return resolution if self.is_rolled_up(filter_kwargs, using) else None
+        return None
+
+    def is_rolled_up(self, filter_kwargs, using=None):
+        """Whether the rollups contain every sensorreading of the filter, read from the SensorReadingDateRange instances of its series.
+        Sensorreadings that bypassed the rollups, e.g. written before the rollups existed, are only rolled up when the Rollup_SensorReadings task caught up their series.
+
+        Args:
+            filter_kwargs (dict): Filter of the sensorreadings, see rollup_filter.
+            using (str, optional): Name of the database. Defaults to the database of the router.
+
+        Returns:
+            [bool]: Whether the series of the filter are rolled up.
+        """
+        # The processsteps and dates only select a part of the sensorreadings of the series.
+        series_kwargs = {key: value for key, value in filter_kwargs.items() if key not in ("date__gte", "date__lte") and not key.startswith("processstep")}
+        return SensorReadingDateRange.objects.is_rolled_up(series_kwargs, using)
+
+    def window_queryset(self, resolution, filter_kwargs, using=None):
+        """Rollups of a resolution that contain the sensorreadings of the filter.
+
+        Args:
+            resolution (int): Resolution of the rollups in seconds, e.g. selected by resolution_for.
+            filter_kwargs (dict): Filter of the sensorreadings.
+            using (str, optional): Name of the database. Defaults to the database of the router.
+
+        Returns:
+            [QuerySet]: Rollups without ordering.
+        """
+        rollup_kwargs = self.rollup_filter(filter_kwargs)
+        date_gte, date_lte = rollup_kwargs.pop("date__gte", None), rollup_kwargs.pop("date__lte", None)
+        queryset = self.using(using or router.db_for_read(self.model)).filter(resolution=resolution, **rollup_kwargs)
+        if date_gte is not None:
+            queryset = queryset.filter(bucket_start__gte=date_gte)
+        if date_lte is not None:
+            # The buckets end before the next microsecond or, when the bound is the start of a bucket without sensorreading at the bound, at the bound.
+            end = date_lte + datetime.timedelta(microseconds=1)
+            if (end - EPOCH) % datetime.timedelta(seconds=resolution):
+                end = date_lte
+            queryset = queryset.filter(bucket_start__lt=end)
+        return queryset.order_by()
+
+
+class SensorReadingRollup(BaseModel):
+    """Count, mean, sum of squared deviations from the mean (m2), min and max of the sensorreading values of a processstep per sensor, processparameter or qualitycharacteristic
+    and time bucket. The buckets are stored in several resolutions, so that time window aggregations over long ranges combine few rollups instead of all sensorreadings.
+    Values are added with Welford's algorithm and rollups are merged with the formula of Chan et al., which keeps the variance of large values with small deviations.
+    The rollups are maintained when sensorreadings are imported or written by the api and caught up by the Rollup_SensorReadings task.
+
+    Relationships:
+        SensorReadingRollup to ProcessStep: ManyToOne
+        SensorReadingRollup to Sensor: ManyToOne
+        SensorReadingRollup to ProcessParameter: ManyToOne
+        SensorReadingRollup to QualityCharacteristics: ManyToOne
+    """
+
+    # Length of the bucket in seconds.
+    resolution = models.PositiveIntegerField()
+    bucket_start = models.DateTimeField()
+    count = models.PositiveIntegerField(default=0)
+    mean = models.FloatField(default=0)
+    m2 = models.FloatField(default=0)
+    min = models.FloatField(default=None, null=True, blank=True)
+    max = models.FloatField(default=None, null=True, blank=True)
+
+    # Exactly one of sensor, processparameter and qualitycharacteristics is set.
+    processstep = models.ForeignKey('ProcessStep', related_name='%(class)s', default=None, null=True, blank=True, on_delete=models.CASCADE)
+    sensor = models.ForeignKey('Sensor', related_name='%(class)s', default=None, null=True, blank=True, on_delete=models.CASCADE)
+    processparameter = models.ForeignKey('ProcessParameter', related_name='%(class)s', default=None, null=True, blank=True, on_delete=models.CASCADE)
+    qualitycharacteristics = models.ForeignKey('QualityCharacteristics', related_name='%(class)s', default=None, null=True, blank=True, on_delete=models.CASCADE)
+
+    objects = SensorReadingRollupManager()
+
+    class Meta(BaseModel.Meta):
+        indexes = [models.Index(fields=['sensor', 'resolution', 'bucket_start']),
+                   models.Index(fields=['processparameter', 'resolution', 'bucket_start']),
+                   models.Index(fields=['qualitycharacteristics', 'resolution', 'bucket_start']),
+                   models.Index(fields=['processstep', 'resolution', 'bucket_start']),
+                   ]
+
+    def add_value(self, value):
+        """Add a sensorreading value of the bucket."""
+        self.count += 1
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (value - self.mean)
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+
+    def merge(self, other):
+        """Merge the rollup of other sensorreadings of the same bucket.
+
+        Args:
+            other (SensorReadingRollup): Rollup of the other sensorreadings.
+
+        Returns:
+            [SensorReadingRollup]: The updated instance.
+        """
+        count = self.count + other.count
+        delta = other.mean - self.mean
+        self.mean += delta * other.count / count
+        self.m2 += other.m2 + delta * delta * self.count * other.count / count
+        self.count = count
+        self.min = other.min if self.min is None else min(self.min, other.min)
+        self.max = other.max if self.max is None else max(self.max, other.max)
+        return self
+
+    def __str__(self):
+        return str(self.pk)
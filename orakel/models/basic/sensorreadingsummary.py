@@ -0,0 +1,201 @@
+# Copyright (c) 2022 RWTH Aachen - Werkzeugmaschinenlabor (WZL)
+# Contact: Simon Cramer, s.cramer@wzl-mq.rwth-aachen.de
+
+from django.db import IntegrityError, models, router, transaction
+from django.db.models import Count, Avg, Variance, Min, Max, OuterRef, Subquery
+from orakel.models.utils import BaseModel
+from .sensorreading import SensorReading
+
+from more_itertools import chunked
+
+
+class SensorReadingSummaryManager(models.Manager):
+    """Maintains the SensorReadingSummary instances. The summaries are rebuilt from the sensorreadings of a processstep or merged with appended sensorreadings."""
+
+    feature_fields = ('processparameter', 'qualitycharacteristics')
+    batch_size = 5000
+    # Attempts to merge new sensorreadings when concurrent transactions insert the same summaries.
+    insert_attempts = 3
+
+    def rebuild(self, processstep_ids, using=None):
+        """Recompute the summaries of the processsteps from their sensorreadings.
+
+        Args:
+            processstep_ids (list[int]): Ids of the processsteps.
+            using (str, optional): Name of the database. Defaults to the database of the router.
+        """
+        using = using or router.db_for_write(self.model)
+        processstep_ids = [processstep_id for processstep_id in set(processstep_ids) if processstep_id is not None]
+
+        summaries = []
+        for feature_field in self.feature_fields:
+            sr_queryset = SensorReading.objects.using(using).filter(**{"processstep__in": processstep_ids, feature_field + "__isnull": False, "value__isnull": False})
+            # The first and last value are the values of the earliest and latest sensorreading of the group.
+            group_readings = SensorReading.objects.using(using).filter(**{"processstep": OuterRef("processstep"), feature_field: OuterRef(feature_field),
+                                                                          "value__isnull": False, "date__isnull": False})
+            sr_queryset = sr_queryset.order_by().values("processstep", feature_field).annotate(
+                                                        count=Count("value"),
+                                                        mean=Avg("value"),
+                                                        # Population variance of the database, which is stable for large values unlike the sum of squares.
+                                                        variance=Variance("value"),
+                                                        min=Min("value"),
+                                                        max=Max("value"),
+                                                        first_date=Min("date"),
+                                                        last_date=Max("date"),
+                                                        first_value=Subquery(group_readings.order_by("date", "id").values("value")[:1]),
+                                                        last_value=Subquery(group_readings.order_by("-date", "-id").values("value")[:1]),
+                                                        )
+            for group in sr_queryset:
+                group["processstep_id"] = group.pop("processstep")
+                group[feature_field + "_id"] = group.pop(feature_field)
+                group["m2"] = group.pop("variance") * group["count"]
+                summaries.append(self.model(**group))
+
+        with transaction.atomic(using=using):
+            self.using(using).filter(processstep__in=processstep_ids).delete()
+            self.using(using).bulk_create(summaries, batch_size=self.batch_size)
+
+    def add_readings(self, readings, using=None):
+        """Merge sensorreadings that were appended to the database into the summaries of their processsteps.
+        Call it within the transaction that creates the sensorreadings.
+
+        Args:
+            readings (list[SensorReading]): Created sensorreadings in the order of creation.
+            using (str, optional): Name of the database. Defaults to the database of the router.
+        """
+        using = using or router.db_for_write(self.model)
+
+        # Summarize the new sensorreadings per (processstep, feature field, feature).
+        groups = {}
+        for reading in readings:
+            if reading.value is None or reading.processstep_id is None:
+                continue
+            for feature_field in self.feature_fields:
+                feature_id = getattr(reading, feature_field + "_id")
+                if feature_id is None:
+                    continue
+                key = (reading.processstep_id, feature_field, feature_id)
+                if key not in groups:
+                    groups[key] = self.model(processstep_id=reading.processstep_id, **{feature_field + "_id": feature_id})
+                groups[key].add_value(reading.value, reading.date)
+
+        if not groups:
+            return
+
+        # A concurrent transaction can insert a summary of the same processstep and feature after the locking read.
+        # The insert violates the unique constraints then and the groups are merged again with the inserted summaries.
+        for attempt in range(self.insert_attempts):
+            try:
+                with transaction.atomic(using=using):
+                    self.merge_groups(groups, using)
+                return
+            except IntegrityError:
+                if attempt == self.insert_attempts - 1:
+                    raise
+
+    def merge_groups(self, groups, using):
+        """Merge the summaries of new sensorreadings into the locked summaries of their processsteps or insert them.
+
+        Args:
+            groups (dict): Summaries of the new sensorreadings per (processstep id, feature field, feature id).
+            using (str): Name of the database.
+        """
+        processstep_ids = {processstep_id for processstep_id, _, _ in groups.keys()}
+        existing = {}
+        for summary in self.using(using).select_for_update().filter(processstep__in=processstep_ids).order_by():
+            feature_field = "processparameter" if summary.processparameter_id is not None else "qualitycharacteristics"
+            existing[(summary.processstep_id, feature_field, getattr(summary, feature_field + "_id"))] = summary
+
+        created, updated = [], []
+        for key, group in groups.items():
+            if key in existing:
+                updated.append(existing[key].merge(group))
+            else:
+                created.append(group)
+
+        self.using(using).bulk_create(created, batch_size=self.batch_size)
+        fields = ["count", "mean", "m2", "min", "max", "first_date", "last_date", "first_value", "last_value"]
+        for batch in chunked(updated, self.batch_size):
+            self.using(using).bulk_update(batch, fields)
+
+
+class SensorReadingSummary(BaseModel):
+    """Running statistics of the sensorreading values of a processstep per processparameter or qualitycharacteristic.
+    The summaries are maintained when sensorreadings are imported or written by the api and caught up by the Rollup_SensorReadings task.
+    All summaries can be rebuilt with the command backfill_sensorreadingsummary.
+    The dataframe creation combines them to Min, Max, Avg and StdDev per product without scanning the sensorreadings.
+    The values are summarized by their mean and the sum of squared deviations from the mean (m2), which are updated with Welford's algorithm
+    and merged with the formula of Chan et al. A sum of squares loses the variance of large values with small deviations.
+
+    Relationships:
+        SensorReadingSummary to ProcessStep: ManyToOne (summarizes the sensorreadings of a processstep)
+        SensorReadingSummary to ProcessParameter: ManyToOne
+        SensorReadingSummary to QualityCharacteristics: ManyToOne
+    """
+
+    count = models.PositiveIntegerField(default=0)
+    mean = models.FloatField(default=0)
+    m2 = models.FloatField(default=0)
+    min = models.FloatField(default=None, null=True, blank=True)
+    max = models.FloatField(default=None, null=True, blank=True)
+    first_date = models.DateTimeField(default=None, null=True, blank=True)
+    last_date = models.DateTimeField(default=None, null=True, blank=True)
+    first_value = models.FloatField(default=None, null=True, blank=True)
+    last_value = models.FloatField(default=None, null=True, blank=True)
+
+    # Either processparameter or qualitycharacteristics is set.
+    processstep = models.ForeignKey('ProcessStep', related_name='%(class)s', on_delete=models.CASCADE)
+    processparameter = models.ForeignKey('ProcessParameter', related_name='%(class)s', default=None, null=True, blank=True, on_delete=models.CASCADE)
+    qualitycharacteristics = models.ForeignKey('QualityCharacteristics', related_name='%(class)s', default=None, null=True, blank=True, on_delete=models.CASCADE)
+
+    objects = SensorReadingSummaryManager()
+
+    class Meta(BaseModel.Meta):
+        constraints = [models.UniqueConstraint(fields=['processstep', 'processparameter'], name='unique_summary_processstep_processparameter'),
+                       models.UniqueConstraint(fields=['processstep', 'qualitycharacteristics'], name='unique_summary_processstep_qualitycharacteristics'),
+                       ]
+
+    def add_value(self, value, date):
+        """Add a sensorreading value that is newer than the summarized values.
+
+        Args:
+            value (float): Value of the sensorreading.
+            date (datetime): Date of the sensorreading, None is not considered for the first and last value.
+        """
+        self.count += 1
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (value - self.mean)
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+        if date is not None:
+            # Equal dates keep the earlier sensorreading as first and the later one as last value.
+            if self.first_date is None or date < self.first_date:
+                self.first_date, self.first_value = date, value
+            if self.last_date is None or date >= self.last_date:
+                self.last_date, self.last_value = date, value
+
+    def merge(self, other):
+        """Merge the summary of newer sensorreadings of the same processstep and feature.
+
+        Args:
+            other (SensorReadingSummary): Summary of the newer sensorreadings.
+
+        Returns:
+            [SensorReadingSummary]: The updated instance.
+        """
+        count = self.count + other.count
+        delta = other.mean - self.mean
+        self.mean += delta * other.count / count
+        self.m2 += other.m2 + delta * delta * self.count * other.count / count
+        self.count = count
+        self.min = other.min if self.min is None else min(self.min, other.min)
+        self.max = other.max if self.max is None else max(self.max, other.max)
+        if other.first_date is not None and (self.first_date is None or other.first_date < self.first_date):
+            self.first_date, self.first_value = other.first_date, other.first_value
+        if other.last_date is not None and (self.last_date is None or other.last_date >= self.last_date):
+            self.last_date, self.last_value = other.last_date, other.last_value
+        return self
+
+    def __str__(self):
+        return str(self.pk)
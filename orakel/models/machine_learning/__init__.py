@@ -2,6 +2,7 @@
 # Contact: Simon Cramer, s.cramer@wzl-mq.rwth-aachen.de
 
 from .dataframe import DataFrame
+from .dataframe_partition import DataFramePartition
 from .ml_run_specification import MachineLearningRunSpecification
 from .ml_run import MachineLearningRun
 from .pipelineblock import PipelineBlock
@@ -20,14 +20,24 @@ class DataFrame(BaseModel):
         Dataframe to QualityCharacteristics: ManyToMany
         Dataframe to target_value(QualityCharacteristics): ManyToMany
         MachineLearningRunSpecification to DataFrame: ManyToOne
+        DataFramePartition to DataFrame: ManyToOne
     """
     status_choices = ( ('Pending', 'Pending'),
                         ('Scheduled', 'Scheduled'),
                         ('Failed', 'Failed'),
                         ('Succeeded', 'Succeeded'),
                         ('Running', 'Running'),
+                        ('Cancelled', 'Cancelled'),
                         ('Other', 'Other')
     )
+    artifact_format_choices = ( ('feather', 'feather'),
+                                ('parquet', 'parquet')
+    )
+    compression_choices = ( ('uncompressed', 'uncompressed'),
+                            ('zstd', 'zstd'),
+                            ('lz4', 'lz4'),
+                            ('snappy', 'snappy')
+    )
 
 
     name = models.CharField(max_length=100, default=None ,null=True, blank=True)
@@ -37,7 +47,32 @@ class DataFrame(BaseModel):
     product_amount = models.PositiveIntegerField(default=500000)
     time_series_data = models.BooleanField(default=False, blank=True, null=True)
     random_records = models.BooleanField(default=True, blank=True, null=True)
+    # Seed of the random product selection. Set by the first random build when empty, the same seed selects the same products.
+    random_seed = models.PositiveIntegerField(default=None, null=True, blank=True)
     feature_config = models.JSONField(default=None, null=True, blank=True)
+    # Rows per chunk when time series data (StackedDataFrame) is streamed to the save_path. The whole dataset is loaded into memory when not set.
+    streaming_chunk_size = models.PositiveIntegerField(default=None, null=True, blank=True)
+    # Amount of product shards that are built in parallel by separate CreateDataframe tasks.
+    partitions = models.PositiveIntegerField(default=1)
+    # Format of the x and y files. Parquet files are split into row groups with statistics, snappy is only available for parquet.
+    artifact_format = models.CharField(default='feather', choices=artifact_format_choices, max_length=20)
+    compression = models.CharField(default='uncompressed', choices=compression_choices, max_length=20)
+    float32 = models.BooleanField(default=False)
+    row_group_size = models.PositiveIntegerField(default=None, null=True, blank=True)
+    # Fingerprint of the configuration and the sensorreadings of the last successful build. Builds with the same fingerprint reuse its files.
+    fingerprint = models.CharField(max_length=64, default=None, null=True, blank=True, db_index=True)
+    # Fingerprint of the configuration of the last successful build. Refreshes of a changed configuration build all products.
+    config_fingerprint = models.CharField(max_length=64, default=None, null=True, blank=True)
+    cache_hits = models.PositiveIntegerField(default=0)
+    cache_misses = models.PositiveIntegerField(default=0)
+    # Highest product id that was considered by the last successful build. Refreshes only build newer products.
+    product_high_water_mark = models.PositiveIntegerField(default=None, null=True, blank=True)
+    # Requests the cooperative cancellation of the running build. Reset when a build is submitted.
+    cancel_requested = models.BooleanField(default=False)
+    # Progress of the running or last build, updated by the CreateDataframe task at a throttled rate.
+    progress = models.JSONField(default=None, null=True, blank=True)
+    # Wall time, fetched rows, SQL queries and peak RSS per stage of the last build.
+    instrumentation = models.JSONField(default=None, null=True, blank=True)
 
     # Related Fields
     productspecification = models.ForeignKey('ProductSpecification', related_name='%(class)s', default=None, blank=True, null=True, on_delete=models.SET_NULL)
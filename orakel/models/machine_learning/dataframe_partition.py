@@ -0,0 +1,44 @@
+# Copyright (c) 2022 RWTH Aachen - Werkzeugmaschinenlabor (WZL)
+# Contact: Simon Cramer, s.cramer@wzl-mq.rwth-aachen.de
+
+from django.db import models
+from orakel.models.utils import BaseModel
+
+
+class DataFramePartition(BaseModel):
+    """A shard of the products of a partitioned DataFrame build.
+    Each partition is built by its own CreateDataframe task and tracks the progress of this task.
+    The partial dataframes are concatenated by the MergeDataframePartitions task when all partitions are finished.
+
+    Relationships:
+        DataFramePartition to DataFrame: ManyToOne
+    """
+    status_choices = ( ('Scheduled', 'Scheduled'),
+                        ('Running', 'Running'),
+                        ('Failed', 'Failed'),
+                        ('Succeeded', 'Succeeded'),
+                        ('Cancelled', 'Cancelled'),
+    )
+
+    partition = models.PositiveIntegerField(default=0)
+    status = models.CharField(default='Scheduled', choices=status_choices, max_length=20)
+    task_id = models.CharField(max_length=200, default=None, null=True, blank=True)
+    product_amount = models.PositiveIntegerField(default=0)
+    first_product_id = models.PositiveIntegerField(default=None, null=True, blank=True)
+    last_product_id = models.PositiveIntegerField(default=None, null=True, blank=True)
+    started = models.DateTimeField(default=None, null=True, blank=True)
+    ended = models.DateTimeField(default=None, null=True, blank=True)
+    # Progress of the partition build, updated by its CreateDataframe task at a throttled rate.
+    progress = models.JSONField(default=None, null=True, blank=True)
+    # Wall time, fetched rows, SQL queries and peak RSS per stage of the partition build.
+    instrumentation = models.JSONField(default=None, null=True, blank=True)
+
+    # Related Fields
+    dataframe = models.ForeignKey('DataFrame', related_name='%(class)s', default=None, null=True, blank=True, on_delete=models.CASCADE)
+
+    class Meta(BaseModel.Meta):
+        ordering = ['partition']
+        indexes = [models.Index(fields=['dataframe', 'partition'])]
+
+    def __str__(self):
+        return "{}/{}".format(self.dataframe_id, self.partition)
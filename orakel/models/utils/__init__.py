@@ -2,3 +2,4 @@
 # Contact: Simon Cramer, s.cramer@wzl-mq.rwth-aachen.de
 
 from .base_model import BaseModel
+from .functions import TimeBucket
@@ -0,0 +1,43 @@
+# Copyright (c) 2022 RWTH Aachen - Werkzeugmaschinenlabor (WZL)
+# Contact: Simon Cramer, s.cramer@wzl-mq.rwth-aachen.de
+
+import datetime
+
+from django.db.models import BigIntegerField, Func
+
+
+class TimeBucket(Func):
+    """Index of the time window that contains a datetime, counted from origin in windows of the given length.
+    The index is computed with an integer division, so only datetimes at or after the origin are supported.
+    Windows are bounded by whole microseconds, SQLite dates are compared with microsecond precision as well.
+    """
+    output_field = BigIntegerField()
+
+    def __init__(self, expression, origin, window, **extra):
+        """
+        Args:
+            expression (str or Expression): Datetime field or expression.
+            origin (datetime.datetime): Start of the first window, timezone aware.
+            window (datetime.timedelta): Length of the windows.
+        """
+        self.origin = origin
+        self.window_us = window // datetime.timedelta(microseconds=1)
+        super().__init__(expression, **extra)
+
+    def as_sql(self, compiler, connection, **extra_context):
+        sql, params = compiler.compile(self.source_expressions[0])
+        origin = connection.ops.adapt_datetimefield_value(self.origin)
+        return "FLOOR(EXTRACT(EPOCH FROM ({} - %s)) * 1000000 / %s)".format(sql), params + [origin, self.window_us]
+
+    def as_mysql(self, compiler, connection, **extra_context):
+        sql, params = compiler.compile(self.source_expressions[0])
+        origin = connection.ops.adapt_datetimefield_value(self.origin)
+        return "TIMESTAMPDIFF(MICROSECOND, %s, {}) DIV %s".format(sql), [origin] + params + [self.window_us]
+
+    def as_sqlite(self, compiler, connection, **extra_context):
+        sql, params = compiler.compile(self.source_expressions[0])
+        # Dates are stored as 'YYYY-MM-DD HH:MM:SS[.ffffff]' in UTC, the fraction is omitted when it is zero.
+        # strftime rounds fractions to milliseconds, so the seconds and the microseconds are parsed separately.
+        epoch_us = "(CAST(strftime('%%s', substr({sql}, 1, 19)) AS INTEGER) * 1000000 + CAST(substr({sql} || '.000000', 21, 6) AS INTEGER))".format(sql=sql)
+        origin_us = (self.origin - datetime.datetime(1970, 1, 1, tzinfo=datetime.timezone.utc)) // datetime.timedelta(microseconds=1)
+        return "({} - %s) / %s".format(epoch_us), params + params + [origin_us, self.window_us]
@@ -1,4 +1,5 @@
 # Copyright (c) 2022 RWTH Aachen - Werkzeugmaschinenlabor (WZL)
 # Contact: Simon Cramer, s.cramer@wzl-mq.rwth-aachen.de
 
+from .arrow_renderer import ArrowRenderer
 from .no_filter_renderer import NoFilterBrowsableAPIRenderer
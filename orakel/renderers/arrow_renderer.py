@@ -0,0 +1,84 @@
+# Copyright (c) 2022 RWTH Aachen - Werkzeugmaschinenlabor (WZL)
+# Contact: Simon Cramer, s.cramer@wzl-mq.rwth-aachen.de
+
+import json
+
+import pyarrow as pa
+from rest_framework.renderers import BaseRenderer
+from rest_framework.utils.encoders import JSONEncoder
+
+
+class ArrowRenderer(BaseRenderer):
+    """Renders response data as a columnar Apache Arrow IPC stream, selected with the Accept header application/vnd.apache.arrow.stream or ?format=arrow.
+    Clients read the stream without parsing, e.g. pyarrow.ipc.open_stream(content).read_all() or tableFromIPC in Arrow JS.
+
+    Views pass a pyarrow.Table, e.g. of orakel.views.utils.columnar. The count, next and previous links of paginated data are stored as JSON in the schema metadata.
+    Other data is converted row by row: lists of dicts become one column per key, nested dicts are flattened to <key>.<nested key>,
+    single values become a column 'value' and messages a column 'detail'.
+    """
+    media_type = 'application/vnd.apache.arrow.stream'
+    format = 'arrow'
+    charset = None
+    render_style = 'binary'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+
+        metadata = {}
+        if isinstance(data, dict) and 'results' in data:
+            metadata = {key: json.dumps(value, cls=JSONEncoder) for key, value in data.items() if key != 'results'}
+            data = data['results']
+        table = data if isinstance(data, pa.Table) else self.rows_table(data)
+        if metadata:
+            table = table.replace_schema_metadata(dict(table.schema.metadata or {}, **metadata))
+
+        sink = pa.BufferOutputStream()
+        with pa.ipc.new_stream(sink, table.schema) as writer:
+            writer.write_table(table)
+        return sink.getvalue().to_pybytes()
+
+    @classmethod
+    def flatten(cls, row, prefix=''):
+        """Flatten nested dicts to a single dict.
+
+        Args:
+            row (dict): Row of the response data.
+            prefix (str, optional): Prefix of the keys. Defaults to ''.
+
+        Returns:
+            [dict]: Values per <key>.<nested key>.
+        """
+        flat = {}
+        for key, value in row.items():
+            if isinstance(value, dict):
+                flat.update(cls.flatten(value, prefix + str(key) + '.'))
+            else:
+                flat[prefix + str(key)] = value
+        return flat
+
+    @classmethod
+    def rows_table(cls, data):
+        """Table of response data that is not columnar.
+
+        Args:
+            data (list, dict, str or value): Response data.
+
+        Returns:
+            [pa.Table]: One row per list item, missing keys are null.
+        """
+        if isinstance(data, str):
+            data = {'detail': data}
+        rows = data if isinstance(data, list) else [data]
+        rows = [cls.flatten(row) if isinstance(row, dict) else {'value': row} for row in rows]
+
+        keys = list(dict.fromkeys(key for row in rows for key in row))
+        # Values that Arrow can not convert, e.g. urls in lists of related instances, are sent as JSON.
+        columns = {}
+        for key in keys:
+            values = [row.get(key) for row in rows]
+            try:
+                columns[key] = pa.array(values)
+            except (pa.ArrowInvalid, pa.ArrowTypeError):
+                columns[key] = pa.array([None if value is None else json.dumps(value, cls=JSONEncoder) for value in values], type=pa.string())
+        return pa.table(columns)
@@ -1,6 +1,8 @@
 # Copyright (c) 2022 RWTH Aachen - Werkzeugmaschinenlabor (WZL)
 # Contact: Simon Cramer, s.cramer@wzl-mq.rwth-aachen.de
 
+from django.db import router, transaction
+
 from orakel import models
 from orakel.serializers.utils import BaseSerializer, PrimaryKeyRelatedField, HyperlinkedIdentityField
 
@@ -27,3 +29,27 @@ class SensorReadingSerializer(BaseSerializer):
         model = models.SensorReading
         fields = ('id','url','value','date','sensor', 'processparameter', 'qualitycharacteristics','processstep','event')
         depth = 1
+
+    def create(self, validated_data):
+        # Keep the summary and the rollups of the processstep and the date ranges of the series up to date within the transaction of the sensorreading.
+        with transaction.atomic(using=router.db_for_write(models.SensorReading)):
+            instance = super().create(validated_data)
+            models.SensorReadingSummary.objects.add_readings([instance])
+            models.SensorReadingRollup.objects.add_readings([instance])
+            models.SensorReadingDateRange.objects.add_readings([instance])
+        return instance
+
+    def update(self, instance, validated_data):
+        # Rebuild the summaries and the rollups of the previous and the new processstep and the date ranges of the previous and the new series.
+        with transaction.atomic(using=router.db_for_write(models.SensorReading)):
+            processstep_id = instance.processstep_id
+            series = models.SensorReadingDateRange.objects.series_of([instance])
+            instance = super().update(instance, validated_data)
+            models.SensorReadingSummary.objects.rebuild([processstep_id, instance.processstep_id])
+            models.SensorReadingRollup.objects.rebuild([processstep_id, instance.processstep_id])
+            for series_field, series_ids in models.SensorReadingDateRange.objects.series_of([instance]).items():
+                series[series_field] |= series_ids
+            if None in (processstep_id, instance.processstep_id):
+                models.SensorReadingRollup.objects.rebuild_without_processstep(series)
+            models.SensorReadingDateRange.objects.rebuild(series)
+        return instance
@@ -28,6 +28,18 @@ class DataFrameSerializer(BaseSerializer):
 
     status = serializers.CharField(read_only=True)
     product_amount = serializers.IntegerField(required=False, min_value=1, max_value=500000)
+    random_seed = serializers.IntegerField(required=False, allow_null=True, min_value=0, max_value=2**31 - 1)
+    streaming_chunk_size = serializers.IntegerField(required=False, allow_null=True, min_value=1000, max_value=10000000)
+    partitions = serializers.IntegerField(required=False, min_value=1, max_value=64)
+    row_group_size = serializers.IntegerField(required=False, allow_null=True, min_value=1000, max_value=10000000)
+    fingerprint = serializers.CharField(read_only=True)
+    config_fingerprint = serializers.CharField(read_only=True)
+    cache_hits = serializers.IntegerField(read_only=True)
+    cache_misses = serializers.IntegerField(read_only=True)
+    product_high_water_mark = serializers.IntegerField(read_only=True)
+    cancel_requested = serializers.BooleanField(read_only=True)
+    progress = serializers.JSONField(read_only=True)
+    instrumentation = serializers.JSONField(read_only=True)
     processstepspecification_choice = serializers.SerializerMethodField(method_name="get_processstepspecification_choice")
     processparameter_choice = serializers.SerializerMethodField(method_name="get_processparameter_choice")
     qualitycharacteristics_choice = serializers.SerializerMethodField(method_name="get_qualitycharacteristics_choice")
@@ -39,13 +51,13 @@ class DataFrameSerializer(BaseSerializer):
     class Meta:
         model = models.DataFrame
         read_only_fields = ('processstepspecification_choice', 'realsensor_choice')
-        fields = ('id','url','name','description', 'status', 'save_path', 'product_amount', 'random_records', 'feature_config','time_series_data', 'productspecification',
+        fields = ('id','url','name','description', 'status', 'save_path', 'product_amount', 'random_records', 'random_seed', 'feature_config','time_series_data', 'streaming_chunk_size', 'partitions', 'artifact_format', 'compression', 'float32', 'row_group_size', 'fingerprint', 'config_fingerprint', 'cache_hits', 'cache_misses', 'product_high_water_mark', 'cancel_requested', 'progress', 'instrumentation', 'productspecification',
                   'processstepspecification', 'processstepspecification_choice', 'qualitycharacteristics', 'processparameter', 'processparameter_choice', 'qualitycharacteristics_choice', 'target_value')
         depth  = 1
 
     def validate_feature_config(self, value):
         # Ensure that the list only contains one of the allowed_list_values which could be use for the dataframe creation.
-        allowed_list_values = ["Min", "Max", "Avg", "StdDev", "StackedDataFrame"]
+        allowed_list_values = ["Min", "Max", "Avg", "StdDev", "Count", "Range", "RMS", "Skew", "Kurtosis", "First", "Last", "Median", "P05", "P25", "P75", "P95", "StackedDataFrame"]
         if type(value) != list:
             raise serializers.ValidationError("Type {} is not supported for field feature_config. Please provide a list!".format(type(value)))
 
@@ -56,6 +68,15 @@ class DataFrameSerializer(BaseSerializer):
         return value
 
 
+    def validate(self, attrs):
+        # Ensure that the compression is supported by the artifact format.
+        artifact_format = attrs.get('artifact_format', getattr(self.instance, 'artifact_format', 'feather'))
+        compression = attrs.get('compression', getattr(self.instance, 'compression', 'uncompressed'))
+        if artifact_format == 'feather' and compression == 'snappy':
+            raise serializers.ValidationError("Compression snappy is not supported for feather files. Please use zstd or lz4!")
+
+        return attrs
+
     def validate_processstepspecification(self, value):
         # Ensure that the processstepspecification intances are related to the dataframe.productspecification
         if hasattr(self, 'instance'):
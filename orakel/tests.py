@@ -0,0 +1,706 @@
+# Copyright (c) 2022 RWTH Aachen - Werkzeugmaschinenlabor (WZL)
+# Contact: Simon Cramer, s.cramer@wzl-mq.rwth-aachen.de
+
+import datetime
+import json
+import os
+import re
+from urllib.parse import parse_qs, urlparse
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import connection
+from django.db.models import F, Max, Min
+from django.test import TestCase
+from rest_framework.exceptions import NotFound
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+from job_scheduler.tasks import RollupSensorReadings
+
+from orakel.models import ProcessParameter, ProcessStep, Product, QualityCharacteristics, Sensor, SensorReading, SensorReadingDateRange, SensorReadingRollup
+from orakel.models.utils import TimeBucket
+from orakel.renderers import ArrowRenderer
+from orakel.views.utils.aggregation import TimeSeriesAggregation, parse_aggregation_functions, parse_aggregation_window, timestamp_strings
+from orakel.views.basic.processparameter_views import ProcessParameterViewSet
+from orakel.views.basic.sensorreading_views import SensorReadingViewSet
+from orakel.views.utils.pagination import KeysetPagination, LinkHeaderKeysetPagination
+from orakel.views.utils.downsampling import downsample, downsampled_readings, lttb, min_max, read_points
+
+
+TEST_DATASET = os.path.join(settings.BASE_DIR, "test_data", "test_dataset.json")
+
+
+def legacy_time_window_aggregation(queryset, freq, aggregationFcn):
+    """Reference implementation of the former pandas grouping in SensorReadingViewSet.aggregation."""
+    df = pd.DataFrame(list(queryset.order_by('date').only('date', 'value').values()))
+    df['date'] = pd.to_datetime(df['date'])
+    df['value'] = df['value'].astype(float)
+    df = df[['date', 'value']]
+    df = df.set_index('date', drop=False)
+    grouped = df.groupby([pd.Grouper(freq=freq)])
+    df = {'min': grouped.min, 'max': grouped.max, 'std': grouped.std}.get(aggregationFcn, grouped.mean)()
+    df.index = df.index.map(lambda x: datetime.datetime.strftime(x, '%Y-%m-%dT%H:%M:%SZ'))
+    df.dropna(subset=['value'], inplace=True)
+    return [{'date': str(index), 'value': row['value']} for index, row in df.iterrows()]
+
+
+def time_window_aggregation(filter_kwargs, delta, aggregationFcn, use_rollups):
+    """Time windows of SensorReadingViewSet.aggregation with or without the rollups."""
+    aggregation = TimeSeriesAggregation(filter_kwargs, delta, [aggregationFcn] if aggregationFcn else [])
+    aggregation.use_rollups = use_rollups
+    window_queryset, origin = aggregation.windows()
+    return aggregation.window_payload(window_queryset, origin)
+
+
+class TimeWindowAggregationTest(TestCase):
+    """Compare the time windows that are aggregated in the database with the former pandas grouping."""
+
+    fixtures = [TEST_DATASET]
+
+    def aggregate(self, filter_kwargs, delta, aggregationFcn):
+        # The fixture has no rollups, the windows are aggregated from the sensorreadings.
+        return time_window_aggregation(filter_kwargs, delta, aggregationFcn, use_rollups=False)
+
+    def assert_windows_equal(self, windows, expected):
+        self.assertEqual([window['date'] for window in windows], [window['date'] for window in expected])
+        np.testing.assert_allclose([window['value'] for window in windows], [window['value'] for window in expected], rtol=1e-9)
+
+    def test_windows_match_pandas(self):
+        processparameter = ProcessParameter.objects.order_by('pk').first()
+        first_date = SensorReading.objects.filter(processparameter=processparameter).order_by('date').first().date
+        # The former grouping creates all windows between the first and the last date, keep the range short.
+        filter_kwargs = {'processparameter_id': processparameter.pk, 'date__lte': first_date + datetime.timedelta(days=2)}
+        queryset = SensorReading.objects.filter(**filter_kwargs)
+        for delta, freq in ((datetime.timedelta(minutes=1), '1T'), (datetime.timedelta(seconds=7), '7S'), (datetime.timedelta(milliseconds=500), '500L')):
+            for aggregationFcn in (None, 'avg', 'min', 'max', 'std'):
+                with self.subTest(freq=freq, aggregationFcn=aggregationFcn):
+                    self.assert_windows_equal(self.aggregate(filter_kwargs, delta, aggregationFcn), legacy_time_window_aggregation(queryset, freq, aggregationFcn))
+
+    def test_window_boundaries(self):
+        # A sensorreading at the start of a window belongs to that window, one microsecond before to the previous window.
+        sensorreading = SensorReading.objects.filter(date__isnull=False).order_by('pk').first()
+        midnight = sensorreading.date.replace(hour=0, minute=0, second=0, microsecond=0)
+        SensorReading.objects.filter(pk=sensorreading.pk).update(date=midnight + datetime.timedelta(seconds=10))
+        other = SensorReading.objects.create(value=sensorreading.value + 1, date=midnight + datetime.timedelta(seconds=10, microseconds=-1), processparameter=sensorreading.processparameter)
+        windows = self.aggregate({'pk__in': [sensorreading.pk, other.pk]}, datetime.timedelta(seconds=5), 'max')
+
+        self.assertEqual([window['date'] for window in windows], [(midnight + datetime.timedelta(seconds=5)).strftime('%Y-%m-%dT%H:%M:%SZ'),
+                                                                 (midnight + datetime.timedelta(seconds=10)).strftime('%Y-%m-%dT%H:%M:%SZ')])
+
+    def test_no_sensorreadings(self):
+        self.assertEqual(self.aggregate({'pk__in': []}, datetime.timedelta(seconds=5), 'avg'), [])
+
+
+class SensorReadingRollupTest(TestCase):
+    """Compare the time windows that are combined from the SensorReadingRollup instances with the windows of the sensorreadings."""
+
+    fixtures = [TEST_DATASET]
+    rollup_key = ('resolution', 'bucket_start', 'sensor', 'processparameter', 'qualitycharacteristics')
+
+    def setUp(self):
+        self.processstep_ids = list(SensorReading.objects.order_by().values_list('processstep', flat=True).distinct())
+        SensorReadingRollup.objects.rebuild(self.processstep_ids)
+        SensorReadingDateRange.objects.rebuild(SensorReadingDateRange.objects.series_of_processsteps(self.processstep_ids), rolled_up=True)
+        self.processparameter = ProcessParameter.objects.order_by('pk').first()
+
+    def aggregate(self, filter_kwargs, delta, aggregationFcn, use_rollups):
+        return time_window_aggregation(filter_kwargs, delta, aggregationFcn, use_rollups)
+
+    def test_windows_match_sensorreadings(self):
+        first_date = SensorReading.objects.filter(processparameter=self.processparameter).order_by('date').first().date
+        midnight = first_date.replace(hour=0, minute=0, second=0, microsecond=0)
+        bounds = ({}, {'date__gte': midnight + datetime.timedelta(hours=9), 'date__lte': midnight + datetime.timedelta(days=20, microseconds=-1)},
+                  {'date__gte': (midnight + datetime.timedelta(hours=9)).isoformat()}, {'date__lte': first_date + datetime.timedelta(days=3, seconds=1)})
+        for delta in (datetime.timedelta(minutes=1), datetime.timedelta(hours=2), datetime.timedelta(days=1)):
+            for filter_kwargs in bounds:
+                filter_kwargs = dict(filter_kwargs, processparameter_id=self.processparameter.pk)
+                self.assertIsNotNone(SensorReadingRollup.objects.resolution_for(delta, filter_kwargs))
+                for aggregationFcn in ('avg', 'min', 'max', 'std'):
+                    with self.subTest(delta=delta, filter_kwargs=filter_kwargs, aggregationFcn=aggregationFcn):
+                        windows = self.aggregate(filter_kwargs, delta, aggregationFcn, use_rollups=True)
+                        expected = self.aggregate(filter_kwargs, delta, aggregationFcn, use_rollups=False)
+                        self.assertEqual([window['date'] for window in windows], [window['date'] for window in expected])
+                        # The std of windows with constant values is zero up to the rounding errors of the merged rollups.
+                        np.testing.assert_allclose([window['value'] for window in windows], [window['value'] for window in expected], rtol=1e-6, atol=1e-6)
+
+    def test_resolution_for(self):
+        filter_kwargs = {'processparameter_id': self.processparameter.pk}
+        # Whether the series is rolled up is read from its date range without counting the sensorreadings.
+        with self.assertNumQueries(1):
+            self.assertEqual(SensorReadingRollup.objects.resolution_for(datetime.timedelta(days=7), filter_kwargs), 86400)
+        self.assertEqual(SensorReadingRollup.objects.resolution_for(datetime.timedelta(minutes=90), filter_kwargs), 60)
+        self.assertEqual(SensorReadingRollup.objects.resolution_for(datetime.timedelta(hours=2), dict(filter_kwargs, date__gte='2018-07-16T08:00:30Z')), 1)
+        self.assertIsNone(SensorReadingRollup.objects.resolution_for(datetime.timedelta(milliseconds=1500), filter_kwargs))
+        # Filters that the rollups do not support aggregate the sensorreadings.
+        self.assertIsNone(SensorReadingRollup.objects.resolution_for(datetime.timedelta(days=1), dict(filter_kwargs, value__gte=0)))
+
+    def test_readings_without_rollups_use_sensorreadings(self):
+        # Sensorreadings that were written before the rollups existed, their series are not rolled up.
+        SensorReadingRollup.objects.filter(processstep__in=self.processstep_ids[::2]).delete()
+        SensorReadingDateRange.objects.filter(processparameter=self.processparameter).update(rolled_up=False)
+        filter_kwargs = {'processparameter_id': self.processparameter.pk}
+        self.assertIsNone(SensorReadingRollup.objects.resolution_for(datetime.timedelta(days=1), filter_kwargs))
+        for delta in (datetime.timedelta(minutes=1), datetime.timedelta(days=1)):
+            with self.subTest(delta=delta):
+                windows = self.aggregate(filter_kwargs, delta, 'avg', use_rollups=True)
+                expected = self.aggregate(filter_kwargs, delta, 'avg', use_rollups=False)
+                self.assertEqual(windows, expected)
+
+        RollupSensorReadings().run(database_name='default', lookback_hours=0)
+        self.assertEqual(SensorReadingRollup.objects.resolution_for(datetime.timedelta(days=1), filter_kwargs), 86400)
+        self.assertEqual(self.aggregate(filter_kwargs, datetime.timedelta(days=1), 'min', use_rollups=True), self.aggregate(filter_kwargs, datetime.timedelta(days=1), 'min', use_rollups=False))
+
+    def test_add_readings_matches_rebuild(self):
+        sensorreading = SensorReading.objects.filter(processparameter=self.processparameter).order_by('pk').first()
+        readings = [SensorReading(value=sensorreading.value + i, date=sensorreading.date + datetime.timedelta(seconds=i * 30), processstep_id=sensorreading.processstep_id,
+                                  processparameter_id=sensorreading.processparameter_id, sensor_id=sensorreading.sensor_id) for i in range(5)]
+        SensorReading.objects.bulk_create(readings)
+        SensorReadingRollup.objects.add_readings(readings)
+        added = list(SensorReadingRollup.objects.filter(processstep=sensorreading.processstep_id).order_by(*self.rollup_key).values_list(*self.rollup_key, 'count', 'mean', 'm2', 'min', 'max'))
+
+        SensorReadingRollup.objects.rebuild([sensorreading.processstep_id])
+        rebuilt = list(SensorReadingRollup.objects.filter(processstep=sensorreading.processstep_id).order_by(*self.rollup_key).values_list(*self.rollup_key, 'count', 'mean', 'm2', 'min', 'max'))
+
+        self.assertEqual(len(added), len(rebuilt))
+        for added_rollup, rebuilt_rollup in zip(added, rebuilt):
+            self.assertEqual(added_rollup[:6], rebuilt_rollup[:6])
+            np.testing.assert_allclose(added_rollup[6:], rebuilt_rollup[6:], atol=1e-9)
+
+    def test_std_of_large_values(self):
+        # Values with a large mean and small deviations cancel out in a sum of squares.
+        sensorreading = SensorReading.objects.filter(processparameter=self.processparameter).exclude(processstep=None).order_by('pk').first()
+        midnight = sensorreading.date.replace(hour=0, minute=0, second=0, microsecond=0)
+        values = 1e8 + np.random.default_rng(0).normal(0, 0.5, 7200)
+        readings = [SensorReading(value=value, date=midnight + datetime.timedelta(seconds=i), processstep_id=sensorreading.processstep_id,
+                                  processparameter_id=sensorreading.processparameter_id) for i, value in enumerate(values)]
+        SensorReading.objects.bulk_create(readings[:3600])
+        SensorReadingRollup.objects.rebuild([sensorreading.processstep_id])
+        SensorReading.objects.bulk_create(readings[3600:])
+        SensorReadingRollup.objects.add_readings(readings[3600:])
+
+        filter_kwargs = {'processparameter_id': self.processparameter.pk, 'date__gte': midnight, 'date__lte': midnight + datetime.timedelta(hours=2, microseconds=-1)}
+        expected = [values[:3600].std(ddof=1), values[3600:].std(ddof=1)]
+        for use_rollups in (True, False):
+            with self.subTest(use_rollups=use_rollups):
+                windows = self.aggregate(filter_kwargs, datetime.timedelta(hours=1), 'std', use_rollups)
+                np.testing.assert_allclose([window['value'] for window in windows], expected, rtol=1e-6)
+
+    def readings_without_processstep(self):
+        sensorreadings = SensorReading.objects.filter(processparameter=self.processparameter).order_by('pk')[:50]
+        return [SensorReading(value=sensorreading.value * 2, date=sensorreading.date + datetime.timedelta(seconds=7), processparameter_id=sensorreading.processparameter_id,
+                              sensor_id=sensorreading.sensor_id) for sensorreading in sensorreadings]
+
+    def test_add_readings_without_processstep_matches_rebuild(self):
+        readings = self.readings_without_processstep()
+        SensorReading.objects.bulk_create(readings)
+        SensorReadingRollup.objects.add_readings(readings)
+        added = list(SensorReadingRollup.objects.filter(processstep=None).order_by(*self.rollup_key).values_list(*self.rollup_key, 'count', 'min', 'max'))
+
+        SensorReadingRollup.objects.rebuild_without_processstep(SensorReadingDateRange.objects.series_of(readings))
+        self.assertTrue(added)
+        self.assertEqual(added, list(SensorReadingRollup.objects.filter(processstep=None).order_by(*self.rollup_key).values_list(*self.rollup_key, 'count', 'min', 'max')))
+
+    def test_catch_up_readings_without_processstep(self):
+        # Sensorreadings that were imported without rollups.
+        readings = self.readings_without_processstep()
+        SensorReading.objects.bulk_create(readings)
+        SensorReadingDateRange.objects.add_readings(readings, rolled_up=False)
+        filter_kwargs = {'processparameter_id': self.processparameter.pk}
+        self.assertIsNone(SensorReadingRollup.objects.resolution_for(datetime.timedelta(days=1), filter_kwargs))
+        RollupSensorReadings().run(database_name='default', lookback_hours=0)
+        self.assertEqual(SensorReadingRollup.objects.resolution_for(datetime.timedelta(days=1), filter_kwargs), 86400)
+
+        for delta in (datetime.timedelta(minutes=1), datetime.timedelta(days=1)):
+            with self.subTest(delta=delta):
+                windows = self.aggregate(filter_kwargs, delta, 'avg', use_rollups=True)
+                expected = self.aggregate(filter_kwargs, delta, 'avg', use_rollups=False)
+                self.assertEqual([window['date'] for window in windows], [window['date'] for window in expected])
+                np.testing.assert_allclose([window['value'] for window in windows], [window['value'] for window in expected], rtol=1e-6)
+
+
+class SensorReadingDateRangeTest(TestCase):
+    """Compare the SensorReadingDateRange instances and the daterange actions with the dates of the sensorreadings."""
+
+    fixtures = [TEST_DATASET]
+
+    def setUp(self):
+        self.processstep_ids = list(ProcessStep.objects.order_by('pk').values_list('pk', flat=True))
+        SensorReadingDateRange.objects.rebuild(SensorReadingDateRange.objects.series_of_processsteps(self.processstep_ids))
+
+    def expected(self, **filter_kwargs):
+        dates = SensorReading.objects.filter(date__isnull=False, **filter_kwargs).aggregate(first_date=Min('date'), last_date=Max('date'))
+        return dates['first_date'], dates['last_date']
+
+    def assert_date_ranges_match(self):
+        for series_field in SensorReadingDateRange.objects.series_fields:
+            series_ids = SensorReading.objects.filter(**{series_field + '__isnull': False}).order_by().values_list(series_field, flat=True).distinct()
+            self.assertTrue(series_ids)
+            for series_id in series_ids:
+                with self.subTest(series_field=series_field, series_id=series_id):
+                    self.assertEqual(SensorReadingDateRange.objects.date_range({series_field + '_id': series_id}), self.expected(**{series_field: series_id}))
+
+    def test_rebuild_matches_sensorreadings(self):
+        self.assert_date_ranges_match()
+        self.assertEqual(SensorReadingDateRange.objects.date_range({}), self.expected())
+        self.assertEqual(SensorReadingDateRange.objects.date_range({'processparameter_id__in': []}), (None, None))
+
+    def test_add_readings_extends_date_ranges(self):
+        sensorreading = SensorReading.objects.filter(date__isnull=False, processparameter__isnull=False).order_by('pk').first()
+        readings = [SensorReading(value=i, date=sensorreading.date + datetime.timedelta(days=i * 400), processstep_id=sensorreading.processstep_id,
+                                  processparameter_id=sensorreading.processparameter_id, sensor_id=sensorreading.sensor_id) for i in (-1, 0, 1)]
+        SensorReading.objects.bulk_create(readings)
+        SensorReadingDateRange.objects.add_readings(readings)
+        self.assert_date_ranges_match()
+
+    def test_daterange_actions(self):
+        factory = APIRequestFactory()
+        user = get_user_model()(username='admin', is_staff=True)
+        product_ids = list(Product.objects.order_by('pk').values_list('pk', flat=True)[:3])
+        processparameter_ids = list(ProcessParameter.objects.order_by('pk').values_list('pk', flat=True)[:2])
+        view = SensorReadingViewSet.as_view({'get': 'daterange'})
+        for params, filter_kwargs in (({'product_ids': str(product_ids)}, {'processstep__product__in': product_ids}),
+                                      ({'processparameter_ids': str(processparameter_ids)}, {'processparameter__in': processparameter_ids}),
+                                      ({'product_ids': str(product_ids), 'processparameter_ids': str(processparameter_ids)}, {'processstep__product__in': product_ids, 'processparameter__in': processparameter_ids})):
+            with self.subTest(params=params):
+                request = factory.get('/sensorreading/daterange/', params)
+                force_authenticate(request, user=user)
+                response = view(request)
+                self.assertEqual((response.data['firstDate'], response.data['lastDate']), self.expected(**filter_kwargs))
+
+        request = factory.post('/processparameter/daterange/', {'processparameter_ids': processparameter_ids}, format='json')
+        force_authenticate(request, user=user)
+        response = ProcessParameterViewSet.as_view({'post': 'daterange_from_list'})(request)
+        self.assertEqual((response.data['firstDate'], response.data['lastDate']), self.expected(processparameter__in=processparameter_ids))
+
+    def test_catch_up_missing_date_ranges(self):
+        SensorReadingDateRange.objects.all().delete()
+        RollupSensorReadings().run(database_name='default', lookback_hours=0)
+        self.assert_date_ranges_match()
+
+
+def reference_lttb(x, y, n_out):
+    """Reference implementation of largest-triangle-three-buckets with plain Python loops."""
+    n = len(x)
+    every = (n - 2) / (n_out - 2)
+    selected = [0]
+    a = 0
+    for i in range(n_out - 2):
+        start, end = int(i * every) + 1, int((i + 1) * every) + 1
+        next_start, next_end = end, min(int((i + 2) * every) + 1, n)
+        if i == n_out - 3:
+            next_start, next_end = n - 1, n
+        avg_x = sum(x[next_start:next_end]) / (next_end - next_start)
+        avg_y = sum(y[next_start:next_end]) / (next_end - next_start)
+        areas = [abs((x[a] - avg_x) * (y[j] - y[a]) - (x[a] - x[j]) * (avg_y - y[a])) for j in range(start, end)]
+        a = start + areas.index(max(areas))
+        selected.append(a)
+    selected.append(n - 1)
+    return selected
+
+
+class DownsamplingTest(TestCase):
+    """Downsampling of sensorreadings and aggregated time windows for the max_points parameter."""
+
+    fixtures = [TEST_DATASET]
+
+    def setUp(self):
+        rng = np.random.default_rng(0)
+        self.x = np.cumsum(rng.integers(1, 1000, 10001))
+        self.y = np.cumsum(rng.normal(size=10001))
+
+    def test_lttb_matches_reference(self):
+        for n_out in (3, 10, 1000):
+            with self.subTest(n_out=n_out):
+                self.assertEqual(lttb(self.x, self.y, n_out).tolist(), reference_lttb((self.x - self.x[0]).astype(float).tolist(), self.y.tolist(), n_out))
+
+    def test_min_max_envelope(self):
+        index = min_max(self.x, self.y, 100)
+        self.assertLessEqual(len(index), 100)
+        self.assertTrue(np.all(np.diff(index) > 0))
+        self.assertIn(np.argmin(self.y), index)
+        self.assertIn(np.argmax(self.y), index)
+        self.assertEqual((index[0], index[-1]), (0, len(self.y) - 1))
+
+    def test_short_series_and_nan(self):
+        self.assertEqual(downsample(self.x[:5], self.y[:5], 10).tolist(), [0, 1, 2, 3, 4])
+        y = self.y[:5].copy()
+        y[2] = np.nan
+        self.assertEqual(downsample(self.x[:5], y, 10, 'minmax').tolist(), [0, 1, 3, 4])
+
+    def test_downsampled_readings(self):
+        processparameter = ProcessParameter.objects.order_by('pk').first()
+        queryset = SensorReading.objects.filter(processparameter=processparameter)
+        times, values = read_points(queryset)
+        expected = list(queryset.filter(value__isnull=False, date__isnull=False).order_by('date').values_list('date', 'value'))
+        self.assertEqual(len(times), len(expected))
+        self.assertEqual([datetime.datetime.fromtimestamp(time / 1e6, datetime.timezone.utc) for time in times[:10]], [date for date, _ in expected[:10]])
+        np.testing.assert_array_equal(values, [value for _, value in expected])
+
+        readings = downsampled_readings(queryset, 50)
+        self.assertEqual(len(readings), 50)
+        self.assertEqual((readings[0]['date'], readings[-1]['date']), (expected[0][0], expected[-1][0]))
+
+    def test_downsampled_time_window_values(self):
+        processparameter = ProcessParameter.objects.order_by('pk').first()
+        delta = datetime.timedelta(minutes=1)
+        processstep_ids = list(SensorReading.objects.order_by().values_list('processstep', flat=True).distinct())
+        SensorReadingRollup.objects.rebuild(processstep_ids)
+        SensorReadingDateRange.objects.rebuild(SensorReadingDateRange.objects.series_of_processsteps(processstep_ids), rolled_up=True)
+        aggregation = TimeSeriesAggregation({'processparameter_id': processparameter.pk}, delta, ['max'])
+        window_queryset, origin = aggregation.windows()
+        windows = aggregation.window_payload(window_queryset, origin)
+        downsampled = aggregation.window_payload(window_queryset, origin, 20, 'minmax')
+        self.assertLessEqual(len(downsampled), 20)
+        self.assertTrue(all(window in windows for window in downsampled))
+        self.assertIn(max(window['value'] for window in windows), [window['value'] for window in downsampled])
+
+
+class TimeSeriesAggregationTest(TestCase):
+    """Parameters, several aggregation functions and response data of the shared time series aggregation."""
+
+    fixtures = [TEST_DATASET]
+
+    def setUp(self):
+        self.processparameter = ProcessParameter.objects.order_by('pk').first()
+        self.filter_kwargs = {'processparameter_id': self.processparameter.pk}
+
+    def test_parse_parameters(self):
+        self.assertEqual(parse_aggregation_window('5s'), datetime.timedelta(seconds=5))
+        self.assertEqual(parse_aggregation_window('250ms'), datetime.timedelta(milliseconds=250))
+        self.assertEqual(parse_aggregation_window('2m'), datetime.timedelta(minutes=2))
+        self.assertIsNone(parse_aggregation_window(None))
+        for aggregationWindow in ('5h', 's', '0s', 'x5s'):
+            with self.subTest(aggregationWindow=aggregationWindow):
+                with self.assertRaises(ValueError):
+                    parse_aggregation_window(aggregationWindow)
+        self.assertEqual(parse_aggregation_functions('min, max,avg,min'), ['min', 'max', 'avg'])
+        self.assertEqual(parse_aggregation_functions(None), [])
+        with self.assertRaises(ValueError):
+            parse_aggregation_functions('min,median')
+
+    def test_several_functions_match_single_functions(self):
+        delta = datetime.timedelta(hours=1)
+        aggregation = TimeSeriesAggregation(self.filter_kwargs, delta, ['min', 'max', 'avg', 'std'])
+        aggregation.use_rollups = False
+        windows = aggregation.window_payload(*aggregation.windows())
+        for aggregationFcn in ('min', 'max', 'avg', 'std'):
+            with self.subTest(aggregationFcn=aggregationFcn):
+                expected = {window['date']: window['value'] for window in time_window_aggregation(self.filter_kwargs, delta, aggregationFcn, use_rollups=False)}
+                # Windows with a single value have no standard deviation.
+                values = {window['date']: window['value'][aggregationFcn] for window in windows if window['value'][aggregationFcn] is not None}
+                self.assertEqual(values.keys(), expected.keys())
+                np.testing.assert_allclose([values[date] for date in expected], list(expected.values()), rtol=1e-9)
+
+    def test_total(self):
+        values = pd.Series(SensorReading.objects.filter(**self.filter_kwargs).values_list('value', flat=True), dtype=float)
+        total = TimeSeriesAggregation(self.filter_kwargs, functions=['avg', 'min', 'max', 'std']).total()
+        np.testing.assert_allclose([total['avg'], total['min'], total['max'], total['std']], [values.mean(), values.min(), values.max(), values.std()], rtol=1e-6)
+        self.assertIsNone(TimeSeriesAggregation({'pk__in': []}, functions=['avg']).total())
+
+    def test_series_payload(self):
+        index = pd.DatetimeIndex(['2021-09-08 05:02:00', '2021-09-08 05:02:00.500000', '2021-09-08 05:02:01.000250'], tz='UTC')
+        self.assertEqual(timestamp_strings(index), [str(timestamp) for timestamp in index])
+        df = pd.DataFrame({'min': [1.0, np.nan, 3.0], 'max': [2.0, 4.0, 5.0]}, index=index)
+        self.assertEqual(TimeSeriesAggregation.series_payload(df), [{str(index[0]): {'min': 1.0, 'max': 2.0}}, {str(index[1]): {'min': None, 'max': 4.0}},
+                                                                    {str(index[2]): {'min': 3.0, 'max': 5.0}}])
+        self.assertEqual(TimeSeriesAggregation.series_payload(df[['max']]), [{str(timestamp): value} for timestamp, value in zip(index, [2.0, 4.0, 5.0])])
+
+    def test_series_interpolates_windows(self):
+        sensorreading = SensorReading.objects.filter(processparameter=self.processparameter, processstep__isnull=False).order_by('pk').first()
+        filter_kwargs = {'processparameter_id': self.processparameter.pk, 'processstep_id__in': [sensorreading.processstep_id]}
+        SensorReading.objects.bulk_create([SensorReading(value=value, date=sensorreading.date + datetime.timedelta(seconds=seconds), processparameter=self.processparameter,
+                                                         processstep_id=sensorreading.processstep_id) for seconds, value in ((1, 10.0), (7, 40.0))])
+        aggregation = TimeSeriesAggregation(filter_kwargs, datetime.timedelta(seconds=2), ['max', 'min'])
+        aggregation.use_rollups = False
+        df = aggregation.series(SensorReading.objects.filter(**filter_kwargs).order_by('date'))
+        self.assertEqual(list(df.columns), ['max', 'min'])
+        self.assertTrue(np.all(np.diff(df.index.asi8) == 2 * 10 ** 9))
+        self.assertFalse(df.isna().any().any())
+        self.assertEqual(df['max'].iloc[-1], 40.0)
+
+
+class KeysetPaginationTest(TestCase):
+    """Walk the pages of the keyset pagination forwards and backwards."""
+
+    fixtures = [TEST_DATASET]
+
+    def paginate(self, paginator, queryset, **params):
+        rows = paginator.paginate_queryset(queryset, Request(APIRequestFactory().get('/sensorreading/', dict(params, pagination='cursor', page_size=7))))
+        return rows, paginator.get_next_link(), paginator.get_previous_link()
+
+    def walk(self, paginator_class, queryset, key):
+        """Pages from the first to the last page and back."""
+        forward, backward = [], []
+        rows, next_link, previous_link = self.paginate(paginator_class(), queryset)
+        self.assertIsNone(previous_link)
+        forward.extend(key(row) for row in rows)
+        while next_link is not None:
+            self.assertNotIn('pagination=', next_link)
+            rows, next_link, previous_link = self.paginate(paginator_class(), queryset, cursor=parse_qs(urlparse(next_link).query)['cursor'][0])
+            forward.extend(key(row) for row in rows)
+        backward = [key(row) for row in rows]
+        while previous_link is not None:
+            rows, next_link, previous_link = self.paginate(paginator_class(), queryset, cursor=parse_qs(urlparse(previous_link).query)['cursor'][0])
+            self.assertIsNotNone(next_link)
+            backward = [key(row) for row in rows] + backward
+        return forward, backward
+
+    def test_sensorreadings_keyed_on_date_and_id(self):
+        sensorreading = SensorReading.objects.filter(date__isnull=False).order_by('pk').first()
+        # Several sensorreadings with the same date are ordered by id.
+        SensorReading.objects.bulk_create([SensorReading(value=i, date=sensorreading.date, processparameter=sensorreading.processparameter) for i in range(10)])
+        queryset = SensorReading.objects.filter(processparameter=sensorreading.processparameter).order_by('date')
+        expected = list(queryset.filter(date__isnull=False).order_by('date', 'pk').values_list('date', 'pk'))
+        forward, backward = self.walk(KeysetPagination, queryset, lambda row: (row.date, row.pk))
+        self.assertEqual(forward, expected)
+        self.assertEqual(backward, expected)
+
+    def test_time_windows(self):
+        aggregation = TimeSeriesAggregation({'processparameter_id': ProcessParameter.objects.order_by('pk').first().pk}, datetime.timedelta(minutes=10), ['avg'])
+        aggregation.use_rollups = False
+        window_queryset, _ = aggregation.windows()
+        expected = [window['window'] for window in window_queryset]
+        forward, backward = self.walk(KeysetPagination, window_queryset, lambda row: row['window'])
+        self.assertEqual(forward, expected)
+        self.assertEqual(backward, expected)
+
+    def test_list(self):
+        data = [{str(i): i} for i in range(30)]
+        forward, backward = self.walk(LinkHeaderKeysetPagination, data, lambda row: row)
+        self.assertEqual(forward, data)
+        self.assertEqual(backward, data)
+
+    def test_invalid_cursor(self):
+        for cursor in ('abc', 'eyJrIjogWzFdfQ=='):
+            with self.subTest(cursor=cursor):
+                with self.assertRaises(NotFound):
+                    self.paginate(KeysetPagination(), SensorReading.objects.order_by('date'), cursor=cursor)
+
+    def test_viewset_opt_in(self):
+        factory = APIRequestFactory()
+        view = SensorReadingViewSet(request=Request(factory.get('/sensorreading/', {'pagination': 'cursor'})), format_kwarg=None)
+        self.assertIsInstance(view.paginator, KeysetPagination)
+        view = SensorReadingViewSet(request=Request(factory.get('/sensorreading/')), format_kwarg=None)
+        self.assertNotIsInstance(view.paginator, KeysetPagination)
+
+
+class ArrowRendererTest(TestCase):
+    """Compare the columnar Apache Arrow responses of the time series endpoints with the JSON responses."""
+
+    fixtures = [TEST_DATASET]
+
+    def setUp(self):
+        self.processparameter = ProcessParameter.objects.order_by('pk').first()
+        self.user = get_user_model()(username='admin', is_staff=True)
+        # The minute windows are combined from the rollups.
+        processstep_ids = list(SensorReading.objects.filter(processparameter=self.processparameter).order_by().values_list('processstep', flat=True).distinct())
+        SensorReadingRollup.objects.rebuild(processstep_ids)
+        SensorReadingDateRange.objects.rebuild({'processparameter': [self.processparameter.pk]}, rolled_up=True)
+
+    def get(self, view, params, arrow, **kwargs):
+        request = APIRequestFactory().get('/', dict(params, format='arrow') if arrow else params)
+        force_authenticate(request, user=self.user)
+        response = view(request, **kwargs)
+        response.render()
+        return response
+
+    def compare(self, view, params, **kwargs):
+        """JSON response data and the table of the Arrow response."""
+        json_response, arrow_response = self.get(view, params, False, **kwargs), self.get(view, params, True, **kwargs)
+        self.assertEqual(arrow_response['Content-Type'], ArrowRenderer.media_type)
+        return json.loads(json_response.content), pa.ipc.open_stream(arrow_response.content).read_all()
+
+    def test_time_windows(self):
+        view = SensorReadingViewSet.as_view({'get': 'aggregation'})
+        for params in ({'aggregationFcn': 'avg'}, {'aggregationFcn': 'min,std'}, {'aggregationFcn': 'avg', 'max_points': 20}):
+            with self.subTest(params=params):
+                data, table = self.compare(view, dict(params, processparameter_id=self.processparameter.pk, aggregationWindow='1m'))
+                rows = data['results'] if 'results' in data else data
+                self.assertEqual(table.schema.field('date').type, pa.timestamp('us', tz='UTC'))
+                self.assertEqual([date.strftime('%Y-%m-%dT%H:%M:%SZ') for date in table.column('date').to_pylist()], [row['date'] for row in rows])
+                if isinstance(rows[0]['value'], dict):
+                    for function in rows[0]['value']:
+                        self.assertEqual(table.column('value.' + function).to_pylist(), [row['value'][function] for row in rows])
+                else:
+                    self.assertEqual(table.column('value').to_pylist(), [row['value'] for row in rows])
+                if 'results' in data:
+                    self.assertEqual(json.loads(table.schema.metadata[b'count']), data['count'])
+
+    def test_perproduct_series(self):
+        product_id = SensorReading.objects.filter(processparameter=self.processparameter).values_list('processstep__product', flat=True).first()
+        view = ProcessParameterViewSet.as_view({'get': 'perproduct'})
+        data, table = self.compare(view, {'aggregationWindow': '1s', 'aggregationFcn': 'avg,max'}, pk=self.processparameter.pk, product_id=product_id)
+        self.assertEqual([str(pd.Timestamp(date)) for date in table.column('date').to_pylist()], [next(iter(row)) for row in data])
+        self.assertEqual(list(zip(table.column('value.avg').to_pylist(), table.column('value.max').to_pylist())),
+                         [(value['avg'], value['max']) for row in data for value in row.values()])
+
+    def test_sensorreadings(self):
+        request = APIRequestFactory().get('/', {'format': 'arrow', 'pagination': 'cursor'})
+        force_authenticate(request, user=self.user)
+        response = SensorReadingViewSet.as_view({'get': 'list'})(request)
+        response.render()
+        table = pa.ipc.open_stream(response.content).read_all()
+        expected = SensorReading.objects.order_by('-id')[:100]
+        self.assertEqual(table.column('id').to_pylist(), [reading.pk for reading in expected])
+        self.assertEqual(table.column('date').to_pylist(), [reading.date for reading in expected])
+        self.assertEqual(table.column('value').to_pylist(), [reading.value for reading in expected])
+        self.assertIn(b'next', table.schema.metadata)
+
+    def test_rows(self):
+        self.assertEqual(ArrowRenderer.rows_table('Invalid').to_pylist(), [{'detail': 'Invalid'}])
+        self.assertEqual(ArrowRenderer.rows_table(0.5).to_pylist(), [{'value': 0.5}])
+        self.assertEqual(ArrowRenderer.rows_table([{'a': 1, 'b': {'c': 2.0}}, {'a': 2, 'd': ['x']}]).to_pylist(),
+                         [{'a': 1, 'b.c': 2.0, 'd': None}, {'a': 2, 'b.c': None, 'd': ['x']}])
+
+
+class ReturnQcByProductTest(TestCase):
+    """Measured and predicted values of the QualityCharacteristics per product."""
+
+    fixtures = [TEST_DATASET]
+
+    def setUp(self):
+        self.products = list(Product.objects.filter(processstep__isnull=False).distinct().order_by('pk')[:3])
+        self.qc = QualityCharacteristics.objects.create()
+        self.real = Sensor.objects.create(virtual=False)
+        self.virtual = [Sensor.objects.create(virtual=True) for _ in range(2)]
+
+    def add(self, product, value, sensor):
+        processstep = ProcessStep.objects.filter(product=product).order_by('pk').first()
+        SensorReading.objects.create(value=value, processstep=processstep, qualitycharacteristics=self.qc, sensor=sensor)
+
+    def results(self, product_ids):
+        request = APIRequestFactory().get('/sensorreading/return_qc_by_product/', {'product_list': str(product_ids)})
+        force_authenticate(request, user=get_user_model()(username='admin', is_staff=True))
+        response = SensorReadingViewSet.as_view({'get': 'return_qc_by_product'})(request)
+        self.assertEqual(response.status_code, 200)
+        return [result for result in response.data['results'] if result['QualityCharacteristic'] == self.qc.pk]
+
+    def test_matrix(self):
+        first, second, third = self.products
+        self.add(first, 1.0, self.real)
+        self.add(first, 2.0, self.real)
+        self.add(third, None, self.real)
+        self.add(second, 3.0, self.virtual[1])
+        self.add(first, 4.0, self.virtual[0])
+        self.add(third, 5.0, self.virtual[0])
+        # The columns follow the product list, the newest sensorreading of a product is used, the virtual sensors are ordered by their newest sensorreading.
+        self.assertEqual(self.results([third.pk, first.pk, second.pk, first.pk]), [{'QualityCharacteristic': self.qc.pk,
+                                                                                    'measured_values': ['null', 2.0, 'null', 2.0],
+                                                                                    'predicted_values': [[5.0, 4.0, 'null', 4.0], ['null', 'null', 3.0, 'null']]}])
+
+    def test_missing_sensor_types(self):
+        first, second, _ = self.products
+        self.add(first, 1.0, self.real)
+        self.assertEqual(self.results([first.pk, second.pk]), [{'QualityCharacteristic': self.qc.pk, 'measured_values': [1.0, 'null'], 'predicted_values': []}])
+        SensorReading.objects.filter(qualitycharacteristics=self.qc).update(sensor=self.virtual[0])
+        self.assertEqual(self.results([first.pk, second.pk]), [{'QualityCharacteristic': self.qc.pk, 'measured_values': ['null', 'null'], 'predicted_values': [[1.0, 'null']]}])
+        self.assertEqual(self.results([0]), [])
+
+
+def query_plan_problems(queryset, table="orakel_sensorreading", allow_sort=False):
+    """Full scans of the table and sorts of the result that are not served by an index in the query plan of the queryset.
+
+    Args:
+        queryset (QuerySet): Query to explain.
+        table (str, optional): Table that has to be searched with an index. Defaults to "orakel_sensorreading".
+        allow_sort (bool, optional): Allow sorts, e.g. of grouped rows. Defaults to False.
+
+    Returns:
+        [list[str]]: Problems of the query plan, empty if the plan is fine.
+    """
+    problems = []
+    if connection.vendor == 'sqlite':
+        for line in queryset.explain().splitlines():
+            if re.search(r"\bSCAN (TABLE )?{}\b".format(table), line):
+                problems.append("full scan: " + line.strip())
+            if "TEMP B-TREE FOR" in line and "ORDER BY" in line and not allow_sort:
+                problems.append("sort: " + line.strip())
+        return problems
+
+    def nodes(plan):
+        if isinstance(plan, dict):
+            yield plan
+            plan = list(plan.values())
+        if isinstance(plan, list):
+            for value in plan:
+                yield from nodes(value)
+
+    if connection.vendor == 'mysql':
+        for node in nodes(json.loads(queryset.explain(format='json'))):
+            if node.get('table_name') == table and node.get('access_type') == 'ALL':
+                problems.append("full scan: " + table)
+            if node.get('using_filesort') and not allow_sort:
+                problems.append("sort: filesort")
+    elif connection.vendor == 'postgresql':
+        for node in nodes(json.loads(queryset.explain(format='json'))):
+            if node.get('Node Type') == 'Seq Scan' and node.get('Relation Name') == table:
+                problems.append("full scan: " + table)
+            if node.get('Node Type') in ('Sort', 'Incremental Sort') and not allow_sort:
+                problems.append("sort: " + node['Node Type'])
+    return problems
+
+
+class QueryPlanTest(TestCase):
+    """EXPLAIN the main sensorreading queries of the views and tasks, they have to search an index instead of scanning the table
+    and must not sort the sensorreadings by date outside of an index."""
+
+    def setUp(self):
+        if connection.vendor not in ('sqlite', 'mysql', 'postgresql'):
+            self.skipTest("The query plans of {} are not checked.".format(connection.vendor))
+
+    def assert_indexed(self, queryset, **kwargs):
+        self.assertEqual(query_plan_problems(queryset, **kwargs), [], queryset.explain())
+
+    def test_time_series(self):
+        # SensorReadingViewSet.aggregation, daterange and the perproduct actions with page number and keyset pagination.
+        date = datetime.datetime(2021, 1, 1, tzinfo=datetime.timezone.utc)
+        for field in ('processparameter_id', 'qualitycharacteristics_id', 'sensor_id'):
+            queryset = SensorReading.objects.filter(**{field: 1}).order_by('date')
+            with self.subTest(field=field):
+                self.assert_indexed(queryset)
+                self.assert_indexed(queryset.filter(date__gte=date, date__lte=date + datetime.timedelta(days=1)))
+                self.assert_indexed(queryset.reverse()[:1])
+                self.assert_indexed(queryset.filter(date__isnull=False, date__gte=date).filter(KeysetPagination.keyset_filter(['date', 'pk'], [date, 1], False)).order_by('date', 'pk')[:101])
+                self.assert_indexed(queryset.filter(date__isnull=False).filter(KeysetPagination.keyset_filter(['date', 'pk'], [date, 1], True)).order_by('-date', '-pk')[:101])
+
+    def test_perproduct(self):
+        for field in ('processparameter', 'qualitycharacteristics'):
+            with self.subTest(field=field):
+                self.assert_indexed(SensorReading.objects.filter(**{field: 1, 'processstep_id__in': [1]}).order_by('date'))
+
+    def test_time_windows(self):
+        # The windows are grouped, only the sorted groups are allowed.
+        aggregation = TimeSeriesAggregation({'processparameter_id': 1}, datetime.timedelta(seconds=5), ['avg'])
+        queryset = SensorReading.objects.filter(date__isnull=False, processparameter_id=1).order_by()
+        self.assert_indexed(queryset.order_by('date').values('date')[:1])
+        self.assert_indexed(queryset.annotate(window=TimeBucket('date', datetime.datetime(2021, 1, 1, tzinfo=datetime.timezone.utc), aggregation.delta)).values('window').annotate(max=Max('value')).order_by('window'), allow_sort=True)
+
+    def test_dataframe_queries(self):
+        # CreateDataframe.query_stacked_values and query_feature_values, the rows are sorted by the product id of the processstep.
+        queryset = SensorReading.objects.filter(processparameter__in=[1, 2], processstep__product__in=[1, 2],
+                                                processstep__processstepspecification=F('processparameter__processstepspecification'))
+        self.assert_indexed(queryset.order_by('processstep__product_id', 'processparameter_id', 'date').values_list('processstep__product_id', 'date', 'processparameter_id', 'value'), allow_sort=True)
+        self.assert_indexed(queryset.order_by().values('processstep__product', 'processparameter').annotate(value__max=Max('value')), allow_sort=True)
+        # The validation aggregates per processstep and processparameter only read the covering index.
+        self.assert_indexed(SensorReading.objects.filter(processstep=1, processparameter=1).values('value'))
+
+    def test_date_ranges(self):
+        # SensorReadingDateRange.objects.rebuild and the daterange filters that aggregate the sensorreadings.
+        for field in SensorReadingDateRange.objects.series_fields:
+            with self.subTest(field=field):
+                self.assert_indexed(SensorReading.objects.filter(**{field + '__in': [1, 2], 'date__isnull': False}).order_by().values(field).annotate(first_date=Min('date'), last_date=Max('date')), allow_sort=True)
+        processsteps = ProcessStep.objects.filter(product_id__in=[1, 2]).order_by().values('id')
+        self.assert_indexed(SensorReading.objects.filter(date__isnull=False, processstep_id__in=processsteps).order_by().values('date'))
+
+    def test_processstep_queries(self):
+        # Summaries, rollups, update_date and return_qc_by_product select the sensorreadings of processsteps.
+        self.assert_indexed(SensorReading.objects.filter(processstep_id__in=[1, 2]).order_by())
+        self.assert_indexed(SensorReading.objects.filter(processstep__product_id__in=[1, 2], qualitycharacteristics_id__isnull=False).order_by().values_list('id', 'processstep_id', 'value', 'sensor__virtual'))
+        for field in ('processparameter', 'qualitycharacteristics', 'sensor'):
+            with self.subTest(field=field):
+                self.assert_indexed(SensorReading.objects.filter(**{'processstep__in': [1, 2], field + '__isnull': False, 'value__isnull': False}).order_by().values('processstep', field).annotate(max=Max('value')), allow_sort=True)
@@ -4,14 +4,15 @@
 from orakel.views.utils import CustomModelViewSet
 from orakel.serializers.v1 import QualityCharacteristicsSerializer, SensorReadingSerializer
 from orakel import models
-import pandas as pd
+from orakel.views.utils.aggregation import TimeSeriesAggregation
+from orakel.views.utils.columnar import columnar_requested, points_table, reading_table, time_series_table
+from orakel.views.utils.downsampling import downsampled_points, downsampled_readings, downsampling_parameters
+from orakel.views.utils.pagination import list_paginator
 from rest_framework.decorators import action
 from rest_framework import status as rf_status
 from rest_framework.response import Response
-from rest_framework import pagination
 
 import datetime
-import re
 
 class QualityCharacteristicsViewSet(CustomModelViewSet):
     """Viewset for Model QualityCharacteristics.
@@ -25,6 +26,7 @@ class QualityCharacteristicsViewSet(CustomModelViewSet):
     """
     serializer_class = QualityCharacteristicsSerializer
     django_model = models.QualityCharacteristics
+    columnar_actions = ('perproduct',)
 
 
     @action(detail=True, methods=["get"], url_path="daterange")  # Detail=True to use action/method on an instance.
@@ -40,11 +42,7 @@ class QualityCharacteristicsViewSet(CustomModelViewSet):
                 - lastDate: Date of the sensorreading entry with the newest date regarding to the given QualityCharacteristic.id .
         """
 
-        last_object = models.SensorReading.objects.filter(qualitycharacteristics=pk).order_by('date').last()
-        first_object = models.SensorReading.objects.filter(qualitycharacteristics=pk).order_by('date').first()
-
-        first_date = first_object.date if first_object else None
-        last_date = last_object.date if last_object else None
+        first_date, last_date = models.SensorReadingDateRange.objects.date_range({'qualitycharacteristics_id': pk})
 
         return Response(status=rf_status.HTTP_200_OK, data={"firstDate": first_date, "lastDate": last_date})
 
@@ -65,11 +63,7 @@ class QualityCharacteristicsViewSet(CustomModelViewSet):
         """
         data = request.data
         qualitycharacteristics_ids = data.get("qualitycharacteristics_ids", None)
-        last_object = models.SensorReading.objects.filter(qualitycharacteristics__in=qualitycharacteristics_ids).order_by('date').last()
-        first_object = models.SensorReading.objects.filter(qualitycharacteristics__in=qualitycharacteristics_ids).order_by('date').first()
-
-        first_date = first_object.date if first_object else None
-        last_date = last_object.date if last_object else None
+        first_date, last_date = models.SensorReadingDateRange.objects.date_range({'qualitycharacteristics_id__in': qualitycharacteristics_ids or []})
 
         return Response(status=rf_status.HTTP_200_OK, data={"firstDate": first_date, "lastDate": last_date})
 
@@ -133,13 +127,21 @@ class QualityCharacteristicsViewSet(CustomModelViewSet):
         Args:
             pk (int): id/pk of the QualityCharacteristic instance. (Supplied with the url)
             product_id (int): Id of an Product instance. (Supplied with the url)
+            pagination (str): cursor to paginate with opaque cursors in the next and previous links instead of page numbers. (optional, supplied with the url)
             aggregationWindow (str): length of the time windows for aggregation. Format: <time><unit>. Supported units: ms, s, m. Example: 5s (Optional, supplied with the url)
-            aggregationFcn (str): Function for aggregation. Supports avg, min, max and std. (optional, provided with the url)
+            aggregationFcn (str): Function for aggregation. Supports avg, min, max and std, several functions are separated by commas, e.g. min,max,avg. (optional, provided with the url)
+            max_points (int): Maximum amount of returned points, at least 3. The sensorreadings or the aggregated windows are downsampled to this amount and are not paginated. (optional, supplied with the url)
+            downsampling (str): Downsampling method, lttb (largest-triangle-three-buckets, default) or minmax (min/max envelope). (optional, supplied with the url)
+            format (str): arrow to return the data as columnar Apache Arrow IPC stream, alternatively to the Accept header application/vnd.apache.arrow.stream. (optional, supplied with the url)
         Returns:
             if not aggregated:
             [dict]: Id, date, value and sensor_id of SensorReading instances.
+            if not aggregated and max_points:
+            [dict]: Date and value of the selected SensorReading instances.
             if aggregated:
-            [list]: {Start time of aggregationWindow, aggregated value}
+            [list]: {Start time of aggregationWindow, aggregated value}, the aggregated value is a dict with the value per function if several functions are provided.
+            if format=arrow:
+            Table with the columns of the dicts. Dates are timestamps in UTC, several aggregation functions are columns value.<function>.
         """
 
         """
@@ -149,35 +151,15 @@ class QualityCharacteristicsViewSet(CustomModelViewSet):
           - processsteps = ProcessSteps(product_id)
           - queryset = SensorReadings(qualitycharacteristics, processsteps)
         """
-        if (request.GET.get("aggregationFcn", None) is not None) and (request.GET.get("aggregationWindow", None) is None):
+        # get and check the aggregation functions, the aggregation window and the downsampling parameters
+        try:
+            aggregation = TimeSeriesAggregation.from_request(request.GET, {'qualitycharacteristics_id': pk})
+            max_points, downsampling = downsampling_parameters(request.GET)
+        except ValueError as error:
+            return Response(status=rf_status.HTTP_400_BAD_REQUEST, data=str(error))
+        if aggregation.functions and aggregation.delta is None:
            return Response(status=rf_status.HTTP_400_BAD_REQUEST, data="Aggregation function but no aggregation window provided.")
 
-        # get and check the aggregation function
-        aggregationFcn = request.GET.get("aggregationFcn", None)
-        if aggregationFcn not in ['avg', 'max', 'min', 'std', None]:
-            return Response(status=rf_status.HTTP_400_BAD_REQUEST, data="The provided aggregationFcn is not supported or the provided format is wrong.")
-        # get and check the aggregation window, convert it to a datetime.timedelta and a frequency for pandas grouping
-        aggregationWindow = request.GET.get("aggregationWindow", None)
-        if aggregationWindow:
-            aggregationWindow_split = re.split('(\d+)', aggregationWindow)
-            if aggregationWindow_split:
-                if aggregationWindow_split[2] == 'm':
-                    delta = datetime.timedelta(minutes=int(aggregationWindow_split[1]))
-                    freq = aggregationWindow_split[1]+'T'
-                elif aggregationWindow_split[2] == 's':
-                    delta = datetime.timedelta(seconds=int(aggregationWindow_split[1]))
-                    freq = aggregationWindow_split[1]+'S'
-                elif aggregationWindow_split[2] == 'ms':
-                    delta = datetime.timedelta(milliseconds=int(aggregationWindow_split[1]))
-                    freq = aggregationWindow_split[1]+'L'
-                else:
-                    return Response(status=rf_status.HTTP_400_BAD_REQUEST, data="Time unit is not supported.")
-
-            else:
-                    return Response(status=rf_status.HTTP_400_BAD_REQUEST, data="The provided aggregationWindow has the wrong format.")
-        else:
-            aggregationWindow_split = None
-
         # Exclude these fields from the Response data.
         excluded_fields = ["event", "name", "url", "processparameter", "qualitycharacteristics",  "processstep"]
         product_id = int(product_id)
@@ -193,43 +175,46 @@ class QualityCharacteristicsViewSet(CustomModelViewSet):
             queryset = models.SensorReading.objects.filter(qualitycharacteristics=pk,processstep__in=processsteps).order_by('date').only('id','value','date','sensor_id')
 
             # aggregation if aggregation parameters are provided
-            if aggregationWindow_split is not None:
-                # calculate whether the aggregation window is too small (more than 10% of the windows without sensorreadings). If aggegationWindow is too small unaggregated values are returned.
-                first_date = queryset.first().date
-                last_date = queryset.last().date
-                aggregation = True
-                if ((delta/(last_date-first_date))<0.1):
-                    aggregation = False
-                # convert queryset to pandas.DataFrame for efficient aggregation
-                df = pd.DataFrame(list(queryset.values()))
-                df['date'] = pd.to_datetime(df['date'])
-                df['value'] = df['value'].astype(float)
-                df = df[['date', 'value']]
-                df = df.set_index('date', drop=False)
-                # select the correct aggregation function
-                if aggregation == True:
-                    if aggregationFcn in ['avg',None]:
-                        df = df.groupby([pd.Grouper(freq=freq)]).mean()
-                    elif aggregationFcn == 'min':
-                        df = df.groupby([pd.Grouper(freq=freq)]).min()
-                    elif aggregationFcn == 'max':
-                        df = df.groupby([pd.Grouper(freq=freq)]).max()
-                    elif aggregationFcn == 'std':
-                        df = df.groupby([pd.Grouper(freq=freq)]).std()
-                # insert empty values with linear interpolation
-                df['value'] = df['value'].interpolate()
-                data = []
-                # create list of dictionaries out of the aggregated data
-                for index, row in df.iterrows():
-                    dictionary = {str(index):row['value']}
-                    data.append(dictionary.copy())
+            if aggregation.delta is not None:
+                # Group the sensorreadings by time window in the database. If the aggregation window is too small, the unaggregated values are returned.
+                aggregation.filter_kwargs['processstep_id__in'] = list(processsteps)
+                df = aggregation.series(queryset, stream=max_points is not None)
+                if columnar_requested(request):
+                    # Columnar arrays of the time series, the pages select rows of the series.
+                    df = aggregation.downsample_series(df, max_points, downsampling)
+                    if max_points is not None:
+                        return Response(status=rf_status.HTTP_200_OK, data=time_series_table(df.index, df.to_dict('series')))
+                    paginator = list_paginator(request)
+                    page = paginator.paginate_queryset(range(len(df)), request)
+                    if page is not None:
+                        df = df.iloc[list(page)]
+                        return paginator.get_paginated_response(time_series_table(df.index, df.to_dict('series')))
+                    return Response(status=rf_status.HTTP_200_OK, data=time_series_table(df.index, df.to_dict('series')))
+                data = aggregation.series_payload(df, max_points, downsampling)
+                if max_points is not None:
+                    return Response(status=rf_status.HTTP_200_OK, data=data)
                 # paginate the list
-                paginator = LinkHeaderPagination()
+                paginator = list_paginator(request)
                 page = paginator.paginate_queryset(data, request)
                 if page is not None:
                     return paginator.get_paginated_response(page)
                 return Response(status=rf_status.HTTP_200_OK, data=data)
 
+            elif max_points is not None:
+                # Stream the dates and values and return a shape preserving selection of the sensorreadings instead of pages.
+                if columnar_requested(request):
+                    return Response(status=rf_status.HTTP_200_OK, data=points_table(*downsampled_points(queryset, max_points, downsampling)))
+                data = downsampled_readings(queryset, max_points, downsampling)
+                serializer = SensorReadingSerializer(data, excluded_fields=["id", "url", "sensor", "event", "processparameter", "qualitycharacteristics", "processstep"], context={'request': request}, many=True)
+                return Response(status=rf_status.HTTP_200_OK, data=serializer.data)
+
+            elif columnar_requested(request):
+                # Columnar arrays of the sensorreadings without the serializer.
+                page = self.paginate_queryset(queryset)
+                if page is not None:
+                    return self.get_paginated_response(reading_table(page, ['id', 'value', 'date', 'sensor']))
+                return Response(status=rf_status.HTTP_200_OK, data=reading_table(queryset, ['id', 'value', 'date', 'sensor']))
+
             else:
                 page = self.paginate_queryset(queryset)
                 if page is not None:
@@ -242,25 +227,3 @@ class QualityCharacteristicsViewSet(CustomModelViewSet):
 
         else:
            return Response(status=rf_status.HTTP_404_NOT_FOUND, data="No SensorReadings found! There is no related ProcessStep.")
-
-# pagination for list of dictionaries
-class LinkHeaderPagination(pagination.PageNumberPagination):
-    page_size_query_param = 'page_size'
-
-    def get_paginated_response(self, data):
-        next_url = self.get_next_link()
-        previous_url = self.get_previous_link()
-
-        if next_url is not None and previous_url is not None:
-            link = '<{next_url}>; rel="next", <{previous_url}>; rel="prev"'
-        elif next_url is not None:
-            link = '<{next_url}>; rel="next"'
-        elif previous_url is not None:
-            link = '<{previous_url}>; rel="prev"'
-        else:
-            link = ''
-
-        link = link.format(next_url=next_url, previous_url=previous_url)
-        headers = {'Link': link, 'Count': self.page.paginator.count} if link else {}
-
-        return Response(data, headers=headers)
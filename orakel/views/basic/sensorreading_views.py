@@ -3,18 +3,17 @@
 
 from orakel.models.basic import qualitycharacteristics
 from orakel.views.utils import CustomModelViewSet
+from orakel.views.utils.aggregation import TimeSeriesAggregation
+from orakel.views.utils.columnar import columnar_requested, points_table, reading_table, time_series_table
+from orakel.views.utils.downsampling import downsampled_points, downsampled_readings, downsampling_parameters
 from orakel.serializers.v1 import SensorReadingSerializer
-from orakel.models import SensorReading, Sensor, ProcessParameter, QualityCharacteristics, ProcessStep, Event, ProcessStepSpecification
+from orakel.models import SensorReading, SensorReadingSummary, SensorReadingRollup, SensorReadingDateRange, Sensor, ProcessParameter, QualityCharacteristics, ProcessStep, Event, ProcessStepSpecification
 from rest_framework.decorators import action
 from rest_framework import status as rf_status
 from rest_framework.response import Response
-from rest_framework import pagination
+from django.db import router, transaction
 
 import pandas as pd
-import numpy as np
-import datetime
-import re
-import numbers
 from job_scheduler.tasks import c_update_date
 
 class SensorReadingViewSet(CustomModelViewSet):
@@ -31,11 +30,35 @@ class SensorReadingViewSet(CustomModelViewSet):
     """
     serializer_class = SensorReadingSerializer
     django_model = SensorReading
+    columnar_actions = ('list', 'aggregation')
 
     def __init__(self, *args, **kwargs):
         super(SensorReadingViewSet, self).__init__(*args, **kwargs)
         self.filter_fields["date"].extend(["gte", "lte"])
 
+    def list(self, request, *args, **kwargs):
+        """Lists the SensorReading instances, as columnar arrays without the serializer if format=arrow or the Accept header application/vnd.apache.arrow.stream is given."""
+        if not columnar_requested(request):
+            return super().list(request, *args, **kwargs)
+
+        queryset = self.filter_queryset(self.get_queryset())
+        page = self.paginate_queryset(queryset)
+        if page is not None:
+            return self.get_paginated_response(reading_table(page))
+        return Response(reading_table(queryset))
+
+    def perform_destroy(self, instance):
+        # Keep the summary and the rollups of the processstep and the date ranges of the series up to date within the transaction of the deletion.
+        with transaction.atomic(using=router.db_for_write(SensorReading)):
+            processstep_id = instance.processstep_id
+            series = SensorReadingDateRange.objects.series_of([instance])
+            instance.delete()
+            SensorReadingSummary.objects.rebuild([processstep_id])
+            SensorReadingRollup.objects.rebuild([processstep_id])
+            if processstep_id is None:
+                SensorReadingRollup.objects.rebuild_without_processstep(series)
+            SensorReadingDateRange.objects.rebuild(series)
+
     @action(detail=False, methods=["get"])
     def aggregation(self, request, *args, **kwargs):
         """Lists the aggregation of SensorReading instances over a certain QualityCharacteristics, ProcessParameter or Sensor.
@@ -45,16 +68,25 @@ class SensorReadingViewSet(CustomModelViewSet):
             sensor_id (int): Id of a Sensor instance. Exactly one of the parameters processparameter_id, qualitycharacterics_id, sensor_id must be given. (Supplied with the url)
             processstep_id (int): Id of a ProcessStep. (optional, supplied with the url)
             aggregationWindow (str): length of the time windows for aggregation. Format: <time><unit>. Supported units: ms, s, m. Example: 5s (Optional, supplied with the ur)
-            aggregationFcn (str): Function for aggregation. Supports avg, min, max and std. (optional, provided with the url)
+            aggregationFcn (str): Function for aggregation. Supports avg, min, max and std, several functions are separated by commas, e.g. min,max,avg. (optional, provided with the url)
             date_gte (timestamp): Start date and time of timeframe to consider.
             date_lte (timestamo): End date and time of timeframe to consider.
+            pagination (str): cursor to paginate with opaque cursors in the next and previous links instead of page numbers. The sensorreadings are keyed on (date, id), the windows on their index. (optional, supplied with the url)
+            max_points (int): Maximum amount of returned points, at least 3. The sensorreadings or the aggregated windows are downsampled to this amount and are not paginated. (optional, supplied with the url)
+            downsampling (str): Downsampling method, lttb (largest-triangle-three-buckets, default) or minmax (min/max envelope). (optional, supplied with the url)
+            format (str): arrow to return the data as columnar Apache Arrow IPC stream, alternatively to the Accept header application/vnd.apache.arrow.stream. (optional, supplied with the url)
         Returns:
             if not aggregated:
             [dict]: Id, date, value and sensor_id of SensorReading instances.
+            if not aggregated and max_points:
+            [dict]: Date and value of the selected SensorReading instances.
             if aggregated and aggregationWindow:
             [dict]: Start date ('date') of the aggreationWindows with SensorReadings within and aggregated value ('value') of SensorReadings within this aggregationWindow. Empty
             if aggregatet and no aggregationWindow:
             [float]: Aggregated value
+            The aggregated value is a dict with the value per function if several functions are provided.
+            if format=arrow:
+            Table with the columns of the dicts. Dates are timestamps in UTC, several aggregation functions are columns value.<function>.
         """
 
         """
@@ -62,32 +94,6 @@ class SensorReadingViewSet(CustomModelViewSet):
           - processparameter_id/qualitycharacteristics_id/sensor_id: user input / request data
           - queryset = SensorReadings(<one of qualitycharacteristic, processparameter or sensor>, processsteps)
         """
-        # get and check the aggregation function
-        aggregationFcn = request.GET.get("aggregationFcn", None)
-        if aggregationFcn not in ['avg', 'max', 'min', 'std', None]:
-            return Response(status=rf_status.HTTP_400_BAD_REQUEST, data="The provided aggregationFcn is not supported or the provided format is wrong.")
-        # get and check the aggregation window, convert it to a datetime.timedelta and a frequency for pandas grouping
-        aggregationWindow = request.GET.get("aggregationWindow", None)
-        if aggregationWindow:
-            aggregationWindow_split = re.split('(\d+)', aggregationWindow)
-            if aggregationWindow_split:
-                if aggregationWindow_split[2] == 'm':
-                    delta = datetime.timedelta(minutes=int(aggregationWindow_split[1]))
-                    freq = aggregationWindow_split[1]+'T'
-                elif aggregationWindow_split[2] == 's':
-                    delta = datetime.timedelta(seconds=int(aggregationWindow_split[1]))
-                    freq = aggregationWindow_split[1]+'S'
-                elif aggregationWindow_split[2] == 'ms':
-                    delta = datetime.timedelta(milliseconds=int(aggregationWindow_split[1]))
-                    freq = aggregationWindow_split[1]+'L'
-                else:
-                    return Response(status=rf_status.HTTP_400_BAD_REQUEST, data="Time unit is not supported.")
-
-            else:
-                    return Response(status=rf_status.HTTP_400_BAD_REQUEST, data="The provided aggregationWindow has the wrong format.")
-        else:
-            aggregationWindow_split = None
-
         # Exclude these fields from the Response data.
         excluded_fields = ["event", "url", "processparameter", "qualitycharacteristics",  "processstep"]
 
@@ -122,63 +128,60 @@ class SensorReadingViewSet(CustomModelViewSet):
             queryset_filter_kwargs ['qualitycharacteristics_id'] = qualitycharacteristics_id
         if processparameter_id:
             queryset_filter_kwargs ['processparameter_id'] = processparameter_id
-        if processstep_id:
-            queryset_filter_kwargs ['processstep_id'] = processstep_id
         if sensor_id:
             queryset_filter_kwargs ['sensor_id'] = sensor_id
 
+        # get and check the aggregation functions, the aggregation window and the downsampling parameters
+        try:
+            aggregation = TimeSeriesAggregation.from_request(request.GET, queryset_filter_kwargs)
+            max_points, downsampling = downsampling_parameters(request.GET)
+        except ValueError as error:
+            return Response(status=rf_status.HTTP_400_BAD_REQUEST, data=str(error))
+
         # aggregation if aggregation parameters are provided
-        if aggregationWindow_split is not None:
-
-            # query database and convert queryset to pandas.DataFrame for efficient aggregation
-            df = pd.DataFrame(list(SensorReading.objects.filter(**queryset_filter_kwargs).order_by('date').only('date', 'value').values()))
-            df['date'] = pd.to_datetime(df['date'])
-            df['value'] = df['value'].astype(float)
-            df = df[['date', 'value']]
-            df = df.set_index('date', drop=False)
-
-            # select the correct aggregation function
-            if aggregationFcn in ['avg',None]:
-                df = df.groupby([pd.Grouper(freq=freq)]).mean()
-            elif aggregationFcn == 'min':
-                df = df.groupby([pd.Grouper(freq=freq)]).min()
-            elif aggregationFcn == 'max':
-                df = df.groupby([pd.Grouper(freq=freq)]).max()
-            elif aggregationFcn == 'std':
-                df = df.groupby([pd.Grouper(freq=freq)]).std()
-
-            # set datetime to iso format
-            df.index = df.index.map(lambda x: datetime.datetime.strftime(x, '%Y-%m-%dT%H:%M:%SZ'))
-
-            # delete data points from aggregationWindows without values within
-            df['value'].replace('', np.nan, inplace=True)
-            df.dropna(subset=['value'], inplace=True)
-
-
-            data = []
-            # create list of dictionaries out of the aggregated data
-            for index, row in df.iterrows():
-                dictionary = {}
-                dictionary['date'] = str(index)
-                dictionary['value'] = row['value']
-                data.append(dictionary.copy())
-
-            # state additional fields to exclude and paginate the list
-            excluded_fields.append('id')
-            excluded_fields.append('sensor')
-            page = self.paginate_queryset(data)
+        if aggregation.delta is not None:
+
+            # Group the sensorreadings by time window in the database, only the aggregated windows are fetched.
+            window_queryset, origin = aggregation.windows()
+
+            if columnar_requested(request):
+                # Columnar arrays of the windows.
+                if max_points is not None:
+                    return Response(status=rf_status.HTTP_200_OK, data=time_series_table(*aggregation.window_series(window_queryset, origin, max_points, downsampling)))
+                page = self.paginate_queryset(window_queryset)
+                if page is not None:
+                    return self.get_paginated_response(time_series_table(*aggregation.window_series(page, origin)))
+                return Response(status=rf_status.HTTP_200_OK, data=time_series_table(*aggregation.window_series(window_queryset, origin)))
+
+            if max_points is not None:
+                # Downsample the windows instead of paginating them.
+                return Response(status=rf_status.HTTP_200_OK, data=aggregation.window_payload(window_queryset, origin, max_points, downsampling))
+            page = self.paginate_queryset(window_queryset)
             if page is not None:
-                serializer = SensorReadingSerializer(page, excluded_fields=excluded_fields, context=self.get_serializer_context(), many=True)
-                return self.get_paginated_response(serializer.data)
-            serializer = SensorReadingSerializer(data, excluded_fields=excluded_fields, context=self.get_serializer_context(), many=True)
-            return Response(status=rf_status.HTTP_200_OK, data=serializer.data)
+                return self.get_paginated_response(aggregation.window_payload(page, origin))
+            return Response(status=rf_status.HTTP_200_OK, data=aggregation.window_payload(window_queryset, origin))
 
         else:
             # when no aggregationFcn and aggregationWindow are provided
-            if aggregationFcn is None:
+            if not aggregation.functions:
 
                 queryset = SensorReading.objects.filter(**queryset_filter_kwargs).order_by('date').only('id', 'date', 'value', 'sensor_id')
 
+                if max_points is not None:
+                    # Stream the dates and values and return a shape preserving selection of the sensorreadings instead of pages.
+                    if columnar_requested(request):
+                        return Response(status=rf_status.HTTP_200_OK, data=points_table(*downsampled_points(queryset, max_points, downsampling)))
+                    data = downsampled_readings(queryset, max_points, downsampling)
+                    serializer = SensorReadingSerializer(data, excluded_fields=excluded_fields + ['id', 'sensor'], context=self.get_serializer_context(), many=True)
+                    return Response(status=rf_status.HTTP_200_OK, data=serializer.data)
+
+                if columnar_requested(request):
+                    # Columnar arrays of the sensorreadings without the serializer.
+                    page = self.paginate_queryset(queryset)
+                    if page is not None:
+                        return self.get_paginated_response(reading_table(page, ['id', 'value', 'date', 'sensor']))
+                    return Response(status=rf_status.HTTP_200_OK, data=reading_table(queryset, ['id', 'value', 'date', 'sensor']))
+
                 page = self.paginate_queryset(queryset)
                 if page is not None:
                     serializer = SensorReadingSerializer(page, excluded_fields=excluded_fields, context=self.get_serializer_context(), many=True)
@@ -190,20 +193,8 @@ class SensorReadingViewSet(CustomModelViewSet):
 
             # when aggregationFcn but no aggregation window is provided
             else:
-                queryset = SensorReading.objects.filter(**queryset_filter_kwargs).order_by('date').only('date', 'value')
-                # convert queryset to pandas.DataFrame for efficient aggregation
-                df = pd.DataFrame(list(queryset.values()))
-                df = df['value'].astype('float')
-                if aggregationFcn == 'avg':
-                    df = df.mean()
-                elif aggregationFcn == 'min':
-                    df = df.min()
-                elif aggregationFcn == 'max':
-                    df = df.max()
-                elif aggregationFcn == 'std':
-                    df = df.std()
-
-                return Response(float(df))
+                # aggregate all sensorreadings in the database
+                return Response(aggregation.total())
 
     @action(detail=False, methods=["get"])
     def daterange(self, request, *args, **kwargs):
@@ -233,24 +224,20 @@ class SensorReadingViewSet(CustomModelViewSet):
         # define filter for querying the database
         queryset_filter_kwargs = {}
 
+        # The processsteps are selected in a subquery, so the dates are aggregated with a single query.
         if product_ids:
             product_ids = self.url_to_list(product_ids)
-            queryset_filter_kwargs ['processstep_id__in'] = list(ProcessStep.objects.filter(product_id__in=product_ids).values_list('id'))
+            queryset_filter_kwargs ['processstep_id__in'] = ProcessStep.objects.filter(product_id__in=product_ids).order_by().values('id')
         if productspecification_ids:
             productspecification_ids = self.url_to_list(productspecification_ids)
-            processstepspecification_from_productspecification = list(ProcessStepSpecification.objects.filter(productspecification_id__in=productspecification_ids).values_list('id'))
-            queryset_filter_kwargs ['processstep_id__in'] = list(ProcessStep.objects.filter(processstepspecification_id__in=processstepspecification_from_productspecification).values_list('id'))
+            queryset_filter_kwargs ['processstep_id__in'] = ProcessStep.objects.filter(processstepspecification__productspecification_id__in=productspecification_ids).order_by().values('id')
         if qualitycharacteristics_ids:
             queryset_filter_kwargs ['qualitycharacteristics_id__in'] = self.url_to_list(qualitycharacteristics_ids)
         if processparameter_ids:
             queryset_filter_kwargs ['processparameter_id__in'] = self.url_to_list(processparameter_ids)
 
-
-        last_object = SensorReading.objects.filter(**queryset_filter_kwargs).order_by('date').last()
-        first_object = SensorReading.objects.filter(**queryset_filter_kwargs).order_by('date').first()
-
-        first_date = first_object.date if first_object else None
-        last_date = last_object.date if last_object else None
+        # Filters of processparameters or qualitycharacteristics read the date ranges instead of the sensorreadings.
+        first_date, last_date = SensorReadingDateRange.objects.date_range(queryset_filter_kwargs)
 
         return Response(status=rf_status.HTTP_200_OK, data={"firstDate": first_date, "lastDate": last_date})
 
@@ -278,56 +265,29 @@ class SensorReadingViewSet(CustomModelViewSet):
         product_list = request.GET.get("product_list", None)
         product_list = self.url_to_list(product_list)
 
-        message = []
-        # get the data and convert them to dataframe
-        processstep_ids = list(ProcessStep.objects.filter(product_id__in=product_list).values_list('id'))
-        sensorreadings = SensorReading.objects.exclude(qualitycharacteristics_id__isnull=True).filter(processstep_id__in=processstep_ids).values('value', 'processstep__product__id', 'qualitycharacteristics__id', 'sensor__id', 'sensor__virtual')
-        df = pd.DataFrame(list(sensorreadings))
-        df  = df.reset_index()
+        # get the sensorreadings of the QualityCharacteristics of the products with a single query, the database does not sort them, the order is set by pandas
+        sensorreadings = SensorReading.objects.filter(processstep__product_id__in=product_list, qualitycharacteristics_id__isnull=False).order_by().values_list(
+                                                      'id', 'processstep_id', 'value', 'processstep__product_id', 'qualitycharacteristics_id', 'sensor_id', 'sensor__virtual')
+        df = pd.DataFrame(list(sensorreadings), columns=['id', 'processstep', 'value', 'product', 'qualitycharacteristics', 'sensor', 'virtual'])
+        # newest sensorreading first like the default -id ordering, the newest sensorreading of a product is used
+        df = df.sort_values('id', ascending=False)
         # split the dataframe in dataframes with values from real respective virtual sensors
-        df_real = df[df['sensor__virtual'] == False]
-        df_virtual = df[df['sensor__virtual'] == True]
-        df_real = df_real.reset_index()
-        df_virtual = df_virtual.reset_index()
-
-        # iterate over the QualityCharacteristics
-        qc_list = df['qualitycharacteristics__id'].unique()
-        qc_list.sort()
-        for qc in qc_list:
-            # get the corresponding virtual sensors
-            sensor_list = df_virtual[df_virtual['qualitycharacteristics__id'] == qc]['sensor__id'].unique()
-            measured_list = []
-            predicted_list = []
-            # iterate over the products  for real values and create a list with values
-            for product in product_list:
-                temp = df_real[(df_real['processstep__product__id'] == product) & (df_real['qualitycharacteristics__id'] == qc)]['value'].tolist()
-                if len(temp) > 0:
-                    temp = temp[0]
-                else:
-                    temp = None
-                if isinstance(temp, numbers.Number):
-                    measured_list.append(float(temp))
-                else:
-                    measured_list.append('null')
-            # iterate over the sensors for virtual values
-            for sensor in sensor_list:
-                temp_list = []
-                # iterate over the prducts and crate a list with values
-                for product in product_list:
-                    temp = df_virtual[(df_virtual['processstep__product__id'] == product) & (df_virtual['qualitycharacteristics__id'] == qc) & (df_virtual['sensor__id'] == sensor)]['value'].tolist()
-                    if len(temp) > 0:
-                        temp = temp[0]
-                    else:
-                        temp = None
-                    if isinstance(temp, numbers.Number):
-                        temp_list.append(float(temp))
-                    else:
-                        temp_list.append('null')
-                # create a list of lists from virtual values
-                predicted_list.append(temp_list)
+        df_real = df[df['virtual'] == False]
+        df_virtual = df[df['virtual'] == True]
+
+        # measured values per QualityCharacteristic and predicted values per QualityCharacteristic and virtual sensor, one column per product
+        measured = self.pivot_products(df_real, ['qualitycharacteristics'], product_list)
+        predicted = self.pivot_products(df_virtual, ['qualitycharacteristics', 'sensor'], product_list)
+        # the virtual sensors of each QualityCharacteristic in the order of their newest sensorreading
+        sensors = df_virtual.drop_duplicates(['qualitycharacteristics', 'sensor']).groupby('qualitycharacteristics', sort=False)['sensor'].agg(list)
+
+        message = []
+        for qc in sorted(df['qualitycharacteristics'].unique()):
+            measured_list = measured.loc[qc].tolist() if qc in measured.index else ['null'] * len(product_list)
+            predicted_list = predicted.loc[[(qc, sensor) for sensor in sensors.get(qc, [])]].values.tolist()
             # convert data to json format
             temp_dict = {
-                "QualityCharacteristic": qc,
+                "QualityCharacteristic": int(qc),
                 "measured_values": measured_list,
                 "predicted_values": predicted_list
                 }
@@ -335,6 +295,22 @@ class SensorReadingViewSet(CustomModelViewSet):
             message.append(temp_dict)
         return Response(status=rf_status.HTTP_200_OK, data={'results': message})
 
+    @staticmethod
+    def pivot_products(df, keys, product_list):
+        """Pivot the values of sensorreadings to one row per key and one column per product. The first sensorreading of a key and product in the dataframe is used.
+        Args:
+            df (pd.DataFrame): Sensorreadings with the columns value, product and the key columns.
+            keys (list[str]): Key columns of the rows.
+            product_list (list[int]): Ids of the products in the order of the columns.
+        Returns:
+            [pd.DataFrame]: Values as float, 'null' if the product has no sensorreading of the key or the sensorreading has no value.
+        """
+        values = df.drop_duplicates(keys + ['product']).set_index(keys + ['product'])['value']
+        values = values.astype(object).where(values.notna(), 'null')
+        if values.empty:
+            return pd.DataFrame(columns=product_list, index=pd.MultiIndex.from_arrays([[]] * len(keys), names=keys) if len(keys) > 1 else pd.Index([], name=keys[0]))
+        return values.unstack('product', fill_value='null').reindex(columns=product_list, fill_value='null')
+
     @action(detail=False, methods=["get"])
     def update_date(self, request, *args, **kwargs):
         """Updates the date of a given product to a given date. Time is not changed.
@@ -365,32 +341,3 @@ class SensorReadingViewSet(CustomModelViewSet):
             return Response(status=rf_status.HTTP_200_OK)
         else:
             return Response(status=rf_status.HTTP_400_BAD_REQUEST, data="Not all necessary parameters are provided. Needed: year, month, date, product_id and database")
-
-
-
-
-
-
-
-
-# pagination for list of dictionaries
-class LinkHeaderPagination(pagination.PageNumberPagination):
-    page_size_query_param = 'page_size'
-
-    def get_paginated_response(self, data):
-        next_url = self.get_next_link()
-        previous_url = self.get_previous_link()
-
-        if next_url is not None and previous_url is not None:
-            link = '<{next_url}>; rel="next", <{previous_url}>; rel="prev"'
-        elif next_url is not None:
-            link = '<{next_url}>; rel="next"'
-        elif previous_url is not None:
-            link = '<{previous_url}>; rel="prev"'
-        else:
-            link = ''
-
-        link = link.format(next_url=next_url, previous_url=previous_url)
-        headers = {'Link': link, 'Count': self.page.paginator.count} if link else {}
-
-        return Response(data, headers=headers)
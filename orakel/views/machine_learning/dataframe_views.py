@@ -23,6 +23,10 @@ class DataFrameViewSet(CustomModelViewSet):
 
     Viewset extra Actions:
         create_dataframe: Queue a job in the scheduler
+        refresh_dataframe: Queue a job in the scheduler that appends the products added since the last successful build
+        cancel_dataframe: Stop a scheduled or running build, a re-submitted build resumes from its checkpoints
+        partitions: List the partitions of a partitioned build
+        progress: Return the status and the progress of the running or last build
 
     Relationships:
         Dataframe to ProductSpecification: ManyToOne
@@ -76,9 +80,62 @@ class DataFrameViewSet(CustomModelViewSet):
             return Response(status=rf_status.HTTP_400_BAD_REQUEST, data="To many features supplied (max of 500). amount_feautres = (amount_processparameter + amount_qualitycharacteristics) * amount_methods")
 
         # Update job status to scheduled.
-        self.django_model.objects.filter(pk=pk).update(**{"status": "Scheduled"})
+        self.django_model.objects.filter(pk=pk).update(**{"status": "Scheduled", "cancel_requested": False})
 
         # Submit task to the queue and worker pods.
         tasks.CreateDataframe().delay(pk=pk, database_name=database, methods_per_feature=methods_per_feature, product_ids=None)
 
         return Response(status=rf_status.HTTP_200_OK, data="Job create_dataframe was submitted!")
+
+    @action(detail=True, methods=["get"])  # Detail=True to use action/method on an instance.
+    def refresh_dataframe(self, request, pk, database):
+        """Submits the celery task CreateDataframe for the products that were added since the last successful build.
+        The features of the new products are appended to the files of the last build, which has to use the current configuration.
+        """
+        if not self.django_model.objects.filter(pk=pk, status="Succeeded", product_high_water_mark__isnull=False, save_path__isnull=False).exists():
+            return Response(status=rf_status.HTTP_400_BAD_REQUEST, data="DataFrame instance has no successful build to refresh! Please use create_dataframe.")
+
+        methods_per_feature = self.django_model.objects.filter(pk=pk).values('feature_config')[0].get('feature_config')
+
+        # Update job status to scheduled.
+        self.django_model.objects.filter(pk=pk).update(**{"status": "Scheduled", "cancel_requested": False})
+
+        # Submit task to the queue and worker pods.
+        tasks.CreateDataframe().delay(pk=pk, database_name=database, methods_per_feature=methods_per_feature, product_ids=None, refresh=True)
+
+        return Response(status=rf_status.HTTP_200_OK, data="Job refresh_dataframe was submitted!")
+
+    @action(detail=True, methods=["get"])  # Detail=True to use action/method on an instance.
+    def cancel_dataframe(self, request, pk, database):
+        """Requests the cancellation of a scheduled or running build. The CreateDataframe tasks stop at their next progress update.
+        The completed parts of the build are kept as checkpoints at the save_path, create_dataframe resumes from them.
+        """
+        if not self.django_model.objects.filter(pk=pk, status__in=["Scheduled", "Running"]).exists():
+            return Response(status=rf_status.HTTP_400_BAD_REQUEST, data="DataFrame instance has no scheduled or running build!")
+
+        self.django_model.objects.filter(pk=pk).update(**{"cancel_requested": True})
+
+        return Response(status=rf_status.HTTP_200_OK, data="Cancellation of the build was requested!")
+
+    @action(detail=True, methods=["get"])  # Detail=True to use action/method on an instance.
+    def partitions(self, request, pk, database):
+        """Lists the partitions of a partitioned build with their status and product range.
+        """
+        partitions = models.DataFramePartition.objects.filter(dataframe=pk).values('partition', 'status', 'task_id', 'product_amount', 'first_product_id', 'last_product_id', 'started', 'ended', 'progress', 'instrumentation')
+
+        return Response(status=rf_status.HTTP_200_OK, data=list(partitions))
+
+    @action(detail=True, methods=["get"])  # Detail=True to use action/method on an instance.
+    def progress(self, request, pk, database):
+        """Returns the status and the progress of the running or last build, e.g. to be polled by the GUI.
+        Only the DataFrame and DataFramePartition instances are read, the progress of partitioned builds is combined from their partitions.
+        """
+        dataframe = self.django_model.objects.filter(pk=pk).values('status', 'progress').first()
+        if dataframe is None:
+            return Response(status=rf_status.HTTP_404_NOT_FOUND, data="DataFrame instance does not exist!")
+
+        if dataframe['progress'] and dataframe['progress'].get('stage') == "partitions":
+            progresses = models.DataFramePartition.objects.filter(dataframe=pk).values_list('progress', flat=True)
+            dataframe['progress'] = tasks.BuildProgress.combine(list(progresses))
+
+        return Response(status=rf_status.HTTP_200_OK, data=dataframe)
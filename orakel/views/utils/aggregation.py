@@ -0,0 +1,352 @@
+# Copyright (c) 2022 RWTH Aachen - Werkzeugmaschinenlabor (WZL)
+# Contact: Simon Cramer, s.cramer@wzl-mq.rwth-aachen.de
+
+import datetime
+import re
+
+import numpy as np
+import pandas as pd
+
+from django.db.models import Avg, Count, ExpressionWrapper, F, FloatField, Max, Min, Sum, Variance
+
+from orakel.models import SensorReading, SensorReadingRollup
+from orakel.models.utils import TimeBucket
+from orakel.views.utils.downsampling import downsample, read_points
+
+
+AGGREGATION_FUNCTIONS = ('avg', 'min', 'max', 'std')
+AGGREGATION_UNITS = {'ms': 'milliseconds', 's': 'seconds', 'm': 'minutes'}
+WINDOW_COLUMNS = ('window', 'count', 'mean', 'm2', 'min', 'max')
+
+
+def parse_aggregation_window(aggregationWindow):
+    """Convert an aggregation window to a datetime.timedelta.
+
+    Args:
+        aggregationWindow (str): Length of the time windows. Format: <time><unit>. Supported units: ms, s, m. Example: 5s
+
+    Raises:
+        ValueError: The format or the unit is not supported.
+
+    Returns:
+        [datetime.timedelta]: Length of the time windows, None if no aggregationWindow is given.
+    """
+    if not aggregationWindow:
+        return None
+    aggregationWindow_split = re.split(r'(\d+)', aggregationWindow)
+    if len(aggregationWindow_split) != 3 or aggregationWindow_split[0] or int(aggregationWindow_split[1]) == 0:
+        raise ValueError("The provided aggregationWindow has the wrong format.")
+    if aggregationWindow_split[2] not in AGGREGATION_UNITS:
+        raise ValueError("Time unit is not supported.")
+
+    return datetime.timedelta(**{AGGREGATION_UNITS[aggregationWindow_split[2]]: int(aggregationWindow_split[1])})
+
+
+def parse_aggregation_functions(aggregationFcn):
+    """Split comma separated aggregation functions, e.g. min,max,avg.
+
+    Args:
+        aggregationFcn (str): One or more of avg, min, max and std.
+
+    Raises:
+        ValueError: A function is not supported.
+
+    Returns:
+        [list[str]]: Aggregation functions in the given order without duplicates, empty if no aggregationFcn is given.
+    """
+    if aggregationFcn is None:
+        return []
+    functions = [function.strip() for function in aggregationFcn.split(',')]
+    if not all(function in AGGREGATION_FUNCTIONS for function in functions):
+        raise ValueError("The provided aggregationFcn is not supported or the provided format is wrong.")
+
+    return list(dict.fromkeys(functions))
+
+
+def payload_values(values, functions):
+    """Convert aggregated values to JSON compatible values, NaN becomes None.
+
+    Args:
+        values (dict[str, np.ndarray]): float64 values per aggregation function.
+        functions (list[str]): Aggregation functions of the payload.
+
+    Returns:
+        [list]: Values of the single function or dicts with the values of several functions.
+    """
+    columns = [np.where(np.isnan(values[function]), None, values[function]).tolist() for function in functions]
+    if len(functions) == 1:
+        return columns[0]
+    return [dict(zip(functions, row)) for row in zip(*columns)]
+
+
+def timestamp_strings(index):
+    """String representation of the timestamps like str(pd.Timestamp), e.g. 2021-09-08 05:02:00.500000+00:00.
+
+    Args:
+        index (pd.DatetimeIndex): Timezone aware timestamps.
+
+    Returns:
+        [list[str]]: Timestamps in UTC.
+    """
+    index = index.tz_convert('UTC')
+    fractions = np.where(index.microsecond > 0, np.char.mod('.%06d', index.microsecond), '')
+    return np.char.add(np.char.add(index.strftime('%Y-%m-%d %H:%M:%S').to_numpy(dtype=str), fractions), '+00:00').tolist()
+
+
+class TimeSeriesAggregation:
+    """Aggregation of the sensorreadings of a filter in time windows. Shared by SensorReadingViewSet.aggregation and the perproduct actions of
+    ProcessParameterViewSet and QualityCharacteristicsViewSet.
+    The windows are grouped in the database and converted to the response data with NumPy, several aggregation functions are computed from the same windows.
+    """
+    # Aggregate time windows from the SensorReadingRollup instances when the windows fit a rollup resolution.
+    use_rollups = True
+    # Aggregates of the sensorreading values. The variance of the database is stable for large values with small deviations unlike a sum of squares.
+    value_aggregates = {'count': Count('value'),
+                        'mean': Avg('value'),
+                        'm2': ExpressionWrapper(Variance('value') * Count('value'), output_field=FloatField()),
+                        'min': Min('value'),
+                        'max': Max('value')}
+
+    def __init__(self, filter_kwargs, delta=None, functions=()):
+        """
+        Args:
+            filter_kwargs (dict): Filter of the sensorreadings.
+            delta (datetime.timedelta, optional): Length of the time windows. Defaults to None (no windows).
+            functions (list[str], optional): Requested aggregation functions. Defaults to () (avg).
+        """
+        self.filter_kwargs = filter_kwargs
+        self.delta = delta
+        self.functions = list(functions)
+        self.value_functions = self.functions or ['avg']
+
+    @classmethod
+    def from_request(cls, query_params, filter_kwargs):
+        """Aggregation of the aggregationWindow and aggregationFcn parameters of a request.
+
+        Args:
+            query_params (QueryDict): Query parameters of the request.
+            filter_kwargs (dict): Filter of the sensorreadings.
+
+        Raises:
+            ValueError: The parameters are not supported.
+
+        Returns:
+            [TimeSeriesAggregation]: Aggregation of the request.
+        """
+        return cls(filter_kwargs, parse_aggregation_window(query_params.get("aggregationWindow", None)), parse_aggregation_functions(query_params.get("aggregationFcn", None)))
+
+    def windows(self):
+        """Group the sensorreadings by time window in the database. The windows start at midnight (UTC) of the day of the first sensorreading like pandas.Grouper.
+        The windows are combined from the coarsest SensorReadingRollup resolution that fits the windows and date bounds. Fine windows and sensorreadings that are not
+        rolled up yet aggregate the sensorreadings.
+        Windows without values are omitted, std alone needs at least two values per window.
+
+        Returns:
+            [QuerySet]: Values queryset ordered by window with the window index ('window'), count, mean, sum of squared deviations from the mean (m2), min and max of the values.
+            [datetime.datetime]: Start of the first window, None if there are no sensorreadings.
+        """
+        resolution = SensorReadingRollup.objects.resolution_for(self.delta, self.filter_kwargs) if self.use_rollups else None
+        if resolution is not None:
+            queryset = SensorReadingRollup.objects.window_queryset(resolution, self.filter_kwargs)
+            date_field = 'bucket_start'
+            bounds = queryset.aggregate(first_date=Min(date_field), shift=Avg('mean'))
+            # The rollups of a window are merged with the formula of Chan et al. Their means are shifted by the average mean of the rollups,
+            # so that the squares of large values with small deviations do not cancel out.
+            shift = bounds['shift'] or 0.0
+            weighted = Sum(ExpressionWrapper(F('count') * (F('mean') - shift), output_field=FloatField()))
+            squared = Sum(ExpressionWrapper(F('count') * (F('mean') - shift) * (F('mean') - shift), output_field=FloatField()))
+            # The annotations replace the fields of the same name, m2 and mean are annotated before the fields they use.
+            aggregates = {'m2': ExpressionWrapper(Sum('m2') + squared - weighted * weighted / Sum('count'), output_field=FloatField()),
+                          'mean': ExpressionWrapper(weighted / Sum('count') + shift, output_field=FloatField()),
+                          'count': Sum('count'),
+                          'min': Min('min'),
+                          'max': Max('max')}
+        else:
+            queryset = SensorReading.objects.filter(date__isnull=False, **self.filter_kwargs).order_by()
+            date_field = 'date'
+            bounds = queryset.aggregate(first_date=Min(date_field))
+            aggregates = self.value_aggregates
+
+        if bounds['first_date'] is None:
+            return queryset.none().values(date_field), None
+        origin = bounds['first_date'].astimezone(datetime.timezone.utc).replace(hour=0, minute=0, second=0, microsecond=0)
+
+        if resolution is None:
+            # The variance of the database does not support NULL values on every database.
+            queryset = queryset.filter(value__isnull=False)
+        window_queryset = queryset.annotate(window=TimeBucket(date_field, origin, self.delta)).values('window').annotate(**aggregates)
+        # The sample standard deviation needs at least two values.
+        window_queryset = window_queryset.filter(count__gte=2 if self.value_functions == ['std'] else 1)
+
+        return window_queryset.order_by('window'), origin
+
+    @staticmethod
+    def columns(windows):
+        """Columns of aggregated time windows.
+
+        Args:
+            windows (iterable[dict]): Rows of the queryset of windows().
+
+        Returns:
+            [dict[str, np.ndarray]]: float64 columns of WINDOW_COLUMNS, the window index is int64.
+        """
+        rows = np.array([[window[column] for column in WINDOW_COLUMNS] for window in windows], dtype=np.float64).reshape(-1, len(WINDOW_COLUMNS))
+        columns = dict(zip(WINDOW_COLUMNS, rows.T))
+        columns['window'] = columns['window'].astype(np.int64)
+        return columns
+
+    def values(self, columns):
+        """Aggregated values of time windows.
+
+        Args:
+            columns (dict[str, np.ndarray]): Columns of the windows.
+
+        Returns:
+            [dict[str, np.ndarray]]: float64 values per requested aggregation function, NaN if the window has too few values.
+        """
+        count = columns['count']
+        values = {}
+        with np.errstate(divide='ignore', invalid='ignore'):
+            for function in self.value_functions:
+                if function == 'min':
+                    values[function] = columns['min']
+                elif function == 'max':
+                    values[function] = columns['max']
+                elif function == 'std':
+                    # Sample standard deviation, rounding errors of merged rollups can lead to slightly negative sums of squared deviations.
+                    values[function] = np.where(count >= 2, np.sqrt(np.maximum(columns['m2'], 0) / (count - 1)), np.nan)
+                else:
+                    values[function] = np.where(count >= 1, columns['mean'], np.nan)
+        return values
+
+    def window_starts(self, origin, window):
+        """Start of time windows.
+
+        Args:
+            origin (datetime.datetime): Start of the first window, None if there are no windows.
+            window (np.ndarray): int64 window indices.
+
+        Returns:
+            [np.ndarray]: datetime64[us] starts in UTC.
+        """
+        if origin is None:
+            return np.empty(0, dtype='datetime64[us]')
+        return np.datetime64(origin.astimezone(datetime.timezone.utc).replace(tzinfo=None), 'us') + window * np.timedelta64(self.delta // datetime.timedelta(microseconds=1), 'us')
+
+    def window_series(self, windows, origin, max_points=None, downsampling='lttb'):
+        """Start dates and aggregated values of time windows.
+
+        Args:
+            windows (iterable[dict]): Rows of the queryset of windows().
+            origin (datetime.datetime): Start of the first window.
+            max_points (int, optional): Maximum amount of windows, the windows are downsampled by the first function. Defaults to None.
+            downsampling (str, optional): Downsampling method. Defaults to 'lttb'.
+
+        Returns:
+            [np.ndarray]: datetime64[us] starts of the windows in UTC.
+            [dict[str, np.ndarray]]: float64 values per requested aggregation function, NaN if the window has too few values.
+        """
+        columns = self.columns(windows)
+        values = self.values(columns)
+        if max_points is not None:
+            index = downsample(columns['window'], values[self.value_functions[0]], max_points, downsampling)
+            columns = {column: array[index] for column, array in columns.items()}
+            values = {function: array[index] for function, array in values.items()}
+
+        return self.window_starts(origin, columns['window']), values
+
+    def window_payload(self, windows, origin, max_points=None, downsampling='lttb'):
+        """Response data of aggregated time windows.
+
+        Args:
+            windows (iterable[dict]): Rows of the queryset of windows().
+            origin (datetime.datetime): Start of the first window.
+            max_points (int, optional): Maximum amount of windows, the windows are downsampled by the first function. Defaults to None.
+            downsampling (str, optional): Downsampling method. Defaults to 'lttb'.
+
+        Returns:
+            [list[dict]]: Aggregated value ('value') and start date ('date') of the windows in iso format. The value is a dict of the functions if several functions are requested.
+        """
+        starts, values = self.window_series(windows, origin, max_points, downsampling)
+        dates = np.char.add(np.datetime_as_string(starts, unit='s'), 'Z').tolist()
+
+        return [{'value': value, 'date': date} for value, date in zip(payload_values(values, self.value_functions), dates)]
+
+    def total(self):
+        """Aggregate all sensorreadings of the filter without time windows.
+
+        Returns:
+            [float or dict]: Aggregated value, a dict of the functions if several functions are requested. None if there are no values.
+        """
+        queryset = SensorReading.objects.filter(value__isnull=False, **self.filter_kwargs).order_by()
+        # The variance of the database is not defined without values on every database.
+        row = queryset.aggregate(**self.value_aggregates) if queryset.exists() else dict.fromkeys(WINDOW_COLUMNS[1:])
+        columns = {column: np.array([np.nan if row[column] is None else row[column]], dtype=np.float64) for column in WINDOW_COLUMNS[1:]}
+
+        return payload_values(self.values(columns), self.value_functions)[0]
+
+    def series(self, queryset, stream=False):
+        """Aggregated time series of a product. The windows cover the range from the first to the last window with values, missing windows are interpolated linearly.
+        If the windows are shorter than 10% of the time range of the sensorreadings, the sensorreadings are returned unaggregated.
+
+        Args:
+            queryset (QuerySet): Sensorreadings of the filter ordered by date.
+            stream (bool, optional): Stream only the dates and values of unaggregated sensorreadings, e.g. before downsampling. Defaults to False.
+
+        Returns:
+            [pd.DataFrame]: Values indexed by timestamp, one column per requested function or a single column 'value' of unaggregated sensorreadings.
+        """
+        dates = queryset.aggregate(first_date=Min('date'), last_date=Max('date'))
+        if dates['first_date'] is None:
+            return pd.DataFrame({function: pd.Series(dtype=np.float64) for function in self.value_functions}, index=pd.DatetimeIndex([], tz='UTC'))
+
+        span = dates['last_date'] - dates['first_date']
+        if span and self.delta / span < 0.1:
+            if stream:
+                times, values = read_points(queryset)
+                return pd.DataFrame({'value': values}, index=pd.to_datetime(times, unit='us', utc=True))
+            df = pd.DataFrame(list(queryset.values_list('date', 'value')), columns=['date', 'value'])
+            df = pd.DataFrame({'value': df['value'].astype(float).to_numpy()}, index=pd.to_datetime(df['date']))
+        else:
+            windows, origin = self.windows()
+            columns = self.columns(windows)
+            df = pd.DataFrame(self.values(columns), index=pd.DatetimeIndex(self.window_starts(origin, columns['window'])).tz_localize('UTC'))
+            # Windows without values are part of the time range like in pandas.Grouper.
+            if not df.empty:
+                df = df.reindex(pd.date_range(df.index[0], df.index[-1], freq=self.delta))
+
+        # insert empty values with linear interpolation
+        return df.interpolate()
+
+    @staticmethod
+    def downsample_series(df, max_points=None, downsampling='lttb'):
+        """Downsample a time series of series().
+
+        Args:
+            df (pd.DataFrame): Time series.
+            max_points (int, optional): Maximum amount of timestamps, the series is downsampled by the first column. Defaults to None (no downsampling).
+            downsampling (str, optional): Downsampling method. Defaults to 'lttb'.
+
+        Returns:
+            [pd.DataFrame]: Selected timestamps of the time series.
+        """
+        if max_points is None:
+            return df
+        return df.iloc[downsample(df.index.asi8, df.iloc[:, 0].to_numpy(), max_points, downsampling)]
+
+    @classmethod
+    def series_payload(cls, df, max_points=None, downsampling='lttb'):
+        """Response data of a time series of series().
+
+        Args:
+            df (pd.DataFrame): Time series.
+            max_points (int, optional): Maximum amount of timestamps, the series is downsampled by the first column. Defaults to None.
+            downsampling (str, optional): Downsampling method. Defaults to 'lttb'.
+
+        Returns:
+            [list[dict]]: {timestamp: value} per timestamp, the value is a dict of the columns if there are several columns.
+        """
+        df = cls.downsample_series(df, max_points, downsampling)
+        values = {column: df[column].to_numpy(dtype=np.float64) for column in df.columns}
+
+        return [{timestamp: value} for timestamp, value in zip(timestamp_strings(df.index), payload_values(values, list(df.columns)))]
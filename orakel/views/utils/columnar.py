@@ -0,0 +1,75 @@
+# Copyright (c) 2022 RWTH Aachen - Werkzeugmaschinenlabor (WZL)
+# Contact: Simon Cramer, s.cramer@wzl-mq.rwth-aachen.de
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+
+from orakel.models import SensorReading
+from orakel.renderers import ArrowRenderer
+
+
+TIMESTAMP_TYPE = pa.timestamp('us', tz='UTC')
+# Columns of sensorreadings, relations are represented by their id.
+READING_TYPES = {'id': pa.int64(), 'date': TIMESTAMP_TYPE, 'value': pa.float64(), 'sensor': pa.int64(), 'processstep': pa.int64(),
+                 'processparameter': pa.int64(), 'qualitycharacteristics': pa.int64()}
+READING_FIELDS = ('id', 'date', 'value', 'sensor', 'processstep', 'processparameter', 'qualitycharacteristics')
+
+
+def columnar_requested(request):
+    """Whether the response data of a request is rendered as columnar arrays.
+
+    Args:
+        request (Request): Request after the content negotiation.
+
+    Returns:
+        [bool]: True if the ArrowRenderer was selected by the Accept header or ?format=arrow.
+    """
+    return isinstance(getattr(request, 'accepted_renderer', None), ArrowRenderer)
+
+
+def reading_table(readings, fields=READING_FIELDS):
+    """Sensorreadings as columns, the serializer is not used.
+
+    Args:
+        readings (iterable[SensorReading]): Sensorreadings, e.g. a page.
+        fields (list[str], optional): Columns of READING_TYPES. Defaults to READING_FIELDS.
+
+    Returns:
+        [pa.Table]: Ids of the sensorreadings and relations (int64), dates (timestamp[us, UTC]) and values (float64).
+    """
+    readings = list(readings)
+    attnames = [SensorReading._meta.get_field(field).attname for field in fields]
+    return pa.table({field: pa.array([getattr(reading, attname) for reading in readings], type=READING_TYPES[field]) for field, attname in zip(fields, attnames)})
+
+
+def points_table(times, values):
+    """Dates and values of sensorreadings, e.g. of downsampled_points.
+
+    Args:
+        times (np.ndarray): int64 microseconds since the epoch.
+        values (np.ndarray): float64 values.
+
+    Returns:
+        [pa.Table]: Dates (timestamp[us, UTC]) and values (float64).
+    """
+    return pa.table({'date': pa.array(np.asarray(times, dtype=np.int64), type=pa.int64()).cast(TIMESTAMP_TYPE), 'value': pa.array(np.asarray(values, dtype=np.float64))})
+
+
+def time_series_table(dates, values):
+    """Dates and values of a time series, e.g. of aggregated time windows.
+
+    Args:
+        dates (np.ndarray or pd.DatetimeIndex): datetime64[us] dates in UTC or timezone aware timestamps.
+        values (dict[str, np.ndarray]): float64 values per aggregation function or column, NaN becomes null.
+
+    Returns:
+        [pa.Table]: Dates (timestamp[us, UTC]) and a column 'value' with the single function or a column 'value.<function>' per function.
+    """
+    if isinstance(dates, pd.DatetimeIndex):
+        dates = dates.tz_convert('UTC').tz_localize(None)
+    times = np.asarray(dates, dtype='datetime64[us]').astype(np.int64)
+    columns = {'date': pa.array(times, type=pa.int64()).cast(TIMESTAMP_TYPE)}
+    for function, array in values.items():
+        columns['value' if len(values) == 1 else 'value.' + function] = pa.array(np.asarray(array, dtype=np.float64), from_pandas=True)
+    return pa.table(columns)
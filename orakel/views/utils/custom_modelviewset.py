@@ -7,6 +7,9 @@ from django.db.models.query import QuerySet
 
 from Users.Permissions import UserHasRoles
 
+from orakel.renderers import ArrowRenderer
+from orakel.views.utils.pagination import KeysetPagination
+
 
 
 class CustomModelViewSet(viewsets.ModelViewSet):
@@ -22,6 +25,8 @@ class CustomModelViewSet(viewsets.ModelViewSet):
     http_method_names = ['get', 'post', 'head', 'patch', 'delete']
     read_roles = ['GET', 'HEAD', 'OPTIONS']
     full_roles = ['GET', 'HEAD', 'OPTIONS', 'POST', 'PATCH', 'DELETE']
+    # Actions whose response data can be rendered as columnar arrays with the ArrowRenderer.
+    columnar_actions = ()
 
     def get_serializer_context(self):
         """Provide the database argument from the url to the serializer context.
@@ -52,3 +57,25 @@ class CustomModelViewSet(viewsets.ModelViewSet):
             queryset = queryset.all()
 
         return queryset
+
+    @property
+    def paginator(self):
+        """The paginator instance associated with the view, or `None`.
+        Requests with the cursor or the pagination=cursor parameter use keyset pagination, so deep pages cost the same as the first page.
+        """
+        if not hasattr(self, '_paginator'):
+            if self.pagination_class is not None and KeysetPagination.requested(self.request):
+                self._paginator = KeysetPagination()
+            else:
+                return super().paginator
+        return self._paginator
+
+    def get_renderers(self):
+        """Renderers of the action, the columnar actions can also be rendered as Apache Arrow IPC stream (Accept header application/vnd.apache.arrow.stream or ?format=arrow).
+        Returns:
+            [list]: Renderer instances.
+        """
+        renderers = super().get_renderers()
+        if getattr(self, 'action', None) in self.columnar_actions:
+            renderers.append(ArrowRenderer())
+        return renderers
@@ -0,0 +1,174 @@
+# Copyright (c) 2022 RWTH Aachen - Werkzeugmaschinenlabor (WZL)
+# Contact: Simon Cramer, s.cramer@wzl-mq.rwth-aachen.de
+
+import datetime
+
+import numpy as np
+
+from more_itertools import chunked
+
+from orakel.models.basic.sensorreadingrollup import EPOCH
+from orakel.models.utils import TimeBucket
+
+
+def lttb(x, y, n_out):
+    """Largest-triangle-three-buckets downsampling. The first and the last point are kept, the inner points are split into n_out - 2 buckets of equal size
+    and the point that forms the largest triangle with the previously selected point and the average of the next bucket is selected from each bucket.
+
+    Args:
+        x (np.ndarray): Sorted x values, e.g. timestamps.
+        y (np.ndarray): float64 y values, same length as x.
+        n_out (int): Amount of selected points, at least 3.
+
+    Returns:
+        [np.ndarray]: Sorted indices of the selected points.
+    """
+    n = x.shape[0]
+    if n <= n_out:
+        return np.arange(n)
+    # Shift the x values to the first point, large timestamps lose precision in the products otherwise.
+    x = (x - x[0]).astype(np.float64)
+
+    edges = np.linspace(1, n - 1, n_out - 1).astype(np.int64)
+    starts, ends = edges[:-1], edges[1:]
+    # The average of the following bucket is the third corner of the triangles, the last point follows the last bucket.
+    next_x = np.append((np.add.reduceat(x[:-1], starts) / (ends - starts))[1:], x[-1])
+    next_y = np.append((np.add.reduceat(y[:-1], starts) / (ends - starts))[1:], y[-1])
+
+    selected = np.empty(n_out, dtype=np.int64)
+    selected[0], selected[-1] = 0, n - 1
+    previous = 0
+    for i in range(n_out - 2):
+        start, end = starts[i], ends[i]
+        area = np.abs((x[previous] - next_x[i]) * (y[start:end] - y[previous]) - (x[previous] - x[start:end]) * (next_y[i] - y[previous]))
+        previous = start + int(np.argmax(area))
+        selected[i + 1] = previous
+
+    return selected
+
+
+def min_max(x, y, n_out):
+    """Min/max envelope downsampling. The points are split into buckets of equal size and the minimum and the maximum of each bucket are selected,
+    the first and the last point are kept.
+
+    Args:
+        x (np.ndarray): Sorted x values, e.g. timestamps.
+        y (np.ndarray): float64 y values, same length as x.
+        n_out (int): Maximum amount of selected points, at least 3.
+
+    Returns:
+        [np.ndarray]: Sorted indices of the selected points.
+    """
+    n = x.shape[0]
+    if n <= n_out:
+        return np.arange(n)
+    size = -(-n // max((n_out - 2) // 2, 1))
+    n_buckets = -(-n // size)
+    offsets = np.arange(n_buckets) * size
+    padding = n_buckets * size - n
+    minimum = offsets + np.pad(y, (0, padding), constant_values=np.inf).reshape(n_buckets, size).argmin(axis=1)
+    maximum = offsets + np.pad(y, (0, padding), constant_values=-np.inf).reshape(n_buckets, size).argmax(axis=1)
+
+    return np.unique(np.concatenate(([0, n - 1], minimum, maximum)))
+
+
+DOWNSAMPLING_METHODS = {'lttb': lttb, 'minmax': min_max}
+
+
+def downsample(x, y, max_points, method='lttb'):
+    """Select at most max_points points that preserve the shape of the series.
+
+    Args:
+        x (np.ndarray): Sorted x values, e.g. timestamps.
+        y (np.ndarray): y values, same length as x. Points with NaN values are dropped.
+        max_points (int): Maximum amount of selected points, at least 3.
+        method (str, optional): One of DOWNSAMPLING_METHODS. Defaults to 'lttb'.
+
+    Returns:
+        [np.ndarray]: Sorted indices of the selected points.
+    """
+    y = np.asarray(y, dtype=np.float64)
+    valid = np.flatnonzero(~np.isnan(y))
+    return valid[DOWNSAMPLING_METHODS[method](np.asarray(x)[valid], y[valid], max_points)]
+
+
+def read_points(queryset, chunk_size=100000):
+    """Stream the dates and values of sensorreadings ordered by date into arrays. The dates are converted to integers in the database,
+    the rows are fetched in chunks with a server side cursor where the database supports it.
+
+    Args:
+        queryset (QuerySet): SensorReading queryset.
+        chunk_size (int, optional): Amount of rows per chunk. Defaults to 100000.
+
+    Returns:
+        [np.ndarray]: int64 microseconds since the epoch.
+        [np.ndarray]: float64 values.
+    """
+    rows = queryset.filter(date__isnull=False, value__isnull=False).annotate(
+        epoch_us=TimeBucket('date', EPOCH, datetime.timedelta(microseconds=1))).order_by('date').values_list('epoch_us', 'value').iterator(chunk_size=chunk_size)
+    times, values = [np.empty(0, dtype=np.int64)], [np.empty(0, dtype=np.float64)]
+    for chunk in chunked(rows, chunk_size):
+        chunk_times, chunk_values = zip(*chunk)
+        times.append(np.fromiter(chunk_times, dtype=np.int64, count=len(chunk)))
+        values.append(np.fromiter(chunk_values, dtype=np.float64, count=len(chunk)))
+
+    return np.concatenate(times), np.concatenate(values)
+
+
+def downsampled_points(queryset, max_points, method='lttb'):
+    """Downsampled dates and values of sensorreadings as arrays.
+
+    Args:
+        queryset (QuerySet): SensorReading queryset.
+        max_points (int): Maximum amount of returned sensorreadings, at least 3.
+        method (str, optional): One of DOWNSAMPLING_METHODS. Defaults to 'lttb'.
+
+    Returns:
+        [np.ndarray]: int64 microseconds since the epoch of the selected sensorreadings ordered by date.
+        [np.ndarray]: float64 values.
+    """
+    times, values = read_points(queryset)
+    index = downsample(times, values, max_points, method)
+
+    return times[index], values[index]
+
+
+def downsampled_readings(queryset, max_points, method='lttb'):
+    """Downsampled dates and values of sensorreadings.
+
+    Args:
+        queryset (QuerySet): SensorReading queryset.
+        max_points (int): Maximum amount of returned sensorreadings, at least 3.
+        method (str, optional): One of DOWNSAMPLING_METHODS. Defaults to 'lttb'.
+
+    Returns:
+        [list[dict]]: Date ('date') and value ('value') of the selected sensorreadings ordered by date.
+    """
+    times, values = downsampled_points(queryset, max_points, method)
+
+    return [{'date': EPOCH + datetime.timedelta(microseconds=int(time)), 'value': float(value)} for time, value in zip(times, values)]
+
+
+def downsampling_parameters(query_params):
+    """Read the downsampling parameters of a request.
+
+    Args:
+        query_params (QueryDict): Query parameters with the optional max_points (int, at least 3) and downsampling (one of DOWNSAMPLING_METHODS, defaults to lttb).
+
+    Raises:
+        ValueError: The parameters are not supported.
+
+    Returns:
+        [int]: Maximum amount of returned points, None if the points are not downsampled.
+        [str]: Downsampling method.
+    """
+    max_points = query_params.get("max_points", None)
+    method = query_params.get("downsampling", "lttb")
+    if method not in DOWNSAMPLING_METHODS:
+        raise ValueError("The provided downsampling method is not supported. Supported: {}.".format(", ".join(DOWNSAMPLING_METHODS)))
+    if max_points is not None:
+        if not max_points.isdigit() or int(max_points) < 3:
+            raise ValueError("max_points has to be an integer of at least 3.")
+        max_points = int(max_points)
+
+    return max_points, method
@@ -0,0 +1,260 @@
+# Copyright (c) 2022 RWTH Aachen - Werkzeugmaschinenlabor (WZL)
+# Contact: Simon Cramer, s.cramer@wzl-mq.rwth-aachen.de
+
+import base64
+import binascii
+import datetime
+import json
+from collections import OrderedDict
+
+from django.core.exceptions import FieldDoesNotExist
+from django.db.models import Q
+from rest_framework import pagination
+from rest_framework.exceptions import NotFound
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+
+def link_header(next_url, previous_url):
+    """Link header of the next and the previous page.
+
+    Args:
+        next_url (str): Url of the next page or None.
+        previous_url (str): Url of the previous page or None.
+
+    Returns:
+        [str]: Link header, empty if there is no other page.
+    """
+    if next_url is not None and previous_url is not None:
+        link = '<{next_url}>; rel="next", <{previous_url}>; rel="prev"'
+    elif next_url is not None:
+        link = '<{next_url}>; rel="next"'
+    elif previous_url is not None:
+        link = '<{previous_url}>; rel="prev"'
+    else:
+        link = ''
+
+    return link.format(next_url=next_url, previous_url=previous_url)
+
+
+# pagination for list of dictionaries
+class LinkHeaderPagination(pagination.PageNumberPagination):
+    page_size_query_param = 'page_size'
+
+    def get_paginated_response(self, data):
+        link = link_header(self.get_next_link(), self.get_previous_link())
+        headers = {'Link': link, 'Count': self.page.paginator.count} if link else {}
+
+        return Response(data, headers=headers)
+
+
+class KeysetPagination(pagination.BasePagination):
+    """Cursor pagination that selects the rows after the key of the last row of the previous page, e.g. WHERE (date, id) > (last date, last id), instead of an OFFSET.
+    No COUNT is run, so deep pages cost the same as the first page. The cursors in the next and previous links are opaque.
+    Clients opt in with the query parameter pagination=cursor, the links keep the cursor parameter.
+
+    The ordering is taken from the queryset, the primary key is appended to make the key unique. Grouped querysets have to be ordered by unique fields.
+    Rows with NULL in a nullable ordering field can not be compared and are not part of the pages.
+    Lists are paginated by position.
+    """
+    page_size = api_settings.PAGE_SIZE
+    page_size_query_param = 'page_size'
+    cursor_query_param = 'cursor'
+    invalid_cursor_message = 'Invalid cursor'
+
+    @staticmethod
+    def requested(request):
+        """Whether the request opts in to cursor pagination.
+
+        Args:
+            request (Request): Request of the list.
+
+        Returns:
+            [bool]: True if the cursor or the pagination=cursor parameter is given.
+        """
+        return request.query_params.get('pagination') == 'cursor' or KeysetPagination.cursor_query_param in request.query_params
+
+    def get_page_size(self, request):
+        try:
+            page_size = int(request.query_params[self.page_size_query_param])
+            if page_size > 0:
+                return page_size
+        except (KeyError, ValueError):
+            pass
+        return self.page_size
+
+    @staticmethod
+    def get_ordering(queryset):
+        """Unique ordering of a queryset.
+
+        Args:
+            queryset (QuerySet): Ordered queryset.
+
+        Returns:
+            [list[str]]: Field names, descending fields start with '-'.
+        """
+        ordering = [field for field in (queryset.query.order_by or queryset.model._meta.ordering) if isinstance(field, str)]
+        if queryset.query.group_by is None and not any(field.lstrip('-') in ('pk', queryset.model._meta.pk.name) for field in ordering):
+            ordering.append('-pk' if ordering and ordering[-1].startswith('-') else 'pk')
+        return ordering
+
+    def encode_cursor(self, key, reverse):
+        data = json.dumps({'k': [value.isoformat() if isinstance(value, datetime.datetime) else value for value in key], 'r': int(reverse)})
+        return base64.urlsafe_b64encode(data.encode('ascii')).decode('ascii')
+
+    def decode_cursor(self, request):
+        """Key and direction of the cursor of the request.
+
+        Returns:
+            [list]: Key of the row before the page, None without a cursor.
+            [bool]: True if the page lies before the key.
+        """
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None, False
+        try:
+            data = json.loads(base64.urlsafe_b64decode(encoded.encode('ascii')).decode('ascii'))
+            return list(data['k']), bool(data['r'])
+        except (binascii.Error, UnicodeError, ValueError, TypeError, KeyError):
+            raise NotFound(self.invalid_cursor_message)
+
+    @staticmethod
+    def keyset_filter(ordering, key, reverse):
+        """Filter the rows after the key in the direction of the ordering, before the key if reverse.
+
+        Args:
+            ordering (list[str]): Field names, descending fields start with '-'.
+            key (list): Values of the fields.
+            reverse (bool): Select the rows before the key.
+
+        Returns:
+            [Q]: (f1 > v1) OR (f1 = v1 AND f2 > v2) OR ...
+        """
+        keyset = Q()
+        for i, field in enumerate(ordering):
+            descending = field.startswith('-') != reverse
+            condition = Q(**{'{}__{}'.format(field.lstrip('-'), 'lt' if descending else 'gt'): key[i]})
+            for previous_field, previous_value in zip(ordering[:i], key[:i]):
+                condition &= Q(**{previous_field.lstrip('-'): previous_value})
+            keyset |= condition
+        return keyset
+
+    @staticmethod
+    def row_key(row, ordering):
+        fields = [field.lstrip('-') for field in ordering]
+        if isinstance(row, dict):
+            return [row[field] for field in fields]
+        return [getattr(row, field) for field in fields]
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        page_size = self.get_page_size(request)
+        key, reverse = self.decode_cursor(request)
+        if not hasattr(queryset, 'query'):
+            return self.paginate_list(list(queryset), page_size, key, reverse)
+
+        ordering = self.get_ordering(queryset)
+        if key is not None and len(key) != len(ordering):
+            raise NotFound(self.invalid_cursor_message)
+        for field in ordering:
+            try:
+                if queryset.model._meta.get_field(field.lstrip('-')).null:
+                    queryset = queryset.filter(**{field.lstrip('-') + '__isnull': False})
+            except FieldDoesNotExist:
+                pass
+        if key is not None:
+            queryset = queryset.filter(self.keyset_filter(ordering, key, reverse))
+        if reverse:
+            queryset = queryset.order_by(*[field[1:] if field.startswith('-') else '-' + field for field in ordering])
+        else:
+            queryset = queryset.order_by(*ordering)
+
+        # Fetch one additional row to know whether there is another page in this direction.
+        rows = list(queryset[:page_size + 1])
+        has_more = len(rows) > page_size
+        rows = rows[:page_size]
+        if reverse:
+            rows.reverse()
+        self.set_links(rows, [self.row_key(row, ordering) for row in (rows[:1] + rows[-1:])], key, reverse, has_more)
+        return rows
+
+    def paginate_list(self, data, page_size, key, reverse):
+        """Paginate a list by position, the key is the position of the row before (after if reverse) the page."""
+        if key is not None and (len(key) != 1 or not isinstance(key[0], int)):
+            raise NotFound(self.invalid_cursor_message)
+        if key is None:
+            start = 0
+        elif reverse:
+            start = max(key[0] - page_size, 0)
+        else:
+            start = key[0] + 1
+        end = min(key[0], start + page_size) if key is not None and reverse else start + page_size
+        rows = data[start:end]
+        has_more = start > 0 if reverse else end < len(data)
+        self.set_links(rows, [[start], [start + len(rows) - 1]], key, reverse, has_more)
+        return rows
+
+    def set_links(self, rows, keys, key, reverse, has_more):
+        """Cursors of the next and the previous page.
+
+        Args:
+            rows (list): Rows of the page.
+            keys (list[list]): Keys of the first and the last row of the page.
+            key (list): Key of the cursor of the request, None on the first page.
+            reverse (bool): The page was selected before the key.
+            has_more (bool): There are rows after the page in the direction of the request.
+        """
+        self.next_cursor = self.previous_cursor = None
+        if not rows:
+            return
+        first_key, last_key = keys[0], keys[-1]
+        if reverse:
+            self.previous_cursor = self.encode_cursor(first_key, True) if has_more else None
+            self.next_cursor = self.encode_cursor(last_key, False)
+        else:
+            self.next_cursor = self.encode_cursor(last_key, False) if has_more else None
+            self.previous_cursor = self.encode_cursor(first_key, True) if key is not None else None
+
+    def get_link(self, cursor):
+        if cursor is None:
+            return None
+        url = self.request.build_absolute_uri()
+        url = replace_query_param(url, self.cursor_query_param, cursor)
+        return remove_query_param(url, 'pagination')
+
+    def get_next_link(self):
+        return self.get_link(self.next_cursor)
+
+    def get_previous_link(self):
+        return self.get_link(self.previous_cursor)
+
+    def get_paginated_response(self, data):
+        return Response(OrderedDict([
+            ('next', self.get_next_link()),
+            ('previous', self.get_previous_link()),
+            ('results', data)
+        ]))
+
+    def get_results(self, data):
+        return data['results']
+
+
+class LinkHeaderKeysetPagination(KeysetPagination):
+    """Keyset pagination for lists of dictionaries with the links in the Link header like LinkHeaderPagination."""
+
+    def get_paginated_response(self, data):
+        link = link_header(self.get_next_link(), self.get_previous_link())
+        return Response(data, headers={'Link': link} if link else {})
+
+
+def list_paginator(request):
+    """Paginator for lists of dictionaries, keyset pagination if the request opts in.
+
+    Args:
+        request (Request): Request of the list.
+
+    Returns:
+        [LinkHeaderPagination or LinkHeaderKeysetPagination]: Paginator.
+    """
+    return LinkHeaderKeysetPagination() if KeysetPagination.requested(request) else LinkHeaderPagination()
@@ -271,6 +271,9 @@ CELERY_BEAT_SCHEDULER = "django_celery_beat.schedulers:DatabaseScheduler"
 
 FLOWER_URL = os.environ.get("FLOWER_URL", "http://localhost:5555/")
 
+# Compute Min, Max, Avg, StdDev, Count, Range and RMS features of dataframes from the SensorReadingSummary instances. Set to "false" to aggregate the sensorreadings.
+DATAFRAME_USE_SENSORREADING_SUMMARY = os.environ.get("DATAFRAME_USE_SENSORREADING_SUMMARY", "true").lower() != "false"
+
 from job_scheduler.periodic_task import periodic_tasks
 
 CELERY_BEAT_SCHEDULE = periodic_tasks